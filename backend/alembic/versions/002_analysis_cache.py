@@ -0,0 +1,40 @@
+"""Add analysis_cache table for content-addressed AI results
+
+Revision ID: 002_analysis_cache
+Revises: 001_initial
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '002_analysis_cache'
+down_revision = '001_initial'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    if 'analysis_cache' not in existing_tables:
+        op.create_table(
+            'analysis_cache',
+            sa.Column('key', sa.String(), nullable=False),
+            sa.Column('image_sha256', sa.String(), nullable=False),
+            sa.Column('prompt_version', sa.String(), nullable=False),
+            sa.Column('result', sa.Text(), nullable=False),
+            sa.Column('hits', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+            sa.Column('last_used_at', sa.DateTime(timezone=True), nullable=False),
+            sa.PrimaryKeyConstraint('key')
+        )
+        op.create_index('ix_analysis_cache_prompt_version', 'analysis_cache', ['prompt_version'], unique=False)
+        op.create_index('ix_analysis_cache_created_at', 'analysis_cache', ['created_at'], unique=False)
+        op.create_index('ix_analysis_cache_last_used_at', 'analysis_cache', ['last_used_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_table('analysis_cache')
@@ -0,0 +1,44 @@
+"""Add scan_jobs table for the accept-then-process scan pipeline
+
+Revision ID: 003_scan_jobs
+Revises: 002_analysis_cache
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '003_scan_jobs'
+down_revision = '002_analysis_cache'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    if 'scan_jobs' not in existing_tables:
+        op.create_table(
+            'scan_jobs',
+            sa.Column('id', sa.String(), nullable=False),
+            sa.Column('status', sa.String(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('filename', sa.String(), nullable=False),
+            sa.Column('original_filename', sa.String(), nullable=True),
+            sa.Column('image_sha256', sa.String(), nullable=False),
+            sa.Column('scan_id', sa.Integer(), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('attempts', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+            sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+            sa.ForeignKeyConstraint(['scan_id'], ['scans.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_scan_jobs_status', 'scan_jobs', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_table('scan_jobs')
@@ -0,0 +1,32 @@
+"""Composite indexes for keyset pagination of doctor case lists
+
+Revision ID: 004_scan_list_indexes
+Revises: 003_scan_jobs
+Create Date: 2026-10-18
+"""
+from alembic import op
+from sqlalchemy import inspect
+
+revision = '004_scan_list_indexes'
+down_revision = '003_scan_jobs'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_scans_created_at_id': ['created_at', 'id'],
+    'ix_scans_severity_created_at': ['severity', 'created_at'],
+    'ix_scans_assigned_to_created_at': ['assigned_to', 'created_at'],
+}
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    existing = {ix['name'] for ix in inspect(bind).get_indexes('scans')}
+    for name, columns in INDEXES.items():
+        if name not in existing:
+            op.create_index(name, 'scans', columns, unique=False)
+
+
+def downgrade() -> None:
+    for name in INDEXES:
+        op.drop_index(name, table_name='scans')
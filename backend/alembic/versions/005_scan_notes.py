@@ -0,0 +1,77 @@
+"""Move case notes from scans.notes into an append-only scan_notes table
+
+Revision ID: 005_scan_notes
+Revises: 004_scan_list_indexes
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '005_scan_notes'
+down_revision = '004_scan_list_indexes'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+scans = sa.table(
+    'scans',
+    sa.column('id', sa.Integer),
+    sa.column('notes', sa.Text),
+    sa.column('created_at', sa.DateTime),
+)
+scan_notes = sa.table(
+    'scan_notes',
+    sa.column('scan_id', sa.Integer),
+    sa.column('author_id', sa.Integer),
+    sa.column('body', sa.Text),
+    sa.column('created_at', sa.DateTime),
+)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    if 'scan_notes' not in existing_tables:
+        op.create_table(
+            'scan_notes',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('scan_id', sa.Integer(), nullable=False),
+            sa.Column('author_id', sa.Integer(), nullable=True),
+            sa.Column('body', sa.Text(), nullable=False),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.ForeignKeyConstraint(['scan_id'], ['scans.id']),
+            sa.ForeignKeyConstraint(['author_id'], ['users.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_scan_notes_scan_id_id', 'scan_notes', ['scan_id', 'id'], unique=False)
+
+    # Split the old newline-joined notes into one row per note, in id order and in batches.
+    # The legacy scans.notes column is left in place (no longer written).
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(scans.c.id, scans.c.notes, scans.c.created_at)
+            .where(scans.c.id > last_id)
+            .where(scans.c.notes.isnot(None))
+            .order_by(scans.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        values = [
+            {"scan_id": scan_id, "author_id": None, "body": line.strip(), "created_at": created_at}
+            for scan_id, notes, created_at in rows
+            for line in notes.split("\n")
+            if line.strip()
+        ]
+        if values:
+            bind.execute(scan_notes.insert(), values)
+        last_id = rows[-1][0]
+
+
+def downgrade() -> None:
+    op.drop_table('scan_notes')
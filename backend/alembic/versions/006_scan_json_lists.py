@@ -0,0 +1,74 @@
+"""Store scans.steps and scans.warnings as JSON lists instead of pipe-joined text
+
+Revision ID: 006_scan_json_lists
+Revises: 005_scan_notes
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '006_scan_json_lists'
+down_revision = '005_scan_notes'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+COLUMNS = ('steps', 'warnings')
+
+JsonList = sa.JSON(none_as_null=True).with_variant(postgresql.JSONB(none_as_null=True), 'postgresql')
+
+
+def _convert(source_type, target_type, transform) -> None:
+    """Copy every column in COLUMNS into `<name>_new`, id-ordered in batches."""
+    bind = op.get_bind()
+    for name in COLUMNS:
+        op.add_column('scans', sa.Column(f'{name}_new', target_type, nullable=True))
+
+    scans = sa.table(
+        'scans',
+        sa.column('id', sa.Integer),
+        *[sa.column(name, source_type) for name in COLUMNS],
+        *[sa.column(f'{name}_new', target_type) for name in COLUMNS],
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(scans.c.id, *[scans.c[name] for name in COLUMNS])
+            .where(scans.c.id > last_id)
+            .order_by(scans.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            scans.update()
+            .where(scans.c.id == sa.bindparam('_id'))
+            .values({f'{name}_new': sa.bindparam(f'_{name}') for name in COLUMNS}),
+            [
+                {'_id': row[0], **{f'_{name}': transform(value) for name, value in zip(COLUMNS, row[1:])}}
+                for row in rows
+            ],
+        )
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table('scans') as batch:
+        for name in COLUMNS:
+            batch.drop_column(name)
+            batch.alter_column(f'{name}_new', new_column_name=name)
+
+
+def _split(value):
+    return [item for item in value.split('|') if item] if value else None
+
+
+def _join(value):
+    return '|'.join(value) if value else None
+
+
+def upgrade() -> None:
+    _convert(sa.Text, JsonList, _split)
+
+
+def downgrade() -> None:
+    _convert(JsonList, sa.Text, _join)
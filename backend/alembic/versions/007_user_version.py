@@ -0,0 +1,25 @@
+"""Add users.version for profile ETags and cache validation
+
+Revision ID: 007_user_version
+Revises: 006_scan_json_lists
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '007_user_version'
+down_revision = '006_scan_json_lists'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    columns = {c['name'] for c in inspect(op.get_bind()).get_columns('users')}
+    if 'version' not in columns:
+        op.add_column('users', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch:
+        batch.drop_column('version')
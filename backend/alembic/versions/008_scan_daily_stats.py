@@ -0,0 +1,50 @@
+"""Add the scan_daily_stats rollup and backfill it from scans
+
+Revision ID: 008_scan_daily_stats
+Revises: 007_user_version
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '008_scan_daily_stats'
+down_revision = '007_user_version'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if 'scan_daily_stats' in inspect(bind).get_table_names():
+        return
+
+    op.create_table(
+        'scan_daily_stats',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('severity', sa.String(), nullable=False),
+        sa.Column('condition', sa.String(), nullable=False),
+        sa.Column('scans', sa.Integer(), nullable=False),
+        sa.Column('confidence_sum', sa.Float(), nullable=False),
+        sa.Column('confidence_count', sa.Integer(), nullable=False),
+        sa.Column('unassigned', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'severity', 'condition')
+    )
+
+    # one GROUP BY over scans; the app keeps the table current from here on
+    if bind.dialect.name == 'postgresql':
+        day = "CAST(timezone('UTC', created_at) AS DATE)"
+    else:
+        day = "date(created_at)"
+    op.execute(f"""
+        INSERT INTO scan_daily_stats (day, severity, condition, scans, confidence_sum, confidence_count, unassigned)
+        SELECT {day}, coalesce(severity, ''), coalesce(condition, ''), count(*),
+               coalesce(sum(confidence), 0), count(confidence),
+               sum(CASE WHEN assigned_to IS NULL THEN 1 ELSE 0 END)
+        FROM scans
+        GROUP BY {day}, coalesce(severity, ''), coalesce(condition, '')
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('scan_daily_stats')
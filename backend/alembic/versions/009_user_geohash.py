@@ -0,0 +1,59 @@
+"""Add an indexed users.geohash for proximity queries, backfilled from lat/lng
+
+Revision ID: 009_user_geohash
+Revises: 008_scan_daily_stats
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+from app.geo import encode
+
+revision = '009_user_geohash'
+down_revision = '008_scan_daily_stats'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+users = sa.table(
+    'users',
+    sa.column('id', sa.Integer),
+    sa.column('location_lat', sa.Float),
+    sa.column('location_lng', sa.Float),
+    sa.column('geohash', sa.String),
+)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    columns = {c['name'] for c in inspector.get_columns('users')}
+    if 'geohash' not in columns:
+        op.add_column('users', sa.Column('geohash', sa.String(length=12), nullable=True))
+    indexes = {i['name'] for i in inspector.get_indexes('users')}
+    if 'ix_users_geohash' not in indexes:
+        op.create_index('ix_users_geohash', 'users', ['geohash'], unique=False)
+
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(users.c.id, users.c.location_lat, users.c.location_lng)
+            .where(users.c.id > last_id)
+            .where(users.c.location_lat.isnot(None))
+            .where(users.c.location_lng.isnot(None))
+            .order_by(users.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for user_id, lat, lng in rows:
+            if -90 <= lat <= 90 and -180 <= lng <= 180:
+                bind.execute(users.update().where(users.c.id == user_id).values(geohash=encode(lat, lng)))
+        last_id = rows[-1][0]
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_geohash', table_name='users')
+    with op.batch_alter_table('users') as batch:
+        batch.drop_column('geohash')
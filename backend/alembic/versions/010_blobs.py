@@ -0,0 +1,51 @@
+"""Add the content-addressed blobs table and scans.blob_sha256
+
+Revision ID: 010_blobs
+Revises: 009_user_geohash
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '010_blobs'
+down_revision = '009_user_geohash'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    if 'blobs' not in inspector.get_table_names():
+        op.create_table(
+            'blobs',
+            sa.Column('sha256', sa.String(length=64), nullable=False),
+            sa.Column('size', sa.Integer(), nullable=False),
+            sa.Column('content_type', sa.String(), nullable=True),
+            sa.Column('refcount', sa.Integer(), nullable=False),
+            sa.Column('local', sa.Boolean(), nullable=False),
+            sa.Column('s3_key', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column('last_seen_at', sa.DateTime(timezone=True), nullable=False),
+            sa.PrimaryKeyConstraint('sha256')
+        )
+        op.create_index('ix_blobs_refcount_last_seen_at', 'blobs', ['refcount', 'last_seen_at'], unique=False)
+        op.create_index('ix_blobs_local_last_seen_at', 'blobs', ['local', 'last_seen_at'], unique=False)
+
+    # existing uploads keep their flat filenames until `python -m app.lifecycle --adopt-legacy`
+    columns = {c['name'] for c in inspector.get_columns('scans')}
+    if 'blob_sha256' not in columns:
+        op.add_column('scans', sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+    indexes = {i['name'] for i in inspector.get_indexes('scans')}
+    if 'ix_scans_blob_sha256' not in indexes:
+        op.create_index('ix_scans_blob_sha256', 'scans', ['blob_sha256'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_scans_blob_sha256', table_name='scans')
+    with op.batch_alter_table('scans') as batch:
+        batch.drop_column('blob_sha256')
+    op.drop_index('ix_blobs_local_last_seen_at', table_name='blobs')
+    op.drop_index('ix_blobs_refcount_last_seen_at', table_name='blobs')
+    op.drop_table('blobs')
@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import get_async_db, pool_stats
+from app import ai_client, ai_providers, events, lifecycle, models, jobs, preprocess, read_cache, result_cache, thumbnails, utils
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(utils.get_current_admin_id)])
+
+@router.get("/analysis-cache")
+async def analysis_cache_stats(db: AsyncSession = Depends(get_async_db)):
+    return await result_cache.stats(db)
+
+@router.delete("/analysis-cache")
+async def invalidate_analysis_cache(all: bool = False, db: AsyncSession = Depends(get_async_db)):
+    removed = await result_cache.invalidate(db, everything=all)
+    return {"ok": True, "removed": removed}
+
+@router.get("/scan-jobs")
+async def scan_job_stats(db: AsyncSession = Depends(get_async_db)):
+    counts = dict((await db.execute(
+        select(models.ScanJob.status, func.count(models.ScanJob.id))
+        .group_by(models.ScanJob.status)
+    )).all())
+    return {**jobs.queue_stats(), "by_status": counts}
+
+@router.get("/preprocess")
+async def preprocess_stats():
+    return preprocess.stats()
+
+@router.get("/ai-limiter")
+async def ai_limiter_state():
+    return ai_client.limiter.state()
+
+@router.get("/ai-providers")
+async def ai_provider_stats():
+    return ai_providers.stats()
+
+@router.get("/db-pool")
+async def db_pool_stats():
+    return pool_stats()
+
+@router.get("/read-cache")
+async def read_cache_stats():
+    return read_cache.stats()
+
+@router.get("/case-stream")
+async def case_stream_stats():
+    return events.broadcaster.stats()
+
+@router.get("/thumbnails")
+async def thumbnail_cache_stats():
+    return thumbnails.cache.stats()
+
+@router.get("/blobs")
+async def blob_stats(db: AsyncSession = Depends(get_async_db)):
+    return await lifecycle.stats(db)
+
+@router.post("/blobs/lifecycle")
+async def run_blob_lifecycle(sweep: bool = False):
+    return await lifecycle.run_once(sweep_orphans=sweep)
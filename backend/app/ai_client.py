@@ -1,77 +1,269 @@
-import google.generativeai as genai
-import PIL.Image
+import anyio
+import functools
 import json
-import os
-import traceback
+import hashlib
+import logging
+import threading
+from app import metrics
 from app.config import settings
+from app.limiter import CallLimiter, LimiterTimeout
+from app.preprocess import prepare_image
 
-def analyze_image(file_path: str):
+logger = logging.getLogger(__name__)
+
+# Changes whenever the model, prompt or generation config changes, so cached
+# results from an older setup are never served for a new one. A configured
+# second provider (see app/ai_providers.py) can answer too, so its model counts.
+PROMPT_VERSION = hashlib.sha256(
+    "\n".join([
+        settings.GEMINI_MODEL,
+        settings.GEMINI_PROMPT,
+        str(settings.GEMINI_TEMPERATURE),
+        str(settings.GEMINI_MAX_OUTPUT_TOKENS),
+        settings.GEMINI_RESPONSE_MIME_TYPE,
+        *([f"perplexity:{settings.PERPLEXITY_MODEL}"] if settings.PERPLEXITY_API_KEY else []),
+    ]).encode()
+).hexdigest()[:16]
+
+
+class AIServiceError(Exception):
+    def __init__(self, message: str, retryable: bool = False, rate_limited: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+        self.rate_limited = rate_limited
+
+
+class AIRateLimitError(AIServiceError):
+    """Upstream quota exhausted (HTTP 429), or our own limiter is saturated."""
+
+
+@functools.lru_cache(maxsize=None)
+def _error_classes():
+    """(rate limit errors, transient errors); google.api_core is only imported once something failed."""
+    from google.api_core import exceptions as google_exceptions
+
+    rate_limit = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+    transient = (
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.BadGateway,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.DeadlineExceeded,
+        ConnectionError,
+        TimeoutError,
+    )
+    return rate_limit, transient
+
+
+def classify_error(e: Exception) -> AIServiceError:
+    if isinstance(e, AIServiceError):
+        return e
+    rate_limit_errors, transient_errors = _error_classes()
+    if isinstance(e, rate_limit_errors):
+        return AIRateLimitError(f"Gemini rate limit exceeded: {e}", retryable=True, rate_limited=True)
+    if isinstance(e, transient_errors):
+        return AIServiceError(f"Gemini unavailable: {e}", retryable=True)
+    if isinstance(e, json.JSONDecodeError):
+        return AIServiceError("Gemini returned malformed JSON", retryable=True)
+    return AIServiceError(f"Gemini request failed: {e}")
+
+
+limiter = CallLimiter(
+    rate_per_minute=settings.AI_RATE_PER_MINUTE,
+    burst=settings.AI_BURST,
+    min_concurrency=settings.AI_MIN_CONCURRENCY,
+    max_concurrency=settings.AI_MAX_CONCURRENCY,
+    max_retries=settings.AI_MAX_RETRIES,
+    backoff_base=settings.AI_BACKOFF_BASE_SECONDS,
+    backoff_max=settings.AI_BACKOFF_MAX_SECONDS,
+    acquire_timeout=settings.AI_ACQUIRE_TIMEOUT_SECONDS,
+)
+
+SAFETY_BLOCKED_RESULT = {
+    "condition": "Analysis block by AI safety filters",
+    "confidence": 0.0,
+    "severity": "MINOR",
+    "steps": ["Consult a real doctor as AI cannot analyze this image.", "Ensure the image is clear."],
+    "warnings": ["AI refused to analyze image."],
+    "fallback": True
+}
+
+
+class GeminiClient:
     """
-    Send image to Google Gemini for analysis using PIL to load the image.
-    Returns structured JSON with keys: condition, confidence, severity, steps, warnings.
+    Long-lived Gemini client. genai.configure() and the GenerativeModel are set
+    up once, so the underlying gRPC channels stay open between scans instead of
+    being rebuilt (and re-handshaken) on every request. The SDK itself (close
+    to a second of imports) is loaded here, on first use, not at startup.
     """
-    print(f"Analyzing image at: {file_path}")
-    
-    if not settings.GEMINI_API_KEY:
-        print("ERROR: GEMINI_API_KEY is not set.")
-        raise ValueError("GEMINI_API_KEY is not set.")
 
-    try:
+    def __init__(self):
+        if not settings.GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY is not set.")
+        import google.generativeai as genai
+
         genai.configure(api_key=settings.GEMINI_API_KEY)
-        
-        # Use gemini-2.5-flash which is the model available for this API key
-        print("Using model: gemini-2.5-flash")
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model = genai.GenerativeModel(
+            settings.GEMINI_MODEL,
+            generation_config=genai.GenerationConfig(
+                temperature=settings.GEMINI_TEMPERATURE,
+                max_output_tokens=settings.GEMINI_MAX_OUTPUT_TOKENS,
+                response_mime_type=settings.GEMINI_RESPONSE_MIME_TYPE or None,
+            ),
+        )
 
+    def _image_part(self, file_path: str):
+        if settings.AI_IMAGE_PREPROCESS:
+            # Send a downsized, metadata-free JPEG; the original stays on disk for storage
+            data, info = prepare_image(file_path)
+            logger.debug(
+                "Preprocessed %s: %s -> %s bytes (%s saved, %sx%s) in %s ms",
+                file_path, info["original_bytes"], info["processed_bytes"],
+                info["bytes_saved"], info["width"], info["height"], info["ms"],
+            )
+            return {"mime_type": "image/jpeg", "data": data}
         # Load image using PIL (bypasses upload_file issues)
-        print("Loading image with PIL...")
-        img = PIL.Image.open(file_path)
-        
-        prompt = """
-        You are a dermatologist AI. Analyze the image and provide a JSON response with the following fields:
-        - condition: (string) The name of the skin condition (e.g., Eczema, Psoriasis, Acne, Burn).
-        - confidence: (number) Confidence score between 0 and 100.
-        - severity: (string) One of ["MINOR", "MODERATE", "URGENT"].
-        - steps: (list of strings) First aid or care steps.
-        - warnings: (list of strings) Warning signs to watch for.
-        
-        Return ONLY raw JSON, no markdown formatting.
-        """
-
-        print("Sending request to Gemini...")
-        response = model.generate_content([prompt, img])
-        print("Response received from Gemini.")
-        
+        import PIL.Image
+
+        return PIL.Image.open(file_path)
+
+    def analyze(self, file_path: str) -> dict:
+        response = self.model.generate_content([settings.GEMINI_PROMPT, self._image_part(file_path)])
+        return parse_response(response)
+
+    async def analyze_async(self, file_path: str) -> dict:
+        with metrics.span("ai_preprocess"):
+            image = await anyio.to_thread.run_sync(self._image_part, file_path)
+        with metrics.span("ai_request"):
+            response = await self.model.generate_content_async([settings.GEMINI_PROMPT, image])
+        with metrics.span("ai_parse"):
+            return parse_response(response)
+
+    async def analyze_many_async(self, file_paths: list) -> dict:
+        with metrics.span("ai_preprocess"):
+            images = [await anyio.to_thread.run_sync(self._image_part, p) for p in file_paths]
+        prompt = settings.GEMINI_PROMPT + settings.GEMINI_MULTI_IMAGE_NOTE
+        with metrics.span("ai_request"):
+            response = await self.model.generate_content_async([prompt, *images])
+        with metrics.span("ai_parse"):
+            return parse_response(response)
+
+    def warm_up(self):
+        self.model.count_tokens("warm-up")
+
+    async def warm_up_async(self):
+        await self.model.count_tokens_async("warm-up")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> GeminiClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GeminiClient()
+    return _client
+
+
+def set_client(client):
+    """Swap the process-wide client (e.g. for an offline stand-in)."""
+    global _client
+    _client = client
+
+
+async def warm_up() -> str:
+    """
+    Create the client and open its connections before the first real scan.
+    Returns "warm", "failed" or "skipped"; a failed client is built again on first use.
+    """
+    if not settings.GEMINI_API_KEY:
+        logger.warning("GEMINI_API_KEY is not set; skipping AI client warm-up")
+        return "skipped"
+    try:
+        client = get_client()
+        await anyio.to_thread.run_sync(client.warm_up)
+        await client.warm_up_async()
+        logger.info("Gemini client warmed up (%s)", settings.GEMINI_MODEL)
+        return "warm"
+    except Exception as e:
+        logger.warning("Gemini warm-up failed: %s", e)
+        return "failed"
+
+
+def parse_response(response) -> dict:
+    try:
+        content = response.text
+    except Exception as e:
+        logger.warning("Gemini response has no text (likely safety filter): %s", e)
+        return dict(SAFETY_BLOCKED_RESULT)
+    return parse_json_text(content)
+
+
+def parse_json_text(content: str) -> dict:
+    """The JSON object in a model's answer; raises json.JSONDecodeError if there is none."""
+    # Strip markdown if present
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content.replace("```json", "").replace("```", "")
+    elif content.startswith("```"):
+        content = content.replace("```", "")
+    return json.loads(content.strip())
+
+
+def analyze_image(file_path: str):
+    """
+    Send image to Google Gemini for analysis.
+    Returns structured JSON with keys: condition, confidence, severity, steps, warnings.
+    A result blocked by safety filters is returned as a placeholder carrying
+    "fallback": True; every other failure raises AIServiceError.
+
+    This blocking variant is for scripts and bypasses the limiter; the API
+    uses analyze_image_async.
+    """
+    client = get_client()
+    try:
+        return client.analyze(file_path)
+    except Exception as e:
+        raise classify_error(e) from e
+
+
+async def _limited(call, limiter=limiter):
+    async def attempt():
         try:
-            content = response.text
+            return await call()
         except Exception as e:
-            print(f"Gemini response has no text (likely safety filter): {e}")
-            return {
-                "condition": "Analysis block by AI safety filters",
-                "confidence": 0.0,
-                "severity": "MINOR",
-                "steps": ["Consult a real doctor as AI cannot analyze this image.", "Ensure the image is clear."],
-                "warnings": ["AI refused to analyze image."]
-            }
-            
-        # Strip markdown if present
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "")
-        elif content.startswith("```"):
-            content = content.replace("```", "")
-            
-        print("Parsing JSON response...")
-        return json.loads(content.strip())
-        
-    except Exception as e:
-        print(f"CRITICAL ERROR in analyze_image: {e}")
-        traceback.print_exc()
-        # Fallback to prevent 500 error
-        return {
-            "condition": f"AI Service Error: {str(e)[:50]}...",
-            "confidence": 0.0,
-            "severity": "MINOR",
-            "steps": ["AI analysis failed.", str(e)],
-            "warnings": [str(e)]
-        }
+            raise classify_error(e) from e
+
+    try:
+        # includes time queued in the limiter and any retries
+        with metrics.span("ai_total"):
+            return await limiter.call(attempt)
+    except LimiterTimeout as e:
+        raise AIRateLimitError(f"AI service is busy: {e}") from e
+
+
+async def analyze_image_async(file_path: str):
+    """
+    Async variant of analyze_image, run under the shared limiter: rate- and
+    concurrency-limited, with retryable errors retried with jittered backoff.
+    """
+    client = get_client()
+    return await _limited(lambda: client.analyze_async(file_path))
+
+
+async def analyze_images_async(file_paths: list):
+    """One combined assessment for several photos of the same lesion, in a single request."""
+    client = get_client()
+    return await _limited(lambda: client.analyze_many_async(file_paths))
+
 
+@metrics.collector
+def _limiter_metrics():
+    state = limiter.state()
+    for key in ("concurrency_limit", "in_flight", "waiting", "tokens"):
+        yield f"vaidra_ai_limiter_{key}", "gauge", f"AI call limiter {key.replace('_', ' ')}.", {}, state[key]
+    for key in ("calls", "succeeded", "failed", "retries", "rate_limited", "rejected"):
+        yield "vaidra_ai_calls_total", "counter", "AI calls through the limiter, by result.", {"result": key}, state[key]
@@ -0,0 +1,436 @@
+"""
+Image analysis across several AI providers, with hedged requests.
+
+A provider (Gemini, Perplexity) sends the images and returns the JSON object
+its model answered with. normalize_result() maps every answer to the same
+schema. analyze() asks the first provider in AI_PROVIDERS that is configured
+and whose circuit is closed. It waits for that provider's recent
+AI_HEDGE_PERCENTILE latency, clamped to AI_HEDGE_MIN/MAX_DELAY_MS. If no
+answer has come by then, the next provider is asked as well. The first valid
+answer wins and the other call is cancelled. A provider that fails is
+replaced by the next one straight away. A safety-filter placeholder only wins
+if no provider does better.
+
+Each provider has a circuit breaker. After AI_BREAKER_FAILURES failures in a
+row it is skipped for AI_BREAKER_RESET_SECONDS, then a single trial call
+decides whether it is back. Latency, outcomes and wins per provider are
+reported by GET /admin/ai-providers and /metrics.
+"""
+import asyncio
+import base64
+import logging
+import threading
+import time
+from collections import deque
+import anyio
+from app import ai_client, metrics
+from app.ai_client import AIRateLimitError, AIServiceError, classify_error
+from app.config import settings
+from app.limiter import CallLimiter, LimiterTimeout
+from app.preprocess import prepare_image
+
+logger = logging.getLogger(__name__)
+
+VALID_SEVERITIES = {"MINOR", "MODERATE", "URGENT"}
+counters = {"analyses": 0, "hedged": 0, "failovers": 0, "hedge_wins": 0, "fallbacks": 0, "failed": 0}
+
+
+def normalize_result(ai_res: dict) -> dict:
+    condition = ai_res.get("condition") or ai_res.get("diagnosis") or "Unclear image"
+    confidence = float(ai_res.get("confidence") or ai_res.get("score") or 0.0)
+    severity_raw = (ai_res.get("severity") or "MINOR").upper()
+    severity = severity_raw if severity_raw in VALID_SEVERITIES else "MINOR"
+    steps = ai_res.get("steps") or ai_res.get("advice") or []
+    warnings = ai_res.get("warnings") or []
+    return {
+        "condition": condition,
+        "confidence": confidence,
+        "severity": severity,
+        "steps": [str(s) for s in steps] if isinstance(steps, list) else [str(steps)],
+        "warnings": [str(w) for w in warnings] if isinstance(warnings, list) else [str(warnings)],
+    }
+
+
+def is_valid(ai_res) -> bool:
+    return isinstance(ai_res, dict) and bool(ai_res.get("condition") or ai_res.get("diagnosis"))
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` in a row -> half_open (one trial call) after `reset_seconds`."""
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.opens = 0
+
+    def ready(self) -> bool:
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= self.reset_seconds
+        return not (self.state == "half_open" and self.trial)
+
+    def allow(self) -> bool:
+        """Like ready(), but claims the trial call when half open."""
+        if not self.ready():
+            return False
+        if self.state != "closed":
+            self.state, self.trial = "half_open", True
+        return True
+
+    def success(self):
+        self.state, self.failures, self.trial = "closed", 0, False
+
+    def failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.opens += 1
+                logger.warning("AI provider circuit opened after %s failures", self.failures)
+            self.state, self.opened_at = "open", time.monotonic()
+        self.trial = False
+
+    def release(self):
+        """The trial call ended without a verdict (e.g. it lost a race)."""
+        self.trial = False
+
+
+class Provider:
+    name = ""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(settings.AI_BREAKER_FAILURES, settings.AI_BREAKER_RESET_SECONDS)
+        self.latencies = deque(maxlen=settings.AI_LATENCY_WINDOW)
+        self.counters = {"calls": 0, "succeeded": 0, "failed": 0, "invalid": 0, "cancelled": 0, "wins": 0}
+
+    def configured(self) -> bool:
+        raise NotImplementedError
+
+    async def analyze(self, file_paths: list) -> dict:
+        """The model's answer as a dict; raises AIServiceError."""
+        raise NotImplementedError
+
+    async def warm_up(self) -> str:
+        return "skipped"
+
+    def quantile(self, q: float):
+        if len(self.latencies) < settings.AI_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self) -> float:
+        p = self.quantile(settings.AI_HEDGE_PERCENTILE)
+        if p is None:  # not enough history yet; be patient
+            return settings.AI_HEDGE_MAX_DELAY_MS / 1000
+        return min(settings.AI_HEDGE_MAX_DELAY_MS, max(settings.AI_HEDGE_MIN_DELAY_MS, p * 1000)) / 1000
+
+    def stats(self) -> dict:
+        quantile = lambda q: round(self.quantile(q) * 1000, 1) if self.quantile(q) is not None else None  # noqa: E731
+        return {
+            "configured": self.configured(),
+            "circuit": self.breaker.state,
+            "circuit_opens": self.breaker.opens,
+            "p50_ms": quantile(0.50),
+            "p95_ms": quantile(0.95),
+            "p99_ms": quantile(0.99),
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1),
+            "win_rate": round(self.counters["wins"] / self.counters["calls"], 3) if self.counters["calls"] else None,
+            **self.counters,
+        }
+
+
+class GeminiProvider(Provider):
+    """ai_client's Gemini client, under its limiter (AI_RATE_PER_MINUTE etc.)."""
+
+    name = "gemini"
+
+    def configured(self) -> bool:
+        return bool(settings.GEMINI_API_KEY)
+
+    async def analyze(self, file_paths: list) -> dict:
+        if len(file_paths) == 1:
+            return await ai_client.analyze_image_async(file_paths[0])
+        return await ai_client.analyze_images_async(file_paths)
+
+    async def warm_up(self) -> str:
+        return await ai_client.warm_up()
+
+
+RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "condition": {"type": "string"},
+        "confidence": {"type": "number"},
+        "severity": {"type": "string", "enum": sorted(VALID_SEVERITIES)},
+        "steps": {"type": "array", "items": {"type": "string"}},
+        "warnings": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["condition", "confidence", "severity", "steps", "warnings"],
+}
+
+
+class PerplexityProvider(Provider):
+    """
+    Perplexity's chat completions API, with the same prompt as Gemini and a
+    JSON schema for the answer. Calls are made with requests from a worker
+    thread over one pooled session. A call that loses a race is abandoned,
+    not interrupted, so PERPLEXITY_TIMEOUT_SECONDS bounds how long its thread
+    stays busy.
+    """
+
+    name = "perplexity"
+
+    def __init__(self):
+        super().__init__()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.limiter = CallLimiter(
+            rate_per_minute=settings.PERPLEXITY_RATE_PER_MINUTE,
+            burst=max(1, settings.PERPLEXITY_MAX_CONCURRENCY),
+            min_concurrency=1,
+            max_concurrency=settings.PERPLEXITY_MAX_CONCURRENCY,
+            max_retries=settings.AI_MAX_RETRIES,
+            backoff_base=settings.AI_BACKOFF_BASE_SECONDS,
+            backoff_max=settings.AI_BACKOFF_MAX_SECONDS,
+            acquire_timeout=settings.AI_ACQUIRE_TIMEOUT_SECONDS,
+        )
+
+    def configured(self) -> bool:
+        return bool(settings.PERPLEXITY_API_KEY)
+
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    session.headers["Authorization"] = f"Bearer {settings.PERPLEXITY_API_KEY}"
+                    session.mount("https://", HTTPAdapter(pool_maxsize=settings.PERPLEXITY_MAX_CONCURRENCY))
+                    self._session = session
+        return self._session
+
+    @staticmethod
+    def _image_url(file_path: str) -> str:
+        if settings.AI_IMAGE_PREPROCESS:
+            data, _ = prepare_image(file_path)
+            media_type = "image/jpeg"
+        else:
+            from app.ingest import sniff_image_type
+
+            with open(file_path, "rb") as f:
+                data = f.read()
+            media_type = sniff_image_type(data[:16]) or "image/jpeg"
+        return f"data:{media_type};base64,{base64.b64encode(data).decode()}"
+
+    @staticmethod
+    def _answer(content: str) -> dict:
+        try:
+            return ai_client.parse_json_text(content)
+        except ValueError:
+            # reasoning models may put text (e.g. <think>...</think>) around the JSON
+            start, end = content.find("{"), content.rfind("}")
+            if start < 0 or end < start:
+                raise
+            return ai_client.parse_json_text(content[start:end + 1])
+
+    def _request(self, file_paths: list) -> dict:
+        import requests
+
+        prompt = settings.GEMINI_PROMPT + (settings.GEMINI_MULTI_IMAGE_NOTE if len(file_paths) > 1 else "")
+        with metrics.span("ai_preprocess"):
+            images = [{"type": "image_url", "image_url": {"url": self._image_url(p)}} for p in file_paths]
+        body = {
+            "model": settings.PERPLEXITY_MODEL,
+            "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}, *images]}],
+            "response_format": {"type": "json_schema", "json_schema": {"schema": RESULT_SCHEMA}},
+        }
+        if settings.GEMINI_TEMPERATURE is not None:
+            body["temperature"] = settings.GEMINI_TEMPERATURE
+        if settings.GEMINI_MAX_OUTPUT_TOKENS:
+            body["max_tokens"] = settings.GEMINI_MAX_OUTPUT_TOKENS
+        try:
+            with metrics.span("ai_request"):
+                response = self.session().post(
+                    settings.PERPLEXITY_ENDPOINT, json=body, timeout=settings.PERPLEXITY_TIMEOUT_SECONDS
+                )
+        except requests.RequestException as e:
+            raise AIServiceError(f"Perplexity unavailable: {e}", retryable=True) from e
+        if response.status_code == 429:
+            raise AIRateLimitError("Perplexity rate limit exceeded", retryable=True, rate_limited=True)
+        if response.status_code >= 500:
+            raise AIServiceError(f"Perplexity unavailable: HTTP {response.status_code}", retryable=True)
+        if response.status_code >= 400:
+            raise AIServiceError(f"Perplexity request failed: HTTP {response.status_code} {response.text[:200]}")
+        with metrics.span("ai_parse"):
+            try:
+                return self._answer(response.json()["choices"][0]["message"]["content"])
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                raise AIServiceError(f"Perplexity returned an unusable answer: {e}", retryable=True) from e
+
+    async def analyze(self, file_paths: list) -> dict:
+        async def call():
+            return await anyio.to_thread.run_sync(self._request, file_paths, cancellable=True)
+
+        return await ai_client._limited(call, self.limiter)
+
+    async def warm_up(self) -> str:
+        # opens the pooled TLS connection; any HTTP answer will do
+        try:
+            await anyio.to_thread.run_sync(
+                lambda: self.session().head(settings.PERPLEXITY_ENDPOINT, timeout=settings.PERPLEXITY_TIMEOUT_SECONDS)
+            )
+            logger.info("Perplexity client warmed up (%s)", settings.PERPLEXITY_MODEL)
+            return "warm"
+        except Exception as e:
+            logger.warning("Perplexity warm-up failed: %s", e)
+            return "failed"
+
+
+PROVIDERS = {"gemini": GeminiProvider, "perplexity": PerplexityProvider}
+providers = [PROVIDERS[name.strip()]() for name in settings.AI_PROVIDERS.split(",") if name.strip()]
+
+
+def set_providers(new_providers: list):
+    """Swap the provider list (e.g. for offline stand-ins)."""
+    global providers
+    providers = list(new_providers)
+
+
+def candidates() -> list:
+    """Configured providers in rotation (circuit not open), in order of preference."""
+    configured = [p for p in providers if p.configured()]
+    ready = [p for p in configured if p.breaker.ready()]
+    # breakers only rotate providers out; with every circuit open, the primary is still tried
+    return ready or configured[:1]
+
+
+async def _call(provider: Provider, file_paths: list) -> dict:
+    provider.counters["calls"] += 1
+    started = time.monotonic()
+    try:
+        ai_res = await provider.analyze(file_paths)
+    except asyncio.CancelledError:
+        provider.counters["cancelled"] += 1
+        # a lower bound, but dropping the slow calls that lost would drag the percentile down
+        provider.latencies.append(time.monotonic() - started)
+        provider.breaker.release()
+        raise
+    except Exception as e:
+        provider.counters["failed"] += 1
+        # our own limiter being full says nothing about the provider's health
+        if isinstance(e.__cause__, LimiterTimeout):
+            provider.breaker.release()
+        else:
+            provider.breaker.failure()
+        raise classify_error(e) from e
+    provider.latencies.append(time.monotonic() - started)
+    if not is_valid(ai_res):
+        provider.counters["invalid"] += 1
+        provider.breaker.failure()
+        raise AIServiceError(f"{provider.name} returned an unusable answer")
+    provider.counters["succeeded"] += 1
+    provider.breaker.success()
+    return {**normalize_result(ai_res), "fallback": bool(ai_res.get("fallback")), "provider": provider.name}
+
+
+async def analyze(file_paths: list) -> dict:
+    """
+    Normalized analysis of one image, or one combined assessment of several,
+    plus "provider" (who answered) and "fallback" (a safety-filter
+    placeholder). Raises AIServiceError when every provider failed.
+    """
+    queue = candidates()
+    if not queue:
+        raise AIServiceError("No AI provider is configured (set GEMINI_API_KEY or PERPLEXITY_API_KEY)")
+    counters["analyses"] += 1
+    forced = len(queue) == 1 and not queue[0].breaker.ready()
+    pending, hedges = {}, set()
+    fallback = error = None
+
+    def launch():
+        while queue:
+            provider = queue.pop(0)
+            # claims the half-open trial; a provider another request is trialling is skipped
+            if provider.breaker.allow() or forced:
+                pending[asyncio.ensure_future(_call(provider, file_paths))] = provider
+                return provider
+        return None
+
+    latest = launch()
+    if latest is None:
+        raise AIServiceError("AI service is unavailable", retryable=True)
+    try:
+        while pending:
+            hedge = queue and settings.AI_HEDGE_ENABLED
+            done, _ = await asyncio.wait(
+                pending, timeout=latest.hedge_delay() if hedge else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                provider = launch()
+                if provider is not None:
+                    counters["hedged"] += 1
+                    hedges.add(provider)
+                    latest = provider
+                continue
+            for task in done:
+                provider = pending.pop(task)
+                try:
+                    result = task.result()
+                except AIServiceError as e:
+                    logger.warning("AI provider %s failed: %s", provider.name, e)
+                    error = e
+                    continue
+                if result["fallback"]:
+                    fallback = fallback or result
+                    continue
+                provider.counters["wins"] += 1
+                if provider in hedges:
+                    counters["hedge_wins"] += 1
+                return result
+            if not pending and queue:
+                provider = launch()
+                if provider is not None:
+                    counters["failovers"] += 1
+                    latest = provider
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    if fallback is not None:
+        counters["fallbacks"] += 1
+        return fallback
+    counters["failed"] += 1
+    raise error
+
+
+async def warm_up() -> str:
+    """Warm up every configured provider; "warm" if at least one is."""
+    results = await asyncio.gather(*(p.warm_up() for p in providers if p.configured()))
+    if "warm" in results:
+        return "warm"
+    return "failed" if "failed" in results else "skipped"
+
+
+def stats() -> dict:
+    return {**counters, "providers": {p.name: p.stats() for p in providers}}
+
+
+@metrics.collector
+def _provider_metrics():
+    for p in providers:
+        labels = {"provider": p.name}
+        for key in ("succeeded", "failed", "invalid", "cancelled"):
+            yield "vaidra_ai_provider_calls_total", "counter", "AI provider calls, by outcome.", {**labels, "result": key}, p.counters[key]
+        yield "vaidra_ai_provider_wins_total", "counter", "Analyses answered by this provider.", labels, p.counters["wins"]
+        p95 = p.quantile(0.95)
+        if p95 is not None:
+            yield "vaidra_ai_provider_latency_p95_seconds", "gauge", "Recent p95 latency of the provider.", labels, round(p95, 4)
+        yield "vaidra_ai_provider_circuit_open", "gauge", "1 while the provider's circuit is open.", labels, int(p.breaker.state == "open")
+    for key in ("hedged", "failovers", "hedge_wins"):
+        yield "vaidra_ai_hedges_total", "counter", "Second providers started, and the races they won.", {"result": key}, counters[key]
@@ -1,18 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.db import get_db
-from app import models, schemas, utils
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import get_async_db
+from app import geo, models, read_cache, schemas, utils
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi import Body
+import json
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 @router.post("/register", status_code=201)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(models.User).filter(models.User.email == user.email).first()
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    existing = await db.scalar(select(models.User.id).where(models.User.email == user.email))
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed = utils.get_password_hash(user.password)
+    await db.commit()  # don't hold a pooled connection while bcrypt runs
+    hashed = await utils.hash_password_async(user.password)
     u = models.User(
         email=user.email, 
         hashed_password=hashed, 
@@ -24,28 +27,27 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
         address=user.address
     )
     db.add(u)
-    db.commit()
-    db.refresh(u)
+    await db.commit()
     return {"id": u.id, "email": u.email, "name": u.name}
 
 @router.post("/login", response_model=schemas.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not utils.verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(models.User).where(models.User.email == form_data.username))
+    await db.commit()  # don't hold a pooled connection while bcrypt runs
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    valid, new_hash = await utils.verify_and_update_password(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    if new_hash:
+        # cost factor changed since this hash was made; upgrade it transparently
+        user.hashed_password = new_hash
+        await db.commit()
     token = utils.create_access_token(user.id)
     return {"access_token": token, "token_type": "bearer"}
 
-@router.get("/profile")
-def get_profile(
-    db: Session = Depends(get_db),
-    current_user_id: int = Depends(utils.get_current_user_id)
-):
-    user = db.query(models.User).filter(models.User.id == current_user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    return {
+def _profile_body(user: models.User) -> bytes:
+    return json.dumps({
         "id": user.id,
         "email": user.email,
         "name": user.name,
@@ -56,26 +58,63 @@ def get_profile(
         "address": user.address,
         "location_lat": user.location_lat,
         "location_lng": user.location_lng
-    }
+    }).encode()
+
+@router.get("/profile")
+async def get_profile(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user_id: int = Depends(utils.get_current_user_id)
+):
+    # the version stamp is all we read unless the client and cache are both stale
+    version = await db.scalar(select(models.User.version).where(models.User.id == current_user_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    tag = read_cache.etag("user", current_user_id, version)
+    if read_cache.not_modified(request, tag):
+        return read_cache.not_modified_response(tag)
+
+    body = read_cache.profiles.get(current_user_id, version)
+    if body is None:
+        user = await db.get(models.User, current_user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        body = _profile_body(user)
+        read_cache.profiles.put(user.id, user.version, body)
+        tag = read_cache.etag("user", user.id, user.version)
+    return read_cache.json_response(body, tag)
 
 @router.put("/profile")
-def update_profile(
+async def update_profile(
     user_update: schemas.UserUpdate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user_id: int = Depends(utils.get_current_user_id) # Assuming utils has this
 ):
-    user = db.query(models.User).filter(models.User.id == current_user_id).first()
-    if not user:
+    User = models.User
+    values = user_update.model_dump(exclude_none=True)
+    if "location_lat" in values or "location_lng" in values:
+        lat, lng = values.get("location_lat"), values.get("location_lng")
+        if lat is None or lng is None:
+            # only one coordinate changed; the geohash needs the stored other half
+            stored = (await db.execute(
+                select(User.location_lat, User.location_lng).where(User.id == current_user_id)
+            )).first()
+            if stored:
+                lat = stored.location_lat if lat is None else lat
+                lng = stored.location_lng if lng is None else lng
+        if (lat is not None and not -90 <= lat <= 90) or (lng is not None and not -180 <= lng <= 180):
+            raise HTTPException(status_code=400, detail="Invalid coordinates")
+        values["geohash"] = geo.encode(lat, lng) if lat is not None and lng is not None else None
+    if values:
+        # a single UPDATE; the row is never loaded
+        found = (await db.execute(
+            update(User).where(User.id == current_user_id).values(**values, version=User.version + 1)
+        )).rowcount
+        await db.commit()
+        read_cache.profiles.invalidate(current_user_id)
+    else:
+        found = await db.scalar(select(User.id).where(User.id == current_user_id))
+    if not found:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    if user_update.name is not None: user.name = user_update.name
-    if user_update.age is not None: user.age = user_update.age
-    if user_update.gender is not None: user.gender = user_update.gender
-    if user_update.conditions is not None: user.conditions = user_update.conditions
-    if user_update.allergies is not None: user.allergies = user_update.allergies
-    if user_update.address is not None: user.address = user_update.address
-    if user_update.location_lat is not None: user.location_lat = user_update.location_lat
-    if user_update.location_lng is not None: user.location_lng = user_update.location_lng
 
-    db.commit()
     return {"status": "updated"}
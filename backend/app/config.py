@@ -1,20 +1,159 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 from pydantic import field_validator
 
+DEFAULT_GEMINI_PROMPT = """
+You are a dermatologist AI. Analyze the image and provide a JSON response with the following fields:
+- condition: (string) The name of the skin condition (e.g., Eczema, Psoriasis, Acne, Burn).
+- confidence: (number) Confidence score between 0 and 100.
+- severity: (string) One of ["MINOR", "MODERATE", "URGENT"].
+- steps: (list of strings) First aid or care steps.
+- warnings: (list of strings) Warning signs to watch for.
+
+Return ONLY raw JSON, no markdown formatting.
+"""
+
+DEFAULT_GEMINI_MULTI_IMAGE_NOTE = """
+The attached images all show the same affected area, photographed from different
+angles. Consider them together and return ONE combined assessment in the format above.
+"""
+
 class Settings(BaseSettings):
     SECRET_KEY: str = "replace_this_with_a_strong_key"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    # Stored hashes with a different cost are re-hashed on the next successful login
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    TOKEN_CACHE_SIZE: int = 4096
     DATABASE_URL: str = "sqlite:///./vaidra.db"
+
+    # Database engine (see app/db.py)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_TIMEOUT_MS: int = 30000  # PostgreSQL only; 0 disables
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+
     GEMINI_API_KEY: str = ""
+    GEMINI_MODEL: str = "gemini-2.5-flash"
+    GEMINI_PROMPT: str = DEFAULT_GEMINI_PROMPT
+    GEMINI_TEMPERATURE: Optional[float] = None
+    GEMINI_MAX_OUTPUT_TOKENS: Optional[int] = None
+    GEMINI_RESPONSE_MIME_TYPE: str = "application/json"
+    GEMINI_MULTI_IMAGE_NOTE: str = DEFAULT_GEMINI_MULTI_IMAGE_NOTE
+    GEMINI_WARM_UP: bool = True
+
+    # Flow control for AI calls (see app/limiter.py)
+    AI_RATE_PER_MINUTE: float = 60.0
+    AI_BURST: int = 10
+    AI_MIN_CONCURRENCY: int = 1
+    AI_MAX_CONCURRENCY: int = 8
+    AI_MAX_RETRIES: int = 3
+    AI_BACKOFF_BASE_SECONDS: float = 0.5
+    AI_BACKOFF_MAX_SECONDS: float = 8.0
+    AI_ACQUIRE_TIMEOUT_SECONDS: float = 30.0
+
+    # Second AI provider and hedged requests (see app/ai_providers.py)
+    AI_PROVIDERS: str = "gemini,perplexity"  # in order of preference; unconfigured ones are skipped
+    AI_HEDGE_ENABLED: bool = True
+    AI_HEDGE_PERCENTILE: float = 0.95
+    AI_HEDGE_MIN_SAMPLES: int = 20
+    AI_HEDGE_MIN_DELAY_MS: int = 500
+    AI_HEDGE_MAX_DELAY_MS: int = 8000
+    AI_LATENCY_WINDOW: int = 200
+    AI_BREAKER_FAILURES: int = 5
+    AI_BREAKER_RESET_SECONDS: float = 30.0
     PERPLEXITY_API_KEY: str = ""
-    PERPLEXITY_ENDPOINT: str = "https://api.perplexity.ai/analyze"
+    PERPLEXITY_ENDPOINT: str = "https://api.perplexity.ai/chat/completions"
+    PERPLEXITY_MODEL: str = "sonar-pro"
+    PERPLEXITY_TIMEOUT_SECONDS: float = 60.0
+    PERPLEXITY_RATE_PER_MINUTE: float = 50.0
+    PERPLEXITY_MAX_CONCURRENCY: int = 4
     USE_S3: bool = False
     S3_ENDPOINT: str = ""
     S3_REGION: str = ""
     S3_BUCKET: str = ""
     S3_ACCESS_KEY: str = ""
     S3_SECRET_KEY: str = ""
+    S3_MAX_POOL_CONNECTIONS: int = 20
+    S3_MULTIPART_THRESHOLD_MB: int = 8
+    S3_MULTIPART_CHUNK_MB: int = 8
+    S3_TRANSFER_CONCURRENCY: int = 4
+    S3_RETRY_INTERVAL_SECONDS: int = 60
+    S3_WARM_UP: bool = True
     UPLOAD_DIR: str = "uploads"
+    MAX_UPLOAD_BYTES: int = 15 * 1024 * 1024
+
+    # Content-addressed upload blobs and their lifecycle (see app/storage.py, app/lifecycle.py)
+    BLOB_LIFECYCLE_INTERVAL_SECONDS: int = 3600  # 0 disables the background job
+    BLOB_TIER_AFTER_DAYS: int = 30  # local copies of blobs unseen this long move to S3; 0 keeps them
+    BLOB_GC_GRACE_HOURS: int = 24
+    BLOB_ORPHAN_SWEEP_HOURS: int = 24
+    BLOB_LIFECYCLE_BATCH_SIZE: int = 200
+
+    # Analysis result cache (keyed by image SHA-256 + prompt version)
+    ANALYSIS_CACHE_ENABLED: bool = True
+    ANALYSIS_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    ANALYSIS_CACHE_MAX_ENTRIES: int = 50000
+
+    # Image preprocessing before the AI call
+    AI_IMAGE_PREPROCESS: bool = True
+    AI_IMAGE_MAX_EDGE: int = 1536
+    AI_IMAGE_JPEG_QUALITY: int = 85
+
+    # Batch analysis (POST /scans/analyze/batch)
+    BATCH_MAX_IMAGES: int = 10
+    BATCH_CONCURRENCY: int = 4
+
+    # Logging and metrics (see app/logs.py, app/metrics.py)
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+    METRICS_ENABLED: bool = True
+
+    # In-process cache of profile / recent-scans responses (see app/read_cache.py)
+    READ_CACHE_MAX_ENTRIES: int = 10000
+
+    # Scan images and thumbnails (GET /scans/{id}/image, /thumbnail; see app/media.py, app/thumbnails.py)
+    SCAN_IMAGE_CACHE_SECONDS: int = 86400
+    SCAN_IMAGE_URL_TTL_SECONDS: int = 300
+    # e.g. "/_uploads" to let nginx send files from an internal location mapped to UPLOAD_DIR
+    MEDIA_ACCEL_REDIRECT_PREFIX: str = ""
+    THUMBNAIL_DIR: str = ""  # defaults to UPLOAD_DIR/thumbnails
+    THUMBNAIL_CACHE_MAX_MB: int = 256
+    THUMBNAIL_JPEG_QUALITY: int = 80
+
+    # GET /doctor/cases/nearby: patients considered per query, nearest first (see app/geo.py)
+    NEARBY_MAX_USERS: int = 5000
+
+    # Research export (GET /doctor/export, see app/export.py)
+    EXPORT_BATCH_SIZE: int = 1000
+    EXPORT_MAX_CONCURRENT: int = 1
+
+    # Case feed (GET /doctor/cases/stream, see app/events.py)
+    EVENTS_BUFFER_SIZE: int = 1000
+    EVENTS_SUBSCRIBER_QUEUE_SIZE: int = 256
+    EVENTS_KEEPALIVE_SECONDS: float = 15.0
+    EVENTS_RETRY_MS: int = 3000
+
+    # Background scan jobs (POST /scans/jobs)
+    SCAN_JOB_WORKERS: int = 2
+    SCAN_JOB_QUEUE_SIZE: int = 100
+    SCAN_JOB_POLL_SECONDS: float = 5.0
+    SCAN_JOB_STALE_SECONDS: int = 600
+    SCAN_JOB_MAX_WAIT_SECONDS: int = 30
+    SCAN_JOB_RETRY_AFTER_SECONDS: int = 5
+
+    # Serving (see gunicorn.conf.py and app/serving.py)
+    PORT: int = 8000
+    WEB_CONCURRENCY: int = 1
+    GRACEFUL_TIMEOUT_SECONDS: int = 30
+    WORKER_TIMEOUT_SECONDS: int = 120
+    READY_DB_TIMEOUT_SECONDS: float = 2.0
 
     # Render provides postgres:// but SQLAlchemy requires postgresql://
     @field_validator("DATABASE_URL", mode="before")
@@ -1,21 +1,175 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from app import metrics
 from app.config import settings
-import os
 
 DATABASE_URL = settings.DATABASE_URL
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
-connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+_metrics_lock = threading.Lock()
+
+
+def _new_metrics() -> dict:
+    return {"checkouts": 0, "timeouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+
+class _TimedPool:
+    """Pool mixin that records how long callers wait to check out a connection."""
+
+    metrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            with _metrics_lock:
+                self.metrics["timeouts"] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with _metrics_lock:
+                self.metrics["checkouts"] += 1
+                self.metrics["wait_seconds_total"] += waited
+                self.metrics["wait_seconds_max"] = max(self.metrics["wait_seconds_max"], waited)
+
+
+class TimedQueuePool(_TimedPool, QueuePool):
+    metrics = _new_metrics()
+
+
+class TimedAsyncQueuePool(_TimedPool, AsyncAdaptedQueuePool):
+    metrics = _new_metrics()
+
+
+def async_url(url: str) -> str:
+    """The same database, addressed through its asyncio driver."""
+    u = make_url(url)
+    if u.get_backend_name() == "sqlite":
+        return str(u.set(drivername="sqlite+aiosqlite"))
+    if u.get_backend_name() == "postgresql":
+        return u.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+    return url
+
+
+def engine_options(url: str, use_async: bool = False) -> dict:
+    options = {"connect_args": {}}
+    if url.startswith("sqlite"):
+        options["connect_args"]["check_same_thread"] = False
+        if make_url(url).database in (None, "", ":memory:"):
+            # in-memory databases live on a single connection; keep SQLAlchemy's default pool
+            return options
+    elif url.startswith("postgresql") and settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        if use_async:
+            options["connect_args"]["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+        else:
+            options["connect_args"]["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+    options.update(
+        poolclass=TimedAsyncQueuePool if use_async else TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        # a cheap liveness check on checkout instead of failing on a connection the server idled out
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    return options
+
+
+# The sync engine serves Alembic, scripts and the background workers that run in
+# the threadpool; request handlers use the async engine below.
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+async_engine = create_async_engine(async_url(DATABASE_URL), **engine_options(DATABASE_URL, use_async=True))
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run alongside a writer instead of serializing on the rollback journal
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.close()
+
+
+def unpooled_async_engine():
+    """
+    An async engine with no pool, for long-running readers (bulk exports) that
+    must not hold one of the connections live requests are waiting for.
+    """
+    unpooled = create_async_engine(
+        async_url(DATABASE_URL), poolclass=NullPool,
+        connect_args=engine_options(DATABASE_URL, use_async=True)["connect_args"],
+    )
+    if IS_SQLITE:
+        event.listen(unpooled.sync_engine, "connect", _sqlite_pragmas)
+    return unpooled
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# expire_on_commit=False: attributes stay readable after commit without an implicit (sync) refresh
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+
+def _pool_stats(pool) -> dict:
+    with _metrics_lock:
+        metrics = dict(pool.metrics) if isinstance(pool, _TimedPool) else _new_metrics()
+    checkouts = metrics["checkouts"]
+    stats = {
+        "pool": type(pool).__name__,
+        **metrics,
+        "wait_seconds_avg": metrics["wait_seconds_total"] / checkouts if checkouts else 0.0,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            in_use=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=settings.DB_MAX_OVERFLOW,
+        )
+    return stats
+
+
+def pool_stats() -> dict:
+    return {"async": _pool_stats(async_engine.pool), "sync": _pool_stats(engine.pool)}
+
+
+@metrics.collector
+def _pool_metrics():
+    for engine_name, stats in pool_stats().items():
+        labels = {"engine": engine_name}
+        yield "vaidra_db_pool_checkouts_total", "counter", "Connections checked out of the pool.", labels, stats["checkouts"]
+        yield "vaidra_db_pool_timeouts_total", "counter", "Checkouts that timed out waiting for a connection.", labels, stats["timeouts"]
+        yield "vaidra_db_pool_wait_seconds_total", "counter", "Total time spent waiting for a pooled connection.", labels, stats["wait_seconds_total"]
+        if "in_use" in stats:
+            yield "vaidra_db_pool_in_use", "gauge", "Connections currently checked out.", labels, stats["in_use"]
+            yield "vaidra_db_pool_size", "gauge", "Configured pool size.", labels, stats["size"]
+            yield "vaidra_db_pool_overflow", "gauge", "Connections open beyond the pool size.", labels, stats["overflow"]
+
+
+def upsert_insert(table):
+    """INSERT for the configured backend, with on_conflict_do_update / do_nothing."""
+    return (sqlite.insert if IS_SQLITE else postgresql.insert)(table)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
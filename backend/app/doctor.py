@@ -1,43 +1,305 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.db import get_db
-from app import models, schemas
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Text, and_, cast, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from app.config import settings
+from app.db import get_async_db
+from app import events, export, geo, models, schemas, serving, stats, utils
+import base64, json
 
 router = APIRouter(prefix="/doctor", tags=["doctor"])
 
+def encode_cursor(created_at: datetime, scan_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), scan_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, scan_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(scan_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/cases")
-def list_cases(status: str = None, db: Session = Depends(get_db)):
-    q = db.query(models.Scan).order_by(models.Scan.created_at.desc())
-    if status:
-        q = q.filter(models.Scan.severity == status)
-    cases = q.all()
-    result = []
-    for c in cases:
-        result.append({
-            "id": c.id,
-            "condition": c.condition,
-            "confidence": c.confidence,
-            "severity": c.severity.value if c.severity else None,
-            "assigned_to": c.assigned_to,
-            "created_at": c.created_at.isoformat()
-        })
-    return result
+async def list_cases(
+    status: str = None,
+    severity: str = None,
+    assigned_to: int = None,
+    unassigned: bool = False,
+    created_from: datetime = None,
+    created_to: datetime = None,
+    warning: str = None,
+    cursor: str = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Newest cases first, paginated by an opaque (created_at, id) cursor: pass
+    `next_cursor` from one page as `cursor` to get the next. `status` is the
+    older name for `severity`. `warning` matches cases whose warnings
+    mention the given text (case-insensitive).
+    """
+    Scan = models.Scan
+    # only the columns the list view shows; rows come back as plain tuples
+    q = select(Scan.id, Scan.condition, Scan.confidence, Scan.severity, Scan.assigned_to, Scan.created_at)
+    severity = severity or status
+    if severity:
+        q = q.where(Scan.severity == severity.upper())
+    if unassigned:
+        q = q.where(Scan.assigned_to.is_(None))
+    elif assigned_to is not None:
+        q = q.where(Scan.assigned_to == assigned_to)
+    if created_from:
+        q = q.where(Scan.created_at >= created_from)
+    if created_to:
+        q = q.where(Scan.created_at < created_to)
+    if warning:
+        # matched in the database against the JSON text, no rows loaded into Python
+        q = q.where(cast(Scan.warnings, Text).icontains(warning, autoescape=True))
+    if cursor:
+        after_created, after_id = decode_cursor(cursor)
+        q = q.where(or_(
+            Scan.created_at < after_created,
+            and_(Scan.created_at == after_created, Scan.id < after_id),
+        ))
+
+    rows = (await db.execute(q.order_by(Scan.created_at.desc(), Scan.id.desc()).limit(limit + 1))).all()
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return {
+        "items": [
+            {
+                "id": scan_id,
+                "condition": condition,
+                "confidence": confidence,
+                "severity": severity_value,
+                "assigned_to": assignee,
+                "created_at": created_at.isoformat() if created_at else None
+            }
+            for scan_id, condition, confidence, severity_value, assignee, created_at in page
+        ],
+        "next_cursor": next_cursor,
+    }
+
+@router.get("/cases/nearby")
+async def nearby_cases(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(10.0, gt=0, le=500),
+    severity: str = None,
+    unassigned: bool = False,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Newest cases from patients whose profile location is within `radius_km`
+    of (lat, lng), each with its `distance_km`. Only the patient's distance
+    is returned, never their coordinates.
+    """
+    near = await geo.users_within(db, lat, lng, radius_km, settings.NEARBY_MAX_USERS)
+    if not near:
+        return {"items": []}
+    distances = dict(near)
+
+    Scan = models.Scan
+    q = select(Scan.id, Scan.condition, Scan.confidence, Scan.severity, Scan.assigned_to, Scan.created_at, Scan.user_id)
+    q = q.where(Scan.user_id.in_(list(distances)))
+    if severity:
+        q = q.where(Scan.severity == severity.upper())
+    if unassigned:
+        q = q.where(Scan.assigned_to.is_(None))
+    rows = (await db.execute(q.order_by(Scan.created_at.desc(), Scan.id.desc()).limit(limit))).all()
+    return {
+        "items": [
+            {
+                "id": scan_id,
+                "condition": condition,
+                "confidence": confidence,
+                "severity": severity_value,
+                "assigned_to": assignee,
+                "created_at": created_at.isoformat() if created_at else None,
+                "distance_km": round(distances[user_id], 3),
+            }
+            for scan_id, condition, confidence, severity_value, assignee, created_at, user_id in rows
+        ],
+    }
+
+@router.get("/cases/stream")
+async def stream_cases(request: Request, severity: str = None, last_event_id: str = None):
+    """
+    Server-Sent Events feed of new and changed cases: `case.created`,
+    `case.assigned` and `case.note`. `severity` takes one or more
+    comma-separated values and is applied on the server. After a reconnect,
+    missed events are replayed from the Last-Event-ID header (or the
+    `last_event_id` parameter). A `reset` event means they could not be, and
+    the client should refetch /doctor/cases.
+    """
+    if serving.state["draining"]:
+        # this worker is shutting down; the client retries and lands on another one
+        raise HTTPException(status_code=503, detail="Server is restarting", headers={"Retry-After": "1"})
+    severities = {s.strip().upper() for s in severity.split(",") if s.strip()} if severity else None
+    sub, missed, reset = events.broadcaster.subscribe(
+        severities, request.headers.get("last-event-id") or last_event_id
+    )
+    return StreamingResponse(
+        events.stream(sub, missed, reset),
+        media_type="text/event-stream",
+        # no-transform/X-Accel-Buffering keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache, no-transform", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/export", dependencies=[Depends(utils.get_current_admin_id)])
+async def export_scans(
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    severity: str = None,
+    created_from: datetime = None,
+    created_to: datetime = None,
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Admin only: every matching scan, anonymized, oldest first, as NDJSON, CSV
+    or Parquet (Parquet needs pyarrow). `severity` takes comma-separated
+    values. `gzip` compresses the stream. The body is produced while it is
+    sent, so there is no size limit and no Content-Length.
+    """
+    # the admin check used this request's session; hand its connection back before streaming
+    await db.commit()
+    if export.busy():
+        raise HTTPException(status_code=429, detail="An export is already running", headers={"Retry-After": "60"})
+    try:
+        encoder = export.encoder_for(format, gzip)
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed")
+    severities = {s.strip().upper() for s in severity.split(",") if s.strip()} if severity else None
+    media_type, extension = export.FORMATS[format]
+    filename = f"scans-{datetime.utcnow():%Y%m%d-%H%M%S}.{extension}"
+    if gzip:
+        media_type, filename = "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        export.stream(export.export_query(severities, created_from, created_to), encoder),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/stats")
+async def case_stats(days: int = Query(30, ge=1, le=366), top: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_db)):
+    """
+    Dashboard numbers for the last `days` UTC days: scans per day by severity,
+    the `top` conditions and mean confidence. `unassigned_urgent` counts every
+    URGENT case still waiting for a doctor. Read from the scan_daily_stats
+    rollup, never from scans.
+    """
+    Stats = models.ScanDailyStats
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    window = Stats.day >= since
+
+    per_day = {}
+    for day, severity, count in (await db.execute(
+        select(Stats.day, Stats.severity, func.sum(Stats.scans))
+        .where(window).group_by(Stats.day, Stats.severity).order_by(Stats.day)
+    )).all():
+        row = per_day.setdefault(day.isoformat(), {"day": day.isoformat(), "total": 0})
+        row[severity or "UNKNOWN"] = count
+        row["total"] += count
+
+    conditions = (await db.execute(
+        select(
+            Stats.condition,
+            func.sum(Stats.scans).label("scans"),
+            func.sum(Stats.confidence_sum),
+            func.sum(Stats.confidence_count),
+        )
+        .where(window).group_by(Stats.condition).order_by(func.sum(Stats.scans).desc(), Stats.condition).limit(top)
+    )).all()
+    total, confidence_sum, confidence_count = (await db.execute(
+        select(func.sum(Stats.scans), func.sum(Stats.confidence_sum), func.sum(Stats.confidence_count)).where(window)
+    )).one()
+    unassigned_urgent = await db.scalar(
+        select(func.coalesce(func.sum(Stats.unassigned), 0)).where(Stats.severity == "URGENT")
+    )
+
+    def mean(s, n):
+        return round(s / n, 4) if n else None
+
+    return {
+        "days": days,
+        "since": since.isoformat(),
+        "total_scans": total or 0,
+        "mean_confidence": mean(confidence_sum, confidence_count),
+        "unassigned_urgent": unassigned_urgent,
+        "per_day": list(per_day.values()),
+        "top_conditions": [
+            {"condition": condition or None, "scans": scans, "mean_confidence": mean(s, n)}
+            for condition, scans, s, n in conditions
+        ],
+    }
 
 @router.post("/assign")
-def assign(req: schemas.AssignRequest, db: Session = Depends(get_db)):
-    scan = db.query(models.Scan).filter(models.Scan.id == req.scan_id).first()
+async def assign(req: schemas.AssignRequest, db: AsyncSession = Depends(get_async_db)):
+    scan = await db.get(models.Scan, req.scan_id)
     if not scan:
         raise HTTPException(status_code=404, detail="Scan not found")
+    # only the request that takes the case off the unassigned pile moves the rollup
+    claimed = await db.execute(
+        update(models.Scan)
+        .where(models.Scan.id == scan.id, models.Scan.assigned_to.is_(None))
+        .values(assigned_to=req.doctor_id)
+    )
+    if claimed.rowcount:
+        await stats.record_assignment(db, scan.id)
     scan.assigned_to = req.doctor_id
-    db.commit()
+    await db.commit()
+    await events.broadcaster.publish("case.assigned", events.case_data(scan))
     return {"ok": True, "scan_id": scan.id, "assigned_to": scan.assigned_to}
 
 @router.post("/note")
-def add_note(note: schemas.NoteCreate, db: Session = Depends(get_db)):
-    scan = db.query(models.Scan).filter(models.Scan.id == note.scan_id).first()
+async def add_note(note: schemas.NoteCreate, db: AsyncSession = Depends(get_async_db)):
+    scan = (await db.execute(
+        select(models.Scan.id, models.Scan.severity).where(models.Scan.id == note.scan_id)
+    )).first()
     if not scan:
         raise HTTPException(status_code=404, detail="Scan not found")
-    existing = scan.notes or ""
-    scan.notes = (existing + "\n" + note.note).strip()
-    db.commit()
-    return {"ok": True}
+    # a single INSERT; notes are never rewritten, so concurrent appends can't clobber each other
+    row = models.ScanNote(scan_id=note.scan_id, author_id=note.author_id, body=note.note.strip())
+    db.add(row)
+    await db.commit()
+    await events.broadcaster.publish("case.note", {
+        "id": scan.id, "severity": scan.severity, "note_id": row.id, "author_id": row.author_id, "body": row.body,
+    })
+    return {"ok": True, "id": row.id}
+
+@router.get("/cases/{scan_id}/notes")
+async def list_notes(
+    scan_id: int,
+    after: int = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Notes oldest first. Pass `next_cursor` from one page as `after` to get the next."""
+    Note = models.ScanNote
+    if not await db.scalar(select(models.Scan.id).where(models.Scan.id == scan_id)):
+        raise HTTPException(status_code=404, detail="Scan not found")
+    q = select(Note.id, Note.author_id, Note.body, Note.created_at).where(Note.scan_id == scan_id)
+    if after is not None:
+        q = q.where(Note.id > after)
+    rows = (await db.execute(q.order_by(Note.id.asc()).limit(limit + 1))).all()
+    page = rows[:limit]
+    return {
+        "items": [
+            {
+                "id": note_id,
+                "author_id": author_id,
+                "body": body,
+                "created_at": created_at.isoformat() if created_at else None
+            }
+            for note_id, author_id, body, created_at in page
+        ],
+        "next_cursor": page[-1].id if len(rows) > limit else None,
+    }
@@ -0,0 +1,220 @@
+"""
+Push feed of case changes for GET /doctor/cases/stream.
+
+Writers call publish() after their commit; one Broadcaster per process fans
+each event out to every connected doctor, so a new scan costs one message
+instead of every open dashboard re-querying /doctor/cases. Events get ids of
+the form "<epoch>-<seq>" and the last EVENTS_BUFFER_SIZE are kept in memory.
+A client that reconnects with Last-Event-ID is replayed what it missed. If
+the id is from another process or older than the buffer, the client gets a
+"reset" event and should refetch the list.
+
+On Postgres, publish() goes through NOTIFY and every worker LISTENs on one
+connection. Each worker's doctors then see writes made by all the workers.
+On SQLite (single process) events are dispatched directly.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from collections import deque
+from sqlalchemy.engine import make_url
+from app import metrics
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "vaidra_case_events"
+
+
+class Subscription:
+    def __init__(self, severities, queue_size: int):
+        self.severities = severities  # None means every severity
+        self.queue = asyncio.Queue(queue_size)
+        self.closed = False
+
+    def close(self):
+        """End the stream once the client has read what is already queued."""
+        self.closed = True
+        if not self.queue.full():
+            self.queue.put_nowait(None)
+
+    def wants(self, event: dict) -> bool:
+        return self.severities is None or event["data"].get("severity") in self.severities
+
+
+class Broadcaster:
+    def __init__(self, buffer_size: int, queue_size: int):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._seq = 0
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscribers = set()
+        self._conn = None
+        self._conn_lock = asyncio.Lock()
+        self._listener = None
+        self.counters = {"published": 0, "delivered": 0, "dropped_subscribers": 0}
+
+    def _dispatch(self, kind: str, data: dict):
+        self._seq += 1
+        event = {"id": f"{self.epoch}-{self._seq}", "seq": self._seq, "event": kind, "data": data}
+        self._buffer.append(event)
+        self.counters["published"] += 1
+        for sub in list(self._subscribers):
+            if not sub.wants(event):
+                continue
+            try:
+                sub.queue.put_nowait(event)
+                self.counters["delivered"] += 1
+            except asyncio.QueueFull:
+                # a stalled client must not grow memory without bound; its
+                # stream is ended and it catches up from the buffer when it
+                # reconnects with Last-Event-ID
+                sub.closed = True
+                self._subscribers.discard(sub)
+                self.counters["dropped_subscribers"] += 1
+
+    async def publish(self, kind: str, data: dict):
+        if self._conn is not None and not self._conn.is_closed():
+            try:
+                async with self._conn_lock:
+                    await self._conn.execute("SELECT pg_notify($1, $2)", CHANNEL, json.dumps({"event": kind, "data": data}))
+                return
+            except Exception as e:
+                logger.warning("NOTIFY failed, delivering locally only: %s", e)
+        self._dispatch(kind, data)
+
+    def subscribe(self, severities=None, last_event_id: str = None):
+        """
+        Returns (subscription, missed events, reset id). The reset id is set
+        when the missed events can't be replayed and the client has to refetch.
+        """
+        sub = Subscription(severities, self.queue_size)
+        missed, reset = [], None
+        if last_event_id:
+            epoch, _, seq = last_event_id.partition("-")
+            oldest = self._buffer[0]["seq"] if self._buffer else self._seq + 1
+            if epoch != self.epoch or not seq.isdigit() or int(seq) < oldest - 1:
+                reset = f"{self.epoch}-{self._seq}"
+            else:
+                missed = [e for e in self._buffer if e["seq"] > int(seq) and sub.wants(e)]
+        self._subscribers.add(sub)
+        return sub, missed, reset
+
+    def unsubscribe(self, sub: Subscription):
+        self._subscribers.discard(sub)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+            self._dispatch(message["event"], message["data"])
+        except (ValueError, KeyError) as e:
+            logger.warning("Ignoring malformed case event: %s", e)
+
+    async def _listen(self, dsn: str):
+        import asyncpg
+
+        while True:
+            lost = asyncio.Event()
+            try:
+                self._conn = await asyncpg.connect(dsn)
+                self._conn.add_termination_listener(lambda conn: lost.set())
+                await self._conn.add_listener(CHANNEL, self._on_notify)
+                logger.info("Listening for case events on %s", CHANNEL)
+                await lost.wait()
+                logger.warning("Case event listener connection lost; reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Case event listener failed: %s", e)
+            self._conn = None
+            await asyncio.sleep(5)
+
+    async def start(self):
+        url = make_url(settings.DATABASE_URL)
+        if url.get_backend_name() == "postgresql" and self._listener is None:
+            dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+            self._listener = asyncio.create_task(self._listen(dsn))
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+        self.close_streams()
+
+    def close_streams(self):
+        """Wake every open stream so it ends (clients reconnect with Last-Event-ID)."""
+        for sub in list(self._subscribers):
+            sub.close()
+        self._subscribers.clear()
+
+    def stats(self) -> dict:
+        return {
+            "epoch": self.epoch,
+            "subscribers": len(self._subscribers),
+            "buffered": len(self._buffer),
+            "last_id": f"{self.epoch}-{self._seq}",
+            "notify": self._conn is not None,
+            **self.counters,
+        }
+
+
+broadcaster = Broadcaster(settings.EVENTS_BUFFER_SIZE, settings.EVENTS_SUBSCRIBER_QUEUE_SIZE)
+
+
+def case_data(scan) -> dict:
+    """A new or changed case, in the shape /doctor/cases lists it."""
+    return {
+        "id": scan.id,
+        "condition": scan.condition,
+        "confidence": scan.confidence,
+        "severity": scan.severity,
+        "assigned_to": scan.assigned_to,
+        "created_at": scan.created_at.isoformat() if scan.created_at else None,
+    }
+
+
+async def case_created(scans):
+    for scan in scans:
+        await broadcaster.publish("case.created", case_data(scan))
+
+
+def format_event(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+async def stream(sub: Subscription, missed: list, reset: str = None):
+    """The text/event-stream body for one subscriber."""
+    try:
+        yield f"retry: {settings.EVENTS_RETRY_MS}\n\n"
+        if reset:
+            # carries an id so the client resumes from here after it refetches
+            yield f"id: {reset}\nevent: reset\ndata: {{}}\n\n"
+        for event in missed:
+            yield format_event(event)
+        while True:
+            if sub.closed and sub.queue.empty():
+                return
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), settings.EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # comments keep proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(sub)
+
+
+@metrics.collector
+def _events_metrics():
+    state = broadcaster.stats()
+    yield "vaidra_case_stream_subscribers", "gauge", "Open /doctor/cases/stream connections.", {}, state["subscribers"]
+    for key in ("published", "delivered", "dropped_subscribers"):
+        yield "vaidra_case_events_total", "counter", "Case feed events, by outcome.", {"result": key}, state[key]
@@ -0,0 +1,251 @@
+"""
+Bulk export of anonymized scans for research (GET /doctor/export).
+
+Rows are read through a server-side cursor (stream_results + yield_per),
+EXPORT_BATCH_SIZE at a time. The connection is a dedicated one from outside
+the request pool. Each batch is encoded, and gzipped if asked, in a worker
+thread. Memory stays flat however many rows match, and the event loop keeps
+serving live requests. At most EXPORT_MAX_CONCURRENT exports run at once.
+
+No direct identifiers are exported. User ids become a keyed hash: it is
+stable for a given SECRET_KEY, so one patient's scans can still be grouped.
+File names, storage keys, doctor ids and free-text notes are left out.
+"""
+import csv
+import hashlib
+import hmac
+import io
+import json
+import logging
+import time
+import zlib
+import anyio
+from sqlalchemy import select, text
+from app import metrics, models
+from app.config import settings
+from app.db import IS_SQLITE, unpooled_async_engine
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("id", "created_at", "patient", "condition", "confidence", "severity", "steps", "warnings", "assigned")
+# (media type, file extension)
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+PARQUET_ROW_GROUP_ROWS = 50_000
+
+counters = {"exports": 0, "rows": 0, "bytes": 0, "active": 0}
+_engine = None
+
+
+def _export_engine():
+    global _engine
+    if _engine is None:
+        _engine = unpooled_async_engine()
+    return _engine
+
+
+def pseudonym(user_id):
+    if user_id is None:
+        return None
+    return hmac.new(settings.SECRET_KEY.encode(), f"patient:{user_id}".encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def export_query(severities=None, created_from=None, created_to=None):
+    Scan = models.Scan
+    q = select(
+        Scan.id, Scan.created_at, Scan.user_id, Scan.condition, Scan.confidence,
+        Scan.severity, Scan.steps, Scan.warnings, Scan.assigned_to.isnot(None),
+    )
+    if severities:
+        q = q.where(Scan.severity.in_(severities))
+    if created_from:
+        q = q.where(Scan.created_at >= created_from)
+    if created_to:
+        q = q.where(Scan.created_at < created_to)
+    return q.order_by(Scan.id)
+
+
+def _records(rows) -> list:
+    return [
+        {
+            "id": scan_id,
+            "created_at": created_at,
+            "patient": pseudonym(user_id),
+            "condition": condition,
+            "confidence": confidence,
+            "severity": severity,
+            "steps": steps or [],
+            "warnings": warnings or [],
+            "assigned": bool(assigned),
+        }
+        for scan_id, created_at, user_id, condition, confidence, severity, steps, warnings, assigned in rows
+    ]
+
+
+def _iso(value) -> str:
+    return value.isoformat() if value else None
+
+
+class NdjsonEncoder:
+    def encode(self, rows) -> bytes:
+        out = []
+        for r in _records(rows):
+            r["created_at"] = _iso(r["created_at"])
+            out.append(json.dumps(r) + "\n")
+        return "".join(out).encode()
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class CsvEncoder:
+    def __init__(self):
+        self.header = True
+
+    def encode(self, rows) -> bytes:
+        out = io.StringIO()
+        writer = csv.writer(out)
+        if self.header:
+            writer.writerow(COLUMNS)
+            self.header = False
+        for r in _records(rows):
+            r["steps"], r["warnings"] = json.dumps(r["steps"]), json.dumps(r["warnings"])
+            r["created_at"] = _iso(r["created_at"]) or ""
+            writer.writerow(r[c] for c in COLUMNS)
+        return out.getvalue().encode()
+
+    def finish(self) -> bytes:
+        return self.encode([]) if self.header else b""
+
+
+class _Chunks:
+    """A write-only file that hands back whatever was written since the last take()."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+class ParquetEncoder:
+    """Columnar output; rows are buffered into row groups of PARQUET_ROW_GROUP_ROWS."""
+
+    def __init__(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("id", pa.int64()),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+            ("patient", pa.string()),
+            ("condition", pa.string()),
+            ("confidence", pa.float64()),
+            ("severity", pa.string()),
+            ("steps", pa.list_(pa.string())),
+            ("warnings", pa.list_(pa.string())),
+            ("assigned", pa.bool_()),
+        ])
+        self.sink = _Chunks()
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression="zstd")
+        self.pending, self.pending_rows = [], 0  # Arrow batches, compact until the row group is written
+
+    def _flush(self):
+        if self.pending:
+            self.writer.write_table(self.pa.Table.from_batches(self.pending, schema=self.schema))
+            self.pending, self.pending_rows = [], 0
+
+    def encode(self, rows) -> bytes:
+        records = _records(rows)
+        if records:
+            self.pending.append(self.pa.RecordBatch.from_pylist(records, schema=self.schema))
+            self.pending_rows += len(records)
+        if self.pending_rows >= PARQUET_ROW_GROUP_ROWS:
+            self._flush()
+        return self.sink.take()
+
+    def finish(self) -> bytes:
+        self._flush()
+        self.writer.close()
+        return self.sink.take()
+
+
+class GzipEncoder:
+    def __init__(self, inner):
+        self.inner = inner
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+
+    def encode(self, rows) -> bytes:
+        return self.compressor.compress(self.inner.encode(rows))
+
+    def finish(self) -> bytes:
+        return self.compressor.compress(self.inner.finish()) + self.compressor.flush()
+
+
+def encoder_for(fmt: str, gzip: bool):
+    """Raises ImportError for parquet without pyarrow installed."""
+    encoder = {"ndjson": NdjsonEncoder, "csv": CsvEncoder, "parquet": ParquetEncoder}[fmt]()
+    return GzipEncoder(encoder) if gzip else encoder
+
+
+def busy() -> bool:
+    return counters["active"] >= settings.EXPORT_MAX_CONCURRENT
+
+
+async def stream(query, encoder):
+    """The response body: encoded batches as they come off the cursor."""
+    counters["active"] += 1
+    started, rows, sent = time.perf_counter(), 0, 0
+    try:
+        async with _export_engine().connect() as conn:
+            if not IS_SQLITE:
+                await conn.execute(text("SET TRANSACTION READ ONLY"))
+                # a cursor stays open for the whole download; the request timeout must not end it
+                await conn.execute(text("SET LOCAL statement_timeout = 0"))
+            result = await conn.stream(query.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+            async for batch in result.partitions(settings.EXPORT_BATCH_SIZE):
+                chunk = await anyio.to_thread.run_sync(encoder.encode, batch)
+                rows += len(batch)
+                if chunk:
+                    sent += len(chunk)
+                    yield chunk
+        chunk = await anyio.to_thread.run_sync(encoder.finish)
+        if chunk:
+            sent += len(chunk)
+            yield chunk
+        counters["exports"] += 1
+        logger.info("Exported %s scans (%s bytes) in %.1fs", rows, sent, time.perf_counter() - started)
+    finally:
+        counters["active"] -= 1
+        counters["rows"] += rows
+        counters["bytes"] += sent
+
+
+@metrics.collector
+def _export_metrics():
+    yield "vaidra_exports_total", "counter", "Completed scan exports.", {}, counters["exports"]
+    yield "vaidra_export_rows_total", "counter", "Scan rows sent by exports.", {}, counters["rows"]
+    yield "vaidra_export_bytes_total", "counter", "Bytes sent by exports.", {}, counters["bytes"]
+    yield "vaidra_exports_active", "gauge", "Exports currently streaming.", {}, counters["active"]
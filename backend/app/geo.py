@@ -0,0 +1,96 @@
+"""
+Proximity search over user locations without PostGIS.
+
+Every user with a location also stores its geohash (kept current by
+update_profile), indexed as a plain string. A radius query picks the finest
+geohash precision whose cells are at least radius_km on each side. The 3x3
+block of cells around the query point then covers the whole circle. Each cell
+is an index range scan (geohash >= cell AND geohash < cell + "{"), which works
+on SQLite and Postgres alike. Exact distances are computed with numpy, only
+for the users in those cells.
+"""
+import math
+from sqlalchemy import and_, or_, select
+from app import models
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 9  # ~5 m cells; enough for any query
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.195
+# sorts after every geohash character, so [cell, cell + "{") is the cell's prefix range
+_PREFIX_END = "{"
+
+
+def encode(lat: float, lng: float, precision: int = PRECISION) -> str:
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def cell_degrees(precision: int):
+    """(height, width) of a geohash cell in degrees."""
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def cover(lat: float, lng: float, radius_km: float):
+    """Geohash cells that together contain the circle, or None if it is too big to narrow."""
+    # cells are narrowest on the side nearest a pole
+    worst_lat = min(90.0, abs(lat) + radius_km / KM_PER_DEGREE)
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_degrees(precision)
+        if height * KM_PER_DEGREE >= radius_km and width * KM_PER_DEGREE * math.cos(math.radians(worst_lat)) >= radius_km:
+            break
+    else:
+        return None
+    cells = set()
+    for dlat in (-height, 0.0, height):
+        for dlng in (-width, 0.0, width):
+            cell_lat = max(-90.0, min(90.0, lat + dlat))
+            cell_lng = (lng + dlng + 180.0) % 360.0 - 180.0
+            cells.add(encode(cell_lat, cell_lng, precision))
+    return sorted(cells)
+
+
+def haversine_km(lat: float, lng: float, lats, lngs):
+    """Great-circle distances from one point to arrays of points, as a numpy array."""
+    import numpy as np
+
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2, lng2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lngs, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+async def users_within(db, lat: float, lng: float, radius_km: float, limit: int):
+    """Up to `limit` (user_id, distance_km) pairs inside the radius, nearest first."""
+    User = models.User
+    q = select(User.id, User.location_lat, User.location_lng).where(User.geohash.isnot(None))
+    cells = cover(lat, lng, radius_km)
+    if cells is not None:
+        q = q.where(or_(*(and_(User.geohash >= c, User.geohash < c + _PREFIX_END) for c in cells)))
+    rows = (await db.execute(q)).all()
+    if not rows:
+        return []
+    import numpy as np
+
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    distances = haversine_km(lat, lng, [r[1] for r in rows], [r[2] for r in rows])
+    inside = np.flatnonzero(distances <= radius_km)
+    nearest = inside[np.argsort(distances[inside], kind="stable")][:limit]
+    return [(int(ids[i]), float(distances[i])) for i in nearest]
@@ -0,0 +1,15 @@
+"""
+The uvicorn worker gunicorn.conf.py runs. Imported only by gunicorn, which
+the app itself does not need.
+"""
+from uvicorn.workers import UvicornWorker
+from app.config import settings
+
+
+class Worker(UvicornWorker):
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        # open connections get this long to finish; it ends before gunicorn's
+        # graceful_timeout so the shutdown handlers (job workers, pools) still run
+        "timeout_graceful_shutdown": max(1, settings.GRACEFUL_TIMEOUT_SECONDS - 5),
+    }
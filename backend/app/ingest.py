@@ -0,0 +1,280 @@
+"""
+Single-pass streaming upload ingestion.
+
+Starlette's UploadFile spools the whole body to a temp file before the endpoint
+runs, which we then copied a second time into UPLOAD_DIR. Here the multipart
+body is parsed straight off the socket: each file part is sniffed from its
+first bytes, size-checked and hashed chunk by chunk, and written to
+UPLOAD_DIR/incoming with async file I/O. Oversized or non-image uploads are
+rejected as soon as that is known, without reading the rest of the body. Once
+the whole form is in, each file is moved into the content-addressed blob
+store (app/storage.py) under its hash.
+"""
+import datetime
+import hashlib
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+import anyio
+import multipart
+from multipart.multipart import parse_options_header
+from fastapi import HTTPException, Request
+from app import metrics, storage
+from app.config import settings
+
+UPLOAD_DIR = settings.UPLOAD_DIR
+INCOMING_DIR = storage.blobs.incoming
+os.makedirs(INCOMING_DIR, exist_ok=True)
+
+# Bytes needed to recognise every format below.
+SNIFF_BYTES = 12
+MAX_FIELD_BYTES = 64 * 1024
+# Rough allowance for multipart boundaries and part headers when checking Content-Length.
+MULTIPART_OVERHEAD = 16 * 1024
+
+
+@dataclass
+class IngestedFile:
+    field: str
+    original_filename: str
+    filename: str  # path relative to UPLOAD_DIR
+    path: str
+    content_type: str  # sniffed, not the client-declared type
+    size: int
+    sha256: str
+
+
+@dataclass
+class IngestedForm:
+    files: list = field(default_factory=list)
+    fields: dict = field(default_factory=dict)
+
+
+def sniff_image_type(head: bytes):
+    """Return the MIME type for a supported image signature, or None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head.startswith(b"BM"):
+        return "image/bmp"
+    return None
+
+
+def safe_name(original_filename: str) -> str:
+    name = os.path.basename((original_filename or "").replace("\\", "/"))
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", name).lstrip(".")
+    return name[:100] or "upload"
+
+
+def upload_filename(original_filename: str) -> str:
+    timestamp = int(datetime.datetime.utcnow().timestamp() * 1000)
+    return f"{timestamp}_{uuid.uuid4().hex[:8]}_{safe_name(original_filename)}"
+
+
+def openapi_body(file_field: str, multiple: bool = False, fields: dict = None) -> dict:
+    """openapi_extra for endpoints that read the multipart body themselves."""
+    file_schema = {"type": "string", "format": "binary"}
+    if multiple:
+        file_schema = {"type": "array", "items": file_schema}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": [file_field],
+                        "properties": {file_field: file_schema, **(fields or {})},
+                    }
+                }
+            },
+        }
+    }
+
+
+class _Part:
+    def __init__(self):
+        self.header_field = b""
+        self.header_value = b""
+        self.headers = {}
+        self.name = None
+        self.filename = None
+        self.data = bytearray()  # form field value, or sniff buffer for files
+        self.file = None
+        self.path = None
+        self.hasher = None
+        self.size = 0
+        self.content_type = None
+
+
+def discard(form: IngestedForm):
+    """Delete every file written for this form (before it is moved into the blob store)."""
+    for f in form.files:
+        if os.path.exists(f.path):
+            os.remove(f.path)
+
+
+async def ingest_multipart(request: Request, file_field: str, max_files: int = 1, int_fields=()) -> IngestedForm:
+    """
+    Stream a multipart/form-data body into the blob store.
+
+    Parts named `file_field` are stored as images (at most `max_files` of them);
+    every other part is read as a small text field. Fields named in
+    `int_fields` are converted to int (or None when absent or empty).
+    """
+    with metrics.span("upload"):
+        form = await _ingest_multipart(request, file_field, max_files, int_fields)
+        try:
+            await storage.adopt(form.files)
+        except BaseException:
+            discard(form)
+            raise
+        return form
+
+
+async def _ingest_multipart(request: Request, file_field: str, max_files: int, int_fields) -> IngestedForm:
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=415, detail="Expected multipart/form-data")
+
+    max_bytes = settings.MAX_UPLOAD_BYTES
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes * max_files + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+
+    form = IngestedForm()
+    events = []
+    current = None
+
+    def on_part_begin():
+        nonlocal current
+        current = _Part()
+
+    def on_header_field(data, start, end):
+        current.header_field += data[start:end]
+
+    def on_header_value(data, start, end):
+        current.header_value += data[start:end]
+
+    def on_header_end():
+        current.headers[current.header_field.lower()] = current.header_value
+        current.header_field = b""
+        current.header_value = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(current.headers.get(b"content-disposition", b""))
+        current.name = options.get(b"name", b"").decode("latin-1")
+        filename = options.get(b"filename")
+        current.filename = filename.decode("utf-8", "replace") if filename is not None else None
+        events.append(("begin", current))
+
+    def on_part_data(data, start, end):
+        events.append(("data", current, bytes(data[start:end])))
+
+    def on_part_end():
+        events.append(("end", current))
+
+    parser = multipart.MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    async def open_destination(part: _Part):
+        part.content_type = sniff_image_type(bytes(part.data[:SNIFF_BYTES]))
+        if part.content_type is None:
+            raise HTTPException(status_code=415, detail="Unsupported file type; expected a JPEG, PNG, WEBP, GIF or BMP image")
+        stored = upload_filename(part.filename)
+        part.path = os.path.join(INCOMING_DIR, stored)
+        # registered before the file exists so error cleanup always sees it
+        form.files.append(IngestedFile(
+            field=part.name, original_filename=part.filename, filename=os.path.relpath(part.path, UPLOAD_DIR),
+            path=part.path, content_type=part.content_type, size=0, sha256="",
+        ))
+        part.file = await anyio.open_file(part.path, "wb")
+        await write(part, bytes(part.data))
+        part.data = bytearray()
+
+    disk_seconds = 0.0
+
+    async def write(part: _Part, data: bytes):
+        nonlocal disk_seconds
+        started = time.perf_counter()
+        await part.file.write(data)
+        disk_seconds += time.perf_counter() - started
+
+    open_parts = []
+    file_parts = 0
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event in events:
+                kind, part = event[0], event[1]
+                is_file = part.name == file_field and part.filename is not None
+                if kind == "begin":
+                    if is_file:
+                        file_parts += 1
+                        if file_parts > max_files:
+                            raise HTTPException(status_code=400, detail=f"At most {max_files} file(s) per request")
+                        part.hasher = hashlib.sha256()
+                        open_parts.append(part)
+                elif kind == "data":
+                    data = event[2]
+                    if is_file:
+                        part.size += len(data)
+                        if part.size > max_bytes:
+                            raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+                        part.hasher.update(data)
+                        if part.file is None:
+                            part.data += data
+                            if len(part.data) >= SNIFF_BYTES:
+                                await open_destination(part)
+                        else:
+                            await write(part, data)
+                    else:
+                        part.data += data
+                        if len(part.data) > MAX_FIELD_BYTES:
+                            raise HTTPException(status_code=413, detail="Form field too large")
+                elif kind == "end":
+                    if is_file:
+                        if part.file is None:
+                            await open_destination(part)
+                        await part.file.aclose()
+                        open_parts.remove(part)
+                        stored = next(f for f in form.files if f.path == part.path)
+                        stored.size = part.size
+                        stored.sha256 = part.hasher.hexdigest()
+                    elif part.name:
+                        form.fields[part.name] = part.data.decode("utf-8", "replace")
+            events.clear()
+        parser.finalize()
+    except BaseException:
+        for part in open_parts:
+            if part.file is not None:
+                await part.file.aclose()
+        discard(form)
+        raise
+
+    if open_parts or not any(f.field == file_field for f in form.files):
+        discard(form)
+        raise HTTPException(status_code=422, detail=f"Missing file field '{file_field}'")
+    for name in int_fields:
+        value = form.fields.get(name)
+        try:
+            form.fields[name] = int(value) if value not in (None, "") else None
+        except ValueError:
+            discard(form)
+            raise HTTPException(status_code=422, detail=f"'{name}' must be an integer")
+    metrics.observe_stage("disk_write", disk_seconds)
+    return form
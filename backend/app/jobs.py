@@ -0,0 +1,292 @@
+"""
+Accept-then-process scan pipeline.
+
+POST /scans/jobs persists the upload and a scan_jobs row, then returns 202
+straight away. A fixed pool of asyncio workers drains a bounded in-process
+queue; DB steps use async sessions, storage uploads run in the threadpool
+and the AI call is awaited directly. The scan_jobs table is the source of truth: a sweeper
+re-enqueues PENDING rows (including ones left behind by a restart) whenever
+the queue has room, and a claim UPDATE makes sure only one worker process
+ever runs a given job.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, HTTPException, Request, Response
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import AsyncSessionLocal
+from app import events, logs, metrics, models, read_cache, schemas, stats, storage
+from app.config import settings
+from app.ingest import UPLOAD_DIR, ingest_multipart
+from app.scans import SCAN_UPLOAD_BODY, analyze_and_store, build_scan, scan_response
+
+router = APIRouter(prefix="/scans/jobs", tags=["scans"])
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, DONE, FAILED = "PENDING", "RUNNING", "DONE", "FAILED"
+FINISHED = {DONE, FAILED}
+
+_queue: asyncio.Queue = None
+_queued: set = set()
+_tasks: list = []
+# Replaced every time a job finishes; long-polls wait on it and then re-check the DB.
+_finished = None
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Scan queue is full. Please retry shortly.",
+        headers={"Retry-After": str(settings.SCAN_JOB_RETRY_AFTER_SECONDS)},
+    )
+
+
+def _enqueue(job_id: str) -> bool:
+    if job_id in _queued:
+        return True
+    try:
+        _queue.put_nowait(job_id)
+    except asyncio.QueueFull:
+        return False
+    _queued.add(job_id)
+    return True
+
+
+def _notify_finished():
+    global _finished
+    _finished.set()
+    _finished = asyncio.Event()
+
+
+def _job_response(job: models.ScanJob, scan: models.Scan = None) -> schemas.ScanJobResponse:
+    return schemas.ScanJobResponse(
+        id=job.id,
+        status=job.status,
+        scan_id=job.scan_id,
+        error=job.error,
+        result=scan_response(scan) if scan is not None else None,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+    )
+
+
+# --- DB steps ---
+
+async def _insert_job(filename: str, original_filename: str, image_sha256: str, user_id) -> schemas.ScanJobResponse:
+    now = _now()
+    async with AsyncSessionLocal() as db:
+        job = models.ScanJob(
+            id=uuid.uuid4().hex,
+            status=PENDING,
+            user_id=user_id,
+            filename=filename,
+            original_filename=original_filename,
+            image_sha256=image_sha256,
+            attempts=0,
+            created_at=now,
+            updated_at=now,
+        )
+        db.add(job)
+        await db.commit()
+        return _job_response(job)
+
+
+async def _discard_job(job_id: str):
+    # the upload's blob may be shared; the lifecycle job deletes it once nothing references it
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(models.ScanJob).where(models.ScanJob.id == job_id))
+        await db.commit()
+
+
+async def _load_job(job_id: str):
+    async with AsyncSessionLocal() as db:
+        job = await db.get(models.ScanJob, job_id)
+        if job is None:
+            return None
+        scan = await db.get(models.Scan, job.scan_id) if job.scan_id else None
+        return _job_response(job, scan)
+
+
+async def _claim(job_id: str) -> bool:
+    Job = models.ScanJob
+    async with AsyncSessionLocal() as db:
+        claimed = await db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == PENDING)
+            .values(status=RUNNING, updated_at=_now(), attempts=Job.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        return claimed.rowcount == 1
+
+
+async def _complete(db: AsyncSession, job: models.ScanJob, scan: models.Scan):
+    db.add(scan)
+    with metrics.span("db_commit"):
+        await db.flush()
+        await stats.record_scans(db, [scan.id])
+        await storage.add_refs(db, [scan])
+        job.scan_id = scan.id
+        job.status = DONE
+        job.updated_at = _now()
+        await db.commit()
+    read_cache.recent_scans.invalidate()
+    await db.refresh(scan)  # created_at is set by the database
+    await events.case_created([scan])
+
+
+async def _run(job_id: str):
+    async with AsyncSessionLocal() as db:
+        job = await db.get(models.ScanJob, job_id)
+        local_path = os.path.join(UPLOAD_DIR, job.filename)
+        result, s3_key = await analyze_and_store(db, local_path, job.filename, job.image_sha256)
+        scan = build_scan(job.user_id, job.filename, s3_key, result)
+        await _complete(db, job, scan)
+
+
+async def _fail(job_id: str, error: str):
+    async with AsyncSessionLocal() as db:
+        job = await db.get(models.ScanJob, job_id)
+        if job is not None:
+            job.status = FAILED
+            job.error = error
+            job.updated_at = _now()
+            await db.commit()
+
+
+async def _pending_jobs(limit: int, skip: list) -> list:
+    Job = models.ScanJob
+    async with AsyncSessionLocal() as db:
+        # RUNNING rows that stopped updating belong to a worker that died mid-job
+        stale = _now() - timedelta(seconds=settings.SCAN_JOB_STALE_SECONDS)
+        await db.execute(
+            update(Job)
+            .where(Job.status == RUNNING, Job.updated_at < stale)
+            .values(status=PENDING)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        q = select(Job.id).where(Job.status == PENDING)
+        if skip:
+            q = q.where(Job.id.notin_(skip))
+        return list(await db.scalars(q.order_by(Job.created_at.asc()).limit(limit)))
+
+
+# --- worker pool ---
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        _queued.discard(job_id)
+        # log lines from this job carry its id in place of a request id
+        logs.request_id.set(f"job-{job_id}")
+        try:
+            if await _claim(job_id):
+                try:
+                    await _run(job_id)
+                except Exception as e:
+                    logger.exception("Scan job %s failed: %s", job_id, e)
+                    await _fail(job_id, str(e))
+                _notify_finished()
+        except Exception as e:
+            logger.exception("Scan job worker error on %s: %s", job_id, e)
+        finally:
+            _queue.task_done()
+
+
+async def _sweeper():
+    while True:
+        try:
+            free = _queue.maxsize - _queue.qsize()
+            if free > 0:
+                for job_id in await _pending_jobs(free, list(_queued)):
+                    if not _enqueue(job_id):
+                        break
+        except Exception as e:
+            logger.warning("Scan job sweeper error: %s", e)
+        await asyncio.sleep(settings.SCAN_JOB_POLL_SECONDS)
+
+
+async def start():
+    global _queue, _finished
+    _queue = asyncio.Queue(maxsize=settings.SCAN_JOB_QUEUE_SIZE)
+    _finished = asyncio.Event()
+    for _ in range(settings.SCAN_JOB_WORKERS):
+        _tasks.append(asyncio.create_task(_worker()))
+    # the first sweep runs immediately and picks up jobs left over from a restart
+    _tasks.append(asyncio.create_task(_sweeper()))
+
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    _queued.clear()
+
+
+@metrics.collector
+def _queue_metrics():
+    stats = queue_stats()
+    yield "vaidra_scan_jobs_queued", "gauge", "Scan jobs waiting in this process's queue.", {}, stats["queued"]
+    yield "vaidra_scan_jobs_queue_size", "gauge", "Capacity of the scan job queue.", {}, stats["queue_size"]
+
+
+def queue_stats() -> dict:
+    return {
+        "queued": _queue.qsize() if _queue else 0,
+        "queue_size": settings.SCAN_JOB_QUEUE_SIZE,
+        "workers": settings.SCAN_JOB_WORKERS,
+    }
+
+
+# --- endpoints ---
+
+@router.post("", status_code=202, response_model=schemas.ScanJobResponse, openapi_extra=SCAN_UPLOAD_BODY)
+async def submit_job(request: Request, response: Response):
+    # reject before reading the body when there is no room
+    if _queue is None or _queue.full():
+        raise _busy()
+
+    form = await ingest_multipart(request, "scan_image", int_fields=("user_id",))
+    upload = form.files[0]
+    user_id = form.fields["user_id"]
+    job = await _insert_job(upload.filename, upload.original_filename, upload.sha256, user_id)
+
+    if not _enqueue(job.id):
+        await _discard_job(job.id)
+        raise _busy()
+
+    response.headers["Location"] = f"{router.prefix}/{job.id}"
+    return job
+
+
+@router.get("/{job_id}", response_model=schemas.ScanJobResponse)
+async def get_job(job_id: str, wait: float = 0):
+    """Return job status. With `wait` > 0, long-poll up to that many seconds for the job to finish."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(max(wait, 0), settings.SCAN_JOB_MAX_WAIT_SECONDS)
+    while True:
+        job = await _load_job(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        remaining = deadline - loop.time()
+        if job.status in FINISHED or remaining <= 0:
+            return job
+        # wake on any local completion, or re-check the DB every second for
+        # jobs picked up by another worker process
+        timeout = min(remaining, 1.0)
+        if _finished is None:
+            await asyncio.sleep(timeout)
+            continue
+        try:
+            await asyncio.wait_for(_finished.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
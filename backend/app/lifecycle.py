@@ -0,0 +1,311 @@
+"""
+Background upkeep of the blob store (see app/storage.py).
+
+Every BLOB_LIFECYCLE_INTERVAL_SECONDS, one pass:
+- collects: blobs that no scan or pending job references and that have been
+  unseen for BLOB_GC_GRACE_HOURS are deleted from disk and from the bucket
+- tiers: with USE_S3, blobs nobody has uploaded again for
+  BLOB_TIER_AFTER_DAYS are put in the bucket (if they are not there yet)
+  and their local copy is deleted; images and thumbnails are then read from S3
+- every BLOB_ORPHAN_SWEEP_HOURS, sweeps: files in the shard tree with no row
+  claiming a local copy, and stale leftovers in incoming/, are deleted
+
+Rows change through conditional UPDATEs/DELETEs that only match while the
+blob is still idle, so an upload of the same bytes (which bumps
+last_seen_at) always wins, and passes running in several workers at once are
+safe. Files are renamed aside first and put back if an upload claimed the
+blob in the meantime.
+
+    python -m app.lifecycle                 # one pass, including the orphan sweep
+    python -m app.lifecycle --adopt-legacy  # move flat pre-blob uploads into the blob store
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+import anyio
+from sqlalchemy import and_, case, delete, exists, func, select, update
+from app import metrics, models, storage
+from app.config import settings
+from app.db import AsyncSessionLocal, upsert_insert
+from app.ingest import sniff_image_type
+from app.jobs import PENDING, RUNNING
+
+logger = logging.getLogger(__name__)
+
+counters = {"runs": 0, "failures": 0, "tiered": 0, "collected": 0, "orphans": 0, "bytes_freed": 0}
+_task = None
+_last_sweep = None
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+async def _retire(sha256: str) -> bool:
+    """Delete a blob's local file unless an upload reclaimed it."""
+    aside = await anyio.to_thread.run_sync(storage.blobs.set_aside, sha256)
+    if aside is None:
+        return False
+    async with AsyncSessionLocal() as db:
+        wanted = await db.scalar(select(models.Blob.local).where(models.Blob.sha256 == sha256))
+    if wanted:
+        await anyio.to_thread.run_sync(storage.blobs.restore, sha256, aside)
+        return False
+    counters["bytes_freed"] += os.path.getsize(aside)
+    os.remove(aside)
+    return True
+
+
+async def tier() -> int:
+    if not settings.USE_S3 or settings.BLOB_TIER_AFTER_DAYS <= 0:
+        return 0
+    Blob = models.Blob
+    cutoff = _now() - timedelta(days=settings.BLOB_TIER_AFTER_DAYS)
+    idle = and_(Blob.local.is_(True), Blob.last_seen_at < cutoff)
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(Blob.sha256, Blob.s3_key).where(idle).order_by(Blob.last_seen_at).limit(settings.BLOB_LIFECYCLE_BATCH_SIZE)
+        )).all()
+    tiered = 0
+    for sha256, key in rows:
+        if key is None:
+            key = storage.s3_blobs.key_for(sha256)
+            try:
+                await anyio.to_thread.run_sync(storage.s3_blobs.put, storage.blobs.path(sha256), key)
+            except FileNotFoundError:
+                logger.error("Blob %s has no local copy and is not in storage", sha256)
+                key = None
+            except Exception as e:
+                logger.warning("Could not move blob %s to storage: %s", sha256, e)
+                break  # storage is unhealthy; try again next pass
+        async with AsyncSessionLocal() as db:
+            moved = await db.execute(update(Blob).where(Blob.sha256 == sha256, idle).values(local=False, s3_key=key))
+            if moved.rowcount and key:
+                # scans whose own upload never went through read the blob's object instead
+                await db.execute(
+                    update(models.Scan)
+                    .where(models.Scan.blob_sha256 == sha256, models.Scan.s3_key.is_(None))
+                    .values(s3_key=key)
+                )
+            await db.commit()
+        if moved.rowcount:
+            await _retire(sha256)
+            tiered += 1
+    counters["tiered"] += tiered
+    return tiered
+
+
+async def collect() -> int:
+    Blob, Scan, Job = models.Blob, models.Scan, models.ScanJob
+    cutoff = _now() - timedelta(hours=settings.BLOB_GC_GRACE_HOURS)
+    # refcount is the fast filter; the NOT EXISTS checks keep a drifted count from losing data
+    idle = and_(
+        Blob.refcount <= 0,
+        Blob.last_seen_at < cutoff,
+        ~exists().where(Scan.blob_sha256 == Blob.sha256),
+        ~exists().where(Job.image_sha256 == Blob.sha256, Job.status.in_((PENDING, RUNNING))),
+    )
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(Blob.sha256, Blob.s3_key).where(idle).limit(settings.BLOB_LIFECYCLE_BATCH_SIZE)
+        )).all()
+    collected = 0
+    for sha256, key in rows:
+        async with AsyncSessionLocal() as db:
+            removed = await db.execute(delete(Blob).where(Blob.sha256 == sha256, idle))
+            await db.commit()
+        if not removed.rowcount:
+            continue
+        await _retire(sha256)
+        if key and settings.USE_S3:
+            try:
+                await anyio.to_thread.run_sync(storage.s3_blobs.delete, key)
+            except Exception as e:
+                logger.warning("Could not delete %s from storage: %s", key, e)
+        collected += 1
+    counters["collected"] += collected
+    return collected
+
+
+def _stale_incoming(cutoff: float) -> int:
+    removed = 0
+    for entry in os.scandir(storage.blobs.incoming):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+async def sweep() -> int:
+    """Delete local files no blob row claims, one top-level shard at a time."""
+    cutoff = time.time() - settings.BLOB_GC_GRACE_HOURS * 3600
+    orphans = await anyio.to_thread.run_sync(_stale_incoming, cutoff)
+    for shard in await anyio.to_thread.run_sync(storage.blobs.shards):
+        old = await anyio.to_thread.run_sync(
+            lambda: [sha256 for sha256, _, mtime in storage.blobs.files(shard) if mtime < cutoff]
+        )
+        for start in range(0, len(old), 500):
+            chunk = old[start:start + 500]
+            async with AsyncSessionLocal() as db:
+                claimed = set(await db.scalars(
+                    select(models.Blob.sha256).where(models.Blob.sha256.in_(chunk), models.Blob.local.is_(True))
+                ))
+            for sha256 in chunk:
+                if sha256 not in claimed and await _retire(sha256):
+                    orphans += 1
+    counters["orphans"] += orphans
+    return orphans
+
+
+async def run_once(sweep_orphans: bool = False) -> dict:
+    # collect first, so garbage is never uploaded just to be deleted
+    result = {"collected": await collect(), "tiered": await tier()}
+    if sweep_orphans:
+        result["orphans"] = await sweep()
+    counters["runs"] += 1
+    return result
+
+
+async def _loop():
+    global _last_sweep
+    while True:
+        await asyncio.sleep(settings.BLOB_LIFECYCLE_INTERVAL_SECONDS)
+        due = _last_sweep is None or time.monotonic() - _last_sweep >= settings.BLOB_ORPHAN_SWEEP_HOURS * 3600
+        try:
+            result = await run_once(sweep_orphans=due)
+            if due:
+                _last_sweep = time.monotonic()
+            if any(result.values()):
+                logger.info("Blob lifecycle pass: %s", result)
+        except Exception as e:
+            counters["failures"] += 1
+            logger.warning("Blob lifecycle pass failed: %s", e)
+
+
+def start():
+    global _task
+    if settings.BLOB_LIFECYCLE_INTERVAL_SECONDS > 0 and _task is None:
+        _task = asyncio.create_task(_loop())
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+
+
+async def stats(db) -> dict:
+    Blob = models.Blob
+    row = (await db.execute(select(
+        func.count(),
+        func.coalesce(func.sum(Blob.size), 0),
+        func.coalesce(func.sum(Blob.refcount), 0),
+        func.sum(case((Blob.local.is_(True), 1), else_=0)),
+        func.sum(case((Blob.s3_key.isnot(None), 1), else_=0)),
+        func.sum(case((Blob.refcount <= 0, 1), else_=0)),
+    ))).one()
+    return {
+        "blobs": row[0],
+        "bytes": int(row[1]),
+        "references": int(row[2]),
+        "local": int(row[3] or 0),
+        "in_s3": int(row[4] or 0),
+        "unreferenced": int(row[5] or 0),
+        **storage.blob_counters,
+        **counters,
+    }
+
+
+@metrics.collector
+def _lifecycle_metrics():
+    for result in ("stored", "deduplicated"):
+        yield "vaidra_blob_uploads_total", "counter", "Uploads by whether their bytes were already stored.", {"result": result}, storage.blob_counters[result]
+    for action in ("tiered", "collected", "orphans"):
+        yield "vaidra_blob_lifecycle_total", "counter", "Blobs handled by the lifecycle job, by action.", {"action": action}, counters[action]
+    yield "vaidra_blob_lifecycle_freed_bytes_total", "counter", "Local bytes freed by the lifecycle job.", {}, counters["bytes_freed"]
+
+
+def _hash_file(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        head = f.read(16)
+        digest.update(head)
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest(), sniff_image_type(head)
+
+
+def adopt_legacy(batch_size: int = 500) -> int:
+    """Move scans' flat UPLOAD_DIR files into the blob store; returns the scans moved."""
+    from app.db import SessionLocal
+
+    Scan, Blob = models.Scan, models.Blob
+    moved, last_id = 0, 0
+    with SessionLocal() as db:
+        while True:
+            rows = db.execute(
+                select(Scan.id, Scan.filename, Scan.s3_key)
+                .where(Scan.blob_sha256.is_(None), Scan.id > last_id)
+                .order_by(Scan.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return moved
+            last_id = rows[-1][0]
+            for scan_id, filename, s3_key in rows:
+                path = os.path.join(settings.UPLOAD_DIR, filename)
+                if not os.path.isfile(path):
+                    continue
+                sha256, content_type = _hash_file(path)
+                target = storage.blobs.path(sha256)
+                if not os.path.exists(target):
+                    # a hard link, so the scan's file stays valid until its row points at the blob
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.link(path, target)
+                stmt = upsert_insert(Blob.__table__).values(
+                    sha256=sha256, size=os.path.getsize(path), content_type=content_type, refcount=0,
+                    local=True, s3_key=s3_key if settings.USE_S3 else None, last_seen_at=_now(),
+                )
+                db.execute(stmt.on_conflict_do_update(index_elements=["sha256"], set_={"local": True}))
+                db.execute(update(Blob).where(Blob.sha256 == sha256).values(refcount=Blob.refcount + 1))
+                db.execute(
+                    update(Scan).where(Scan.id == scan_id)
+                    .values(filename=storage.blobs.relative_path(sha256), blob_sha256=sha256)
+                )
+                db.commit()
+                os.remove(path)
+                moved += 1
+
+
+async def _run_cli_pass() -> dict:
+    from app.db import async_engine
+
+    try:
+        return await run_once(sweep_orphans=True)
+    finally:
+        await async_engine.dispose()  # lets the process exit with aiosqlite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the blob lifecycle once, or adopt pre-blob uploads.")
+    parser.add_argument("--adopt-legacy", action="store_true", help="move flat UPLOAD_DIR files into the blob store first")
+    args = parser.parse_args(argv)
+
+    if args.adopt_legacy:
+        print(f"Moved {adopt_legacy()} legacy uploads into the blob store")
+    print(f"Lifecycle pass: {asyncio.run(_run_cli_pass())}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Client-side flow control for calls to the AI service.
+
+Every call goes through a token bucket sized to our upstream quota and an
+AIMD concurrency limiter: the in-flight limit grows by ~1 per window of
+successful calls and halves when the upstream answers 429, bounded by a hard
+global cap. Retryable failures are retried with full-jitter exponential
+backoff. Errors are classified by duck typing: exceptions with a truthy
+`retryable` attribute are retried, ones with `rate_limited` also shrink the
+limit.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+
+class LimiterTimeout(Exception):
+    """Raised when a call could not get a token or a slot in time."""
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token if one is available; otherwise return seconds until one is."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0.0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise LimiterTimeout("AI request rate limit reached")
+            await asyncio.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit between min_limit and max_limit."""
+
+    def __init__(self, min_limit: int, max_limit: int, decrease_cooldown: float = 1.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.decrease_cooldown = decrease_cooldown
+        self._last_decrease = 0.0
+        self._waiters = deque()
+
+    async def acquire(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while self.in_flight >= int(self.limit):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LimiterTimeout("Too many concurrent AI requests")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def on_success(self):
+        # additive increase: +1 after roughly `limit` successes
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_rate_limited(self):
+        # multiplicative decrease, at most once per cooldown so one burst of
+        # concurrent 429s counts as a single congestion signal
+        now = time.monotonic()
+        if now - self._last_decrease >= self.decrease_cooldown:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self._last_decrease = now
+
+
+class CallLimiter:
+    def __init__(
+        self,
+        rate_per_minute: float,
+        burst: int,
+        min_concurrency: int,
+        max_concurrency: int,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        acquire_timeout: float,
+    ):
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.concurrency = AdaptiveLimiter(min_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.acquire_timeout = acquire_timeout
+        self.counters = {"calls": 0, "succeeded": 0, "failed": 0, "retries": 0, "rate_limited": 0, "rejected": 0}
+
+    def backoff(self, attempt: int) -> float:
+        # "full jitter": uniform over [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def call(self, fn):
+        """Run `await fn()` under the limits, retrying retryable errors."""
+        self.counters["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                await self.bucket.acquire(self.acquire_timeout)
+                await self.concurrency.acquire(self.acquire_timeout)
+            except LimiterTimeout:
+                self.counters["rejected"] += 1
+                raise
+            try:
+                result = await fn()
+            except Exception as e:
+                if getattr(e, "rate_limited", False):
+                    self.counters["rate_limited"] += 1
+                    self.concurrency.on_rate_limited()
+                if not getattr(e, "retryable", False) or attempt >= self.max_retries:
+                    self.counters["failed"] += 1
+                    raise
+                self.counters["retries"] += 1
+                delay = self.backoff(attempt)
+                attempt += 1
+            else:
+                self.concurrency.on_success()
+                self.counters["succeeded"] += 1
+                return result
+            finally:
+                self.concurrency.release()
+            await asyncio.sleep(delay)
+
+    def state(self) -> dict:
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "min_concurrency": self.concurrency.min_limit,
+            "max_concurrency": self.concurrency.max_limit,
+            "in_flight": self.concurrency.in_flight,
+            "waiting": len(self.concurrency._waiters),
+            "tokens": round(min(self.bucket.capacity, self.bucket.tokens + (time.monotonic() - self.bucket.updated) * self.bucket.rate), 2),
+            "rate_per_minute": self.bucket.rate * 60,
+            "burst": self.bucket.capacity,
+            **self.counters,
+        }
@@ -1,13 +1,17 @@
 from fastapi import FastAPI
-from app import models
-from app.db import engine, Base
+from app.db import async_engine
 from app.auth import router as auth_router
 from app.scans import router as scans_router
 from app.doctor import router as doctor_router
-import os
+from app.admin import router as admin_router
+from app.jobs import router as jobs_router
+from app import events, jobs, lifecycle, logs, metrics, serving, storage
+from app.config import settings
+from fastapi.responses import JSONResponse, Response
 
-# create tables
-Base.metadata.create_all(bind=engine)
+logs.configure_logging()
+
+# the schema is managed by Alembic (start.sh runs `alembic upgrade head`)
 
 app = FastAPI(title="Vaidra Backend (FastAPI + Postgres + Perplexity)")
 
@@ -19,12 +23,61 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Request-ID", "Content-Range", "Accept-Ranges"],
 )
 
+# outermost, so the request id and timings cover everything below it
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
 app.include_router(auth_router)
 app.include_router(scans_router)
 app.include_router(doctor_router)
+app.include_router(jobs_router)
+app.include_router(admin_router)
+
+@app.on_event("startup")
+async def start_scan_workers():
+    await jobs.start()
+
+@app.on_event("startup")
+async def start_upload_retries():
+    storage.start_retry_worker()
+
+@app.on_event("startup")
+async def start_blob_lifecycle():
+    lifecycle.start()
+
+@app.on_event("startup")
+async def start_case_events():
+    await events.broadcaster.start()
+
+@app.on_event("startup")
+async def start_serving():
+    # last, so /ready only passes once everything above has started
+    await serving.start()
+
+@app.on_event("shutdown")
+async def stop_scan_workers():
+    await jobs.stop()
+    await storage.stop_retry_worker()
+    await lifecycle.stop()
+    await events.broadcaster.stop()
+
+@app.on_event("shutdown")
+async def close_db_connections():
+    await async_engine.dispose()
 
 @app.get("/health")
-def health():
+async def health():
     return {"status":"ok"}
+
+@app.get("/ready")
+async def ready():
+    """Whether this worker should get traffic; see app/serving.py."""
+    state = await serving.readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
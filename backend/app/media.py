@@ -0,0 +1,125 @@
+"""
+File responses for scan images and thumbnails: strong ETags, conditional
+GETs, single byte ranges and zero-copy sending.
+
+The body is sent without copying when the server allows it: through the ASGI
+zerocopysend extension if the server offers it, or through nginx with
+X-Accel-Redirect when MEDIA_ACCEL_REDIRECT_PREFIX is set. Otherwise the file
+is streamed in chunks from a worker thread.
+"""
+import os
+import anyio
+from fastapi import Request, Response
+from app.config import settings
+from app.ingest import sniff_image_type
+
+CHUNK_SIZE = 256 * 1024
+
+
+def file_etag(st: os.stat_result) -> str:
+    # uploads are never rewritten in place, so size + mtime identify the bytes
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int):
+    """
+    (start, end) inclusive for a single "bytes=" range, "unsatisfiable", or
+    None to ignore the header and send the whole file (which RFC 9110 allows
+    for malformed and multi-range requests).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:  # suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return "unsatisfiable"
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _matches(header: str, etag: str) -> bool:
+    return header.strip() == "*" or any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+
+def media_type_for(path: str) -> str:
+    with open(path, "rb") as f:
+        return sniff_image_type(f.read(16)) or "application/octet-stream"
+
+
+class RangedFileResponse(Response):
+    def __init__(self, request: Request, path: str, st: os.stat_result, media_type: str,
+                 etag: str = None, max_age: int = None):
+        self.path = path
+        self.etag = etag or file_etag(st)
+        self.offset, self.length = 0, st.st_size
+        self.send_body = request.method != "HEAD"
+        max_age = settings.SCAN_IMAGE_CACHE_SECONDS if max_age is None else max_age
+        headers = {
+            "ETag": self.etag,
+            "Accept-Ranges": "bytes",
+            "Cache-Control": f"private, max-age={max_age}",
+        }
+
+        status = 200
+        self.accel = None
+        relative = os.path.relpath(path, settings.UPLOAD_DIR)
+        if_none_match = request.headers.get("if-none-match")
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if if_none_match and _matches(if_none_match, self.etag):
+            status = 304
+        elif settings.MEDIA_ACCEL_REDIRECT_PREFIX and not relative.startswith(".."):
+            # nginx sends the file itself (sendfile, Range, If-Range) from an internal location
+            self.accel = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative.replace(os.sep, "/")
+            headers["X-Accel-Redirect"] = self.accel
+        elif range_header and (not if_range or if_range.strip() == self.etag):
+            byte_range = parse_range(range_header, st.st_size)
+            if byte_range == "unsatisfiable":
+                status = 416
+                headers["Content-Range"] = f"bytes */{st.st_size}"
+            elif byte_range is not None:
+                start, end = byte_range
+                status, self.offset, self.length = 206, start, end - start + 1
+                headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+        if status in (200, 206) and not self.accel:
+            headers["Content-Length"] = str(self.length)
+        else:
+            self.send_body = False
+        super().__init__(status_code=status, headers=headers, media_type=media_type if status in (200, 206) else None)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or not self.length:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend", "file": f.fileno(),
+                    "offset": self.offset, "count": self.length, "more_body": False,
+                })
+            return
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.offset)
+            remaining = self.length
+            while remaining:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:  # file shrank underneath us; end the body rather than hang
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
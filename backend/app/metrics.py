@@ -0,0 +1,208 @@
+"""
+Prometheus metrics with no client library.
+
+Histograms and counters are plain dicts of per-label-set arrays behind one
+lock each; an observation is a bisect plus a few additions, cheap enough to
+leave on in production. Stats that other modules already keep (DB pool, AI
+limiter, caches, job queue) are read at scrape time by collectors rather
+than duplicated here. Served at /metrics in the text exposition format.
+"""
+import bisect
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from app import logs
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> list:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in snapshot.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            inf = _labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+def collector(fn):
+    """Register fn() -> iterable of (name, type, help, {labels}, value) read at scrape time."""
+    _collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for fn in _collectors:
+        try:
+            samples = list(fn())
+        except Exception as e:  # a broken collector must not take /metrics down
+            logs.logger.warning("Metrics collector %s failed: %s", fn.__name__, e)
+            continue
+        # samples of one metric must be contiguous, whatever order they were yielded in
+        families = {}
+        for name, kind, help, labels, value in samples:
+            family = families.setdefault(name, [f"# HELP {name} {help}", f"# TYPE {name} {kind}"])
+            family.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        for family in families.values():
+            lines.extend(family)
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Histogram(
+    "vaidra_http_request_duration_seconds",
+    "HTTP request latency by route template, method and status.",
+    ("method", "route", "status"),
+)
+http_in_flight = Gauge("vaidra_http_requests_in_flight", "HTTP requests currently being served.")
+stage_seconds = Histogram(
+    "vaidra_stage_duration_seconds",
+    "Latency of each scan pipeline stage, by outcome.",
+    ("stage", "outcome"),
+)
+
+
+def observe_stage(stage: str, seconds: float, outcome: str = "ok"):
+    stage_seconds.observe(seconds, stage, outcome)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage; the outcome label is "error" if the block raises."""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage, outcome)
+        logs.logger.debug("stage %s %s in %.1f ms", stage, outcome, elapsed * 1000)
+
+
+class RequestMetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task or body buffering): assigns
+    a request id, echoes it as X-Request-ID, records request latency under the
+    matched route template and writes one access log line per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming[:64] if incoming.isprintable() and incoming else uuid.uuid4().hex[:16]
+        token = logs.request_id.set(request_id)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        http_in_flight.inc(amount=1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.inc(amount=-1)
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            # unmatched paths share one label so 404 scans can't explode cardinality
+            template = route.path if route is not None else "unmatched"
+            http_requests.observe(elapsed, scope["method"], template, str(status))
+            logs.access.info(
+                "%s %s %s %.1fms", scope["method"], template, status, elapsed * 1000,
+                extra={"method": scope["method"], "route": template, "status": status,
+                       "duration_ms": round(elapsed * 1000, 2)},
+            )
+            logs.request_id.reset(token)
@@ -1,10 +1,18 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date, DateTime, ForeignKey, Text, Index, JSON
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.sql import func
 from app.db import Base
 from sqlalchemy.orm import relationship
 
 # Severity values: MINOR, MODERATE, URGENT (stored as plain String to avoid PostgreSQL ENUM issues)
 
+# SQLite's CURRENT_TIMESTAMP has no fractional seconds; bind parameters must use
+# the same format or keyset comparisons on created_at go wrong for equal timestamps.
+CreatedAt = DateTime(timezone=True).with_variant(sqlite.DATETIME(truncate_microseconds=True), "sqlite")
+
+# Lists of strings: JSONB on PostgreSQL, JSON1 text on SQLite. None stays SQL NULL.
+JsonList = JSON(none_as_null=True).with_variant(postgresql.JSONB(none_as_null=True), "postgresql")
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -24,6 +32,10 @@ class User(Base):
     address = Column(String, nullable=True)
     location_lat = Column(Float, nullable=True)
     location_lng = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True, index=True)  # of (location_lat, location_lng); see app/geo.py
+
+    # bumped on every profile write; used as the profile ETag and cache stamp
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     scans = relationship("Scan", back_populates="user")
 
@@ -32,13 +44,84 @@ class Scan(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     user = relationship("User", back_populates="scans")
-    filename = Column(String, nullable=False)
+    filename = Column(String, nullable=False)  # relative to UPLOAD_DIR
     s3_key = Column(String, nullable=True)
+    blob_sha256 = Column(String(64), nullable=True, index=True)  # NULL for uploads from before blobs
     condition = Column(String, nullable=True)
     confidence = Column(Float, nullable=True)
     severity = Column(String, nullable=True)  # MINOR / MODERATE / URGENT
-    steps = Column(Text, nullable=True)    # pipe-separated
-    warnings = Column(Text, nullable=True) # pipe-separated
-    notes = Column(Text, nullable=True)
+    steps = Column(JsonList, nullable=True)     # list of strings
+    warnings = Column(JsonList, nullable=True)  # list of strings
+    notes = Column(Text, nullable=True)  # legacy; notes now live in scan_notes
     assigned_to = Column(Integer, nullable=True) # doctor user id
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(CreatedAt, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_scans_created_at_id", "created_at", "id"),
+        Index("ix_scans_severity_created_at", "severity", "created_at"),
+        Index("ix_scans_assigned_to_created_at", "assigned_to", "created_at"),
+    )
+
+class ScanNote(Base):
+    __tablename__ = "scan_notes"
+    id = Column(Integer, primary_key=True)
+    scan_id = Column(Integer, ForeignKey("scans.id"), nullable=False)
+    author_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    body = Column(Text, nullable=False)
+    created_at = Column(CreatedAt, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_scan_notes_scan_id_id", "scan_id", "id"),
+    )
+
+class ScanDailyStats(Base):
+    """Rollup of scans per UTC day, severity and condition; maintained by app/stats.py."""
+    __tablename__ = "scan_daily_stats"
+    day = Column(Date, primary_key=True)
+    severity = Column(String, primary_key=True)
+    condition = Column(String, primary_key=True)
+    scans = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+    confidence_count = Column(Integer, nullable=False, default=0)
+    unassigned = Column(Integer, nullable=False, default=0)
+
+class Blob(Base):
+    """An upload stored once by content hash; see app/storage.py and app/lifecycle.py."""
+    __tablename__ = "blobs"
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    content_type = Column(String, nullable=True)
+    refcount = Column(Integer, nullable=False, default=0)  # scans pointing at it
+    local = Column(Boolean, nullable=False, default=True)  # a copy is on local disk
+    s3_key = Column(String, nullable=True)
+    created_at = Column(CreatedAt, server_default=func.now())
+    last_seen_at = Column(CreatedAt, nullable=False)  # last upload of these bytes
+
+    __table_args__ = (
+        Index("ix_blobs_refcount_last_seen_at", "refcount", "last_seen_at"),
+        Index("ix_blobs_local_last_seen_at", "local", "last_seen_at"),
+    )
+
+class AnalysisCache(Base):
+    __tablename__ = "analysis_cache"
+    key = Column(String, primary_key=True)  # "<image sha256>:<prompt version>"
+    image_sha256 = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=False, index=True)
+    result = Column(Text, nullable=False)  # JSON: condition/confidence/severity/steps/warnings
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    last_used_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class ScanJob(Base):
+    __tablename__ = "scan_jobs"
+    id = Column(String, primary_key=True)  # uuid4 hex
+    status = Column(String, nullable=False, default="PENDING", index=True)  # PENDING / RUNNING / DONE / FAILED
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    filename = Column(String, nullable=False)  # relative to UPLOAD_DIR
+    original_filename = Column(String, nullable=True)
+    image_sha256 = Column(String, nullable=False)
+    scan_id = Column(Integer, ForeignKey("scans.id"), nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,92 @@
+"""
+Shrink scan images before they are sent to the AI service.
+
+Phone photos are routinely 12 MP with EXIF blocks attached; the model does not
+need either. The original upload on disk is never modified, so storage keeps
+the full-resolution image.
+"""
+import io
+import os
+import threading
+import time
+from app import metrics
+from app.config import settings
+
+_lock = threading.Lock()
+_stats = {"images": 0, "original_bytes": 0, "processed_bytes": 0, "total_ms": 0.0}
+
+
+def downscale(source, max_edge: int, quality: int):
+    """
+    Return (jpeg_bytes, width, height) for an image path or file object: EXIF
+    orientation applied, longest edge capped at max_edge, metadata stripped.
+    """
+    from PIL import Image, ImageOps  # on first use, not at startup
+
+    with Image.open(source) as img:
+        scale = max_edge / max(img.size)
+        if img.format == "JPEG" and scale < 1:
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full resolution.
+            img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        out = io.BytesIO()
+        # no exif= argument, so nothing from the original metadata is carried over
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+        return out.getvalue(), img.width, img.height
+
+
+def prepare_image(file_path: str):
+    """
+    Return (jpeg_bytes, info) for the image at file_path, shrunk to
+    AI_IMAGE_MAX_EDGE and re-encoded at AI_IMAGE_JPEG_QUALITY.
+    """
+    started = time.perf_counter()
+    original_bytes = os.path.getsize(file_path)
+    data, width, height = downscale(file_path, settings.AI_IMAGE_MAX_EDGE, settings.AI_IMAGE_JPEG_QUALITY)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    info = {
+        "original_bytes": original_bytes,
+        "processed_bytes": len(data),
+        "bytes_saved": original_bytes - len(data),
+        "width": width,
+        "height": height,
+        "ms": round(elapsed_ms, 2),
+    }
+    with _lock:
+        _stats["images"] += 1
+        _stats["original_bytes"] += original_bytes
+        _stats["processed_bytes"] += len(data)
+        _stats["total_ms"] += elapsed_ms
+    return data, info
+
+
+def stats() -> dict:
+    with _lock:
+        s = dict(_stats)
+    images = s["images"]
+    return {
+        "images": images,
+        "bytes_saved": s["original_bytes"] - s["processed_bytes"],
+        "avg_original_bytes": round(s["original_bytes"] / images) if images else 0,
+        "avg_processed_bytes": round(s["processed_bytes"] / images) if images else 0,
+        "avg_ms": round(s["total_ms"] / images, 2) if images else 0.0,
+        "max_edge": settings.AI_IMAGE_MAX_EDGE,
+        "jpeg_quality": settings.AI_IMAGE_JPEG_QUALITY,
+        "enabled": settings.AI_IMAGE_PREPROCESS,
+    }
+
+
+@metrics.collector
+def _preprocess_metrics():
+    s = stats()
+    yield "vaidra_preprocess_images_total", "counter", "Images shrunk before the AI call.", {}, s["images"]
+    yield "vaidra_preprocess_bytes_saved_total", "counter", "Bytes not sent to the AI service thanks to preprocessing.", {}, s["bytes_saved"]
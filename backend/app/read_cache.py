@@ -0,0 +1,104 @@
+"""
+Conditional GETs and an in-process read-through cache for hot reads.
+
+Every entry is stored with the version of the data it was built from
+(users.version for a profile, max(scans.id) for the recent-scans list).
+Readers fetch the current version with one indexed lookup. A matching
+If-None-Match gets a 304, a cached body built from the same version is sent
+as-is, and anything else is rebuilt. Writes in this process drop their
+entries right away. Writes made by other workers are caught by the version
+check, so the cache stays correct with any number of workers and without an
+invalidation channel between them.
+"""
+import threading
+from collections import OrderedDict
+from fastapi import Request, Response
+from app import metrics
+from app.config import settings
+
+
+class VersionedCache:
+    def __init__(self, name: str, max_entries: int):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[1]
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, version, body: bytes):
+        with self._lock:
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop one entry, or all of them when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self.counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, **self.counters}
+
+
+profiles = VersionedCache("profiles", settings.READ_CACHE_MAX_ENTRIES)
+# keyed by the requested limit only, so a handful of entries is plenty
+recent_scans = VersionedCache("recent_scans", 64)
+
+
+def etag(*parts) -> str:
+    return 'W/"' + "-".join(str(p) for p in parts) + '"'
+
+
+def not_modified(request: Request, tag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison: W/"x" and "x" name the same representation
+    wanted = tag[2:] if tag.startswith("W/") else tag
+    return any(
+        (candidate[2:] if candidate.startswith("W/") else candidate) == wanted
+        for candidate in (c.strip() for c in header.split(","))
+    )
+
+
+def _headers(tag: str) -> dict:
+    # clients may keep the body but must revalidate before reusing it
+    return {"ETag": tag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified_response(tag: str) -> Response:
+    return Response(status_code=304, headers=_headers(tag))
+
+
+def json_response(body: bytes, tag: str) -> Response:
+    return Response(content=body, media_type="application/json", headers=_headers(tag))
+
+
+def stats() -> dict:
+    return {cache.name: cache.stats() for cache in (profiles, recent_scans)}
+
+
+@metrics.collector
+def _cache_metrics():
+    for name, cache_stats in stats().items():
+        for result in ("hits", "misses"):
+            yield "vaidra_read_cache_requests_total", "counter", "Read cache lookups, by result.", {"cache": name, "result": result}, cache_stats[result]
+        yield "vaidra_read_cache_entries", "gauge", "Entries in the read cache.", {"cache": name}, cache_stats["entries"]
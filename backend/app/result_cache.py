@@ -0,0 +1,153 @@
+"""
+Persistent, content-addressed cache of AI analysis results.
+
+Entries are keyed by the SHA-256 of the uploaded image plus the prompt version,
+so re-uploads of the same photo skip the Gemini round trip, and changing the
+prompt or model automatically stops old results from being served.
+"""
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import metrics, models
+from app.ai_client import PROMPT_VERSION
+from app.config import settings
+from app.db import upsert_insert
+
+RESULT_FIELDS = ("condition", "confidence", "severity", "steps", "warnings")
+
+# Evict at most once every this many stores; eviction is a couple of DELETEs.
+EVICT_EVERY = 100
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_stores_since_evict = 0
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; everything we write is UTC.
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _count(name: str, n: int = 1):
+    with _lock:
+        _stats[name] += n
+
+
+def cache_key(image_sha256: str) -> str:
+    return f"{image_sha256}:{PROMPT_VERSION}"
+
+
+async def get(db: AsyncSession, image_sha256: str):
+    """Return the cached result dict for this image, or None on a miss."""
+    if not settings.ANALYSIS_CACHE_ENABLED:
+        return None
+    entry = await db.get(models.AnalysisCache, cache_key(image_sha256))
+    now = _now()
+    if entry is not None and _as_utc(entry.created_at) < now - timedelta(seconds=settings.ANALYSIS_CACHE_TTL_SECONDS):
+        await db.delete(entry)
+        await db.commit()
+        _count("evictions")
+        entry = None
+    if entry is None:
+        _count("misses")
+        return None
+    entry.hits = (entry.hits or 0) + 1
+    entry.last_used_at = now
+    await db.commit()
+    _count("hits")
+    return json.loads(entry.result)
+
+
+async def put(db: AsyncSession, image_sha256: str, result: dict):
+    """Store a normalized analysis result for this image."""
+    global _stores_since_evict
+    if not settings.ANALYSIS_CACHE_ENABLED:
+        return
+    now = _now()
+    payload = json.dumps({k: result.get(k) for k in RESULT_FIELDS})
+    # one statement, so two misses for the same image (a retried upload) cannot collide
+    stmt = upsert_insert(models.AnalysisCache.__table__).values(
+        key=cache_key(image_sha256),
+        image_sha256=image_sha256,
+        prompt_version=PROMPT_VERSION,
+        result=payload,
+        hits=0,
+        created_at=now,
+        last_used_at=now,
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"result": payload, "created_at": now, "last_used_at": now},
+    ))
+    await db.commit()
+    _count("stores")
+
+    with _lock:
+        _stores_since_evict += 1
+        due = _stores_since_evict >= EVICT_EVERY
+        if due:
+            _stores_since_evict = 0
+    if due:
+        await evict(db)
+
+
+async def evict(db: AsyncSession) -> int:
+    """Drop expired entries, then the least recently used ones above the size bound."""
+    Entry = models.AnalysisCache
+    cutoff = _now() - timedelta(seconds=settings.ANALYSIS_CACHE_TTL_SECONDS)
+    removed = (await db.execute(
+        delete(Entry).where(Entry.created_at < cutoff).execution_options(synchronize_session=False)
+    )).rowcount
+
+    overflow = await db.scalar(select(func.count()).select_from(Entry)) - settings.ANALYSIS_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        oldest = select(Entry.key).order_by(Entry.last_used_at.asc()).limit(overflow).subquery()
+        removed += (await db.execute(
+            delete(Entry).where(Entry.key.in_(select(oldest.c.key))).execution_options(synchronize_session=False)
+        )).rowcount
+    await db.commit()
+    _count("evictions", removed)
+    return removed
+
+
+async def invalidate(db: AsyncSession, everything: bool = False) -> int:
+    """
+    Delete entries written under an older prompt version, or every entry when
+    `everything` is set (e.g. to drop results from a misbehaving model release).
+    """
+    stmt = delete(models.AnalysisCache).execution_options(synchronize_session=False)
+    if not everything:
+        stmt = stmt.where(models.AnalysisCache.prompt_version != PROMPT_VERSION)
+    removed = (await db.execute(stmt)).rowcount
+    await db.commit()
+    _count("evictions", removed)
+    return removed
+
+
+async def stats(db: AsyncSession) -> dict:
+    with _lock:
+        counters = dict(_stats)
+    lookups = counters["hits"] + counters["misses"]
+    return {
+        **counters,
+        "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+        "entries": await db.scalar(select(func.count()).select_from(models.AnalysisCache)),
+        "max_entries": settings.ANALYSIS_CACHE_MAX_ENTRIES,
+        "ttl_seconds": settings.ANALYSIS_CACHE_TTL_SECONDS,
+        "prompt_version": PROMPT_VERSION,
+        "enabled": settings.ANALYSIS_CACHE_ENABLED,
+    }
+
+
+@metrics.collector
+def _result_cache_metrics():
+    with _lock:
+        counters = dict(_stats)
+    for key, value in counters.items():
+        yield "vaidra_analysis_cache_events_total", "counter", "Analysis result cache events.", {"event": key}, value
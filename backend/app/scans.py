@@ -1,90 +1,281 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status, Form
-from sqlalchemy.orm import Session
-from app.db import get_db
-from app import models, schemas
-from app.ai_client import analyze_image
-from app.storage import upload_to_storage
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, StreamingResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import AsyncSessionLocal, get_async_db
+from app import ai_providers, events, media, metrics, models, read_cache, schemas, result_cache, stats, storage, thumbnails
+from app.ai_client import AIRateLimitError, AIServiceError
+from app.ai_providers import normalize_result
 from app.config import settings
-import shutil, os, datetime, uuid
+from app.ingest import IngestedFile, ingest_multipart, openapi_body
+from app.storage import store_upload
+import asyncio, json, os
 
 router = APIRouter(prefix="/scans", tags=["scans"])
 
-UPLOAD_DIR = settings.UPLOAD_DIR
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+RETRY_AFTER_SECONDS = 10
+SCAN_UPLOAD_BODY = openapi_body("scan_image", fields={"user_id": {"type": "integer"}})
+BATCH_UPLOAD_BODY = openapi_body("scan_images", multiple=True, fields={"user_id": {"type": "integer"}})
 
-@router.get("/recent", response_model=list[schemas.ScanResponse])
-def get_recent_scans(db: Session = Depends(get_db), limit: int = 5):
-    scans = db.query(models.Scan).order_by(models.Scan.id.desc()).limit(limit).all()
-    # map to schema
-    return [
-        schemas.ScanResponse(
-            id=scan.id,
-            result=schemas.ScanResult(
-                condition=scan.condition,
-                confidence=scan.confidence or 0.0,
-                severity=scan.severity if scan.severity else "MINOR",
-                steps=scan.steps.split("|") if scan.steps else [],
-                warnings=scan.warnings.split("|") if scan.warnings else []
-            ),
-            created_at=scan.created_at
-        ) for scan in scans
-    ]
-
-@router.post("/analyze", response_model=schemas.ScanResponse)
-def analyze(scan_image: UploadFile = File(...), user_id: int = Form(None), db: Session = Depends(get_db)):
-    # save file locally
-    timestamp = int(datetime.datetime.utcnow().timestamp() * 1000)
-    filename = f"{timestamp}_{scan_image.filename}"
-    local_path = os.path.join(UPLOAD_DIR, filename)
-    with open(local_path, "wb") as buffer:
-        shutil.copyfileobj(scan_image.file, buffer)
-
-    # Optionally upload to S3 storage
-    object_name = f"cases/{uuid.uuid4().hex}_{scan_image.filename}"
-    storage = upload_to_storage(local_path, object_name)
-    s3_key = storage.get("key")
-
-    try:
-        ai_res = analyze_image(local_path)
-    except Exception as e:
-        if "429" in str(e):
-             raise HTTPException(status_code=429, detail="Gemini Rate Limit Exceeded. Please try again later.")
-        raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
+async def analyze_upload(db: AsyncSession, local_path: str, image_sha256: str) -> dict:
+    """Return the normalized analysis for an image, from the result cache when possible."""
+    with metrics.span("cache_lookup"):
+        result = await result_cache.get(db, image_sha256)
+        # release the connection while waiting on the AI service
+        await db.commit()
+    if result is None:
+        ai_res = await ai_providers.analyze([local_path])
+        result = normalize_result(ai_res)
+        # never cache placeholder results from failed or blocked analyses
+        if not ai_res.get("fallback"):
+            with metrics.span("cache_store"):
+                await result_cache.put(db, image_sha256, result)
+    return result
 
-    # normalize ai_res
-    condition = ai_res.get("condition") or ai_res.get("diagnosis") or "Unclear image"
-    confidence = float(ai_res.get("confidence") or ai_res.get("score") or 0.0)
-    severity_raw = (ai_res.get("severity") or "MINOR").upper()
-    VALID_SEVERITIES = {"MINOR", "MODERATE", "URGENT"}
-    severity_str = severity_raw if severity_raw in VALID_SEVERITIES else "MINOR"
+async def analyze_and_store(db: AsyncSession, local_path: str, filename: str, image_sha256: str):
+    """
+    Run the storage upload alongside the analysis instead of before it.
+    Returns (result, s3_key); s3_key is None when the upload failed and was
+    left to the background retry worker.
+    """
+    upload = asyncio.ensure_future(store_upload(local_path, filename))
+    result = await analyze_upload(db, local_path, image_sha256)
+    return result, await upload
 
-    steps = ai_res.get("steps") or ai_res.get("advice") or []
-    warnings = ai_res.get("warnings") or []
-
-    scan = models.Scan(
+def build_scan(user_id, filename: str, s3_key, result: dict) -> models.Scan:
+    return models.Scan(
         user_id=user_id,
         filename=filename,
+        blob_sha256=storage.sha_of(filename),
         s3_key=s3_key,
-        condition=condition,
-        confidence=confidence,
-        severity=severity_str,
-        steps="|".join(steps) if isinstance(steps, list) else str(steps),
-        warnings="|".join(warnings) if isinstance(warnings, list) else str(warnings)
+        condition=result["condition"],
+        confidence=result["confidence"],
+        severity=result["severity"],
+        steps=result["steps"],
+        warnings=result["warnings"]
     )
-    db.add(scan)
-    db.commit()
-    db.refresh(scan)
 
+def scan_response(scan: models.Scan) -> schemas.ScanResponse:
     return schemas.ScanResponse(
         id=scan.id,
         result=schemas.ScanResult(
             condition=scan.condition,
             confidence=scan.confidence or 0.0,
             severity=scan.severity if scan.severity else "MINOR",
-            steps=scan.steps.split("|") if scan.steps else [],
-            warnings=scan.warnings.split("|") if scan.warnings else []
+            steps=scan.steps or [],
+            warnings=scan.warnings or []
+        ),
+        created_at=scan.created_at
+    )
+
+@router.get("/recent", response_model=list[schemas.ScanResponse])
+async def get_recent_scans(request: Request, db: AsyncSession = Depends(get_async_db), limit: int = 5):
+    # scan results are never edited after insert, so the newest id versions the list
+    latest = await db.scalar(select(func.max(models.Scan.id))) or 0
+    tag = read_cache.etag("recent", limit, latest)
+    if read_cache.not_modified(request, tag):
+        return read_cache.not_modified_response(tag)
+
+    body = read_cache.recent_scans.get(limit, latest)
+    if body is None:
+        scans = await db.scalars(
+            select(models.Scan).where(models.Scan.id <= latest).order_by(models.Scan.id.desc()).limit(limit)
+        )
+        body = json.dumps([scan_response(scan).model_dump(mode="json") for scan in scans]).encode()
+        read_cache.recent_scans.put(limit, latest, body)
+    return read_cache.json_response(body, tag)
+
+async def _save_scan(db: AsyncSession, scan: models.Scan) -> schemas.ScanResponse:
+    db.add(scan)
+    with metrics.span("db_commit"):
+        await db.flush()
+        await stats.record_scans(db, [scan.id])
+        await storage.add_refs(db, [scan])
+        await db.commit()
+    read_cache.recent_scans.invalidate()
+    await db.refresh(scan)
+    await events.case_created([scan])
+    return scan_response(scan)
+
+@router.post("/analyze", response_model=schemas.ScanResponse, openapi_extra=SCAN_UPLOAD_BODY)
+async def analyze(request: Request, db: AsyncSession = Depends(get_async_db)):
+    # stream the image straight to disk, hashing it on the way
+    form = await ingest_multipart(request, "scan_image", int_fields=("user_id",))
+    upload = form.files[0]
+    user_id = form.fields["user_id"]
+
+    try:
+        # Optionally upload to S3 storage, in parallel with the AI call
+        result, s3_key = await analyze_and_store(db, upload.path, upload.filename, upload.sha256)
+    except AIRateLimitError:
+        raise HTTPException(
+            status_code=429,
+            detail="Gemini Rate Limit Exceeded. Please try again later.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
         )
+    except AIServiceError as e:
+        raise HTTPException(status_code=502, detail=f"AI service error: {str(e)}")
+
+    scan = build_scan(user_id, upload.filename, s3_key, result)
+    return await _save_scan(db, scan)
+
+async def _save_scans(scans: list) -> list:
+    # one transaction for the whole batch
+    async with AsyncSessionLocal() as db:
+        db.add_all(scans)
+        with metrics.span("db_commit"):
+            await db.flush()
+            await stats.record_scans(db, [scan.id for scan in scans])
+            await storage.add_refs(db, scans)
+            await db.commit()
+        read_cache.recent_scans.invalidate()
+        for scan in scans:
+            await db.refresh(scan)
+        await events.case_created(scans)
+        return [scan_response(scan) for scan in scans]
+
+async def _analyze_batch_item(index: int, upload: IngestedFile, limit: asyncio.Semaphore):
+    async with limit:
+        try:
+            # each item gets its own session: tasks run concurrently
+            async with AsyncSessionLocal() as db:
+                result, s3_key = await analyze_and_store(db, upload.path, upload.filename, upload.sha256)
+        except AIServiceError as e:
+            return index, None, None, str(e)
+        return index, s3_key, result, None
+
+async def _run_batch(uploads: list, user_id, combined: bool):
+    """
+    Yield one BatchItemResult per image as each finishes, then a final
+    BatchResponse once all scans are written.
+    """
+    items, scans = [], []
+    if combined:
+        stored = asyncio.gather(*[store_upload(u.path, u.filename) for u in uploads])
+        try:
+            result = normalize_result(await ai_providers.analyze([u.path for u in uploads]))
+            error = None
+        except AIServiceError as e:
+            result, error = None, str(e)
+        s3_keys = await stored
+        item = schemas.BatchItemResult(
+            index=0, filename=uploads[0].original_filename,
+            status="ok" if result else "error", result=result, error=error,
+        )
+        items.append(item)
+        yield item
+        if result:
+            scans.append(build_scan(user_id, uploads[0].filename, s3_keys[0], result))
+    else:
+        limit = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+        tasks = [asyncio.create_task(_analyze_batch_item(i, u, limit)) for i, u in enumerate(uploads)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, s3_key, result, error = await next_done
+                upload = uploads[index]
+                item = schemas.BatchItemResult(
+                    index=index, filename=upload.original_filename,
+                    status="ok" if result else "error", result=result, error=error,
+                )
+                items.append(item)
+                yield item
+                if result:
+                    scans.append(build_scan(user_id, upload.filename, s3_key, result))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    saved = await _save_scans(scans) if scans else []
+    yield schemas.BatchResponse(items=sorted(items, key=lambda i: i.index), scans=saved, combined=combined)
+
+@router.post("/analyze/batch", openapi_extra=BATCH_UPLOAD_BODY)
+async def analyze_batch(request: Request, stream: bool = False, combined: bool = False):
+    """
+    Analyze several images in one request. Items are analyzed concurrently
+    (BATCH_CONCURRENCY at a time) and every resulting scan is written in a
+    single transaction. With `stream=true` the response is NDJSON: one line per
+    image as it finishes, then a final line with the saved scans. With
+    `combined=true` all images go to Gemini in one request and produce a
+    single combined scan.
+    """
+    form = await ingest_multipart(
+        request, "scan_images", max_files=settings.BATCH_MAX_IMAGES, int_fields=("user_id",)
     )
+    uploads, user_id = form.files, form.fields["user_id"]
+
+    if stream:
+        async def ndjson():
+            async for message in _run_batch(uploads, user_id, combined):
+                yield json.dumps(message.model_dump(mode="json")) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    async for message in _run_batch(uploads, user_id, combined):
+        last = message
+    return last
+
+async def _load_scan(db: AsyncSession, scan_id: int):
+    scan = (await db.execute(
+        select(models.Scan.id, models.Scan.filename, models.Scan.s3_key).where(models.Scan.id == scan_id)
+    )).first()
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    await db.commit()  # release the connection before the (possibly slow) file work
+    return scan
+
+def _local_file(path: str):
+    """(stat, media type) for a local file, or None if it is not there."""
+    try:
+        return os.stat(path), media.media_type_for(path)
+    except FileNotFoundError:
+        return None
+
+@router.api_route("/{scan_id}/image", methods=["GET", "HEAD"])
+async def get_scan_image(scan_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    The original scan image, with a strong ETag and byte-range support. Images
+    that are only in S3 get a 307 to a short-lived presigned URL.
+    """
+    scan = await _load_scan(db, scan_id)
+    path = os.path.join(settings.UPLOAD_DIR, scan.filename)
+    local = await run_in_threadpool(_local_file, path)
+    if local:
+        st, media_type = local
+        return media.RangedFileResponse(request, path, st, media_type)
+    if settings.USE_S3 and scan.s3_key:
+        url = await run_in_threadpool(
+            storage.get_s3_client().generate_presigned_url,
+            "get_object",
+            Params={"Bucket": settings.S3_BUCKET, "Key": scan.s3_key},
+            ExpiresIn=settings.SCAN_IMAGE_URL_TTL_SECONDS,
+        )
+        # cacheable for less than the URL lives, so a cached redirect never points at an expired URL
+        max_age = settings.SCAN_IMAGE_URL_TTL_SECONDS // 2
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": f"private, max-age={max_age}"})
+    raise HTTPException(status_code=404, detail="Image not available")
+
+@router.api_route("/{scan_id}/thumbnail", methods=["GET", "HEAD"])
+async def get_scan_thumbnail(
+    scan_id: int,
+    request: Request,
+    size: int = Query(thumbnails.DEFAULT_SIZE, description=f"longest edge in pixels: one of {', '.join(map(str, thumbnails.SIZES))}"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """A JPEG thumbnail, rendered on first request and served from cache afterwards."""
+    if size not in thumbnails.SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(map(str, thumbnails.SIZES))}")
+    scan = await _load_scan(db, scan_id)
+    entry = await thumbnails.cache.get(scan, size)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Image not available")
+    try:
+        st = await run_in_threadpool(os.stat, entry.path)
+    except FileNotFoundError:  # evicted by another worker in the meantime
+        entry = await thumbnails.cache.get(scan, size)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Image not available")
+        st = await run_in_threadpool(os.stat, entry.path)
+    return media.RangedFileResponse(request, entry.path, st, "image/jpeg", etag=entry.etag)
 
 @router.get("/debug_models")
 def get_debug_models():
@@ -42,6 +42,30 @@ class ScanResponse(BaseModel):
         from_attributes = True  # Pydantic v2 (use orm_mode = True for Pydantic v1)
 
 
+class BatchItemResult(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    status: str  # "ok" / "error"
+    result: Optional[ScanResult] = None
+    error: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    items: List[BatchItemResult]
+    scans: List[ScanResponse]
+    combined: bool = False
+
+
+class ScanJobResponse(BaseModel):
+    id: str
+    status: str
+    scan_id: Optional[int] = None
+    error: Optional[str] = None
+    result: Optional[ScanResponse] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
 class AssignRequest(BaseModel):
     scan_id: int
     doctor_id: int
@@ -49,3 +73,4 @@ class AssignRequest(BaseModel):
 class NoteCreate(BaseModel):
     scan_id: int
     note: str
+    author_id: Optional[int] = None
@@ -0,0 +1,108 @@
+"""
+Readiness and graceful draining of a serving process (see gunicorn.conf.py).
+
+GET /health only says the process is up. GET /ready says this worker should
+get traffic: startup has finished, the database answers, and the AI and S3
+clients have been warmed up. A client whose warm-up failed or is disabled does
+not hold readiness back; it is built on first use instead.
+
+On SIGTERM or SIGINT the worker starts draining before the server's own
+graceful shutdown: /ready turns 503, so load balancers stop routing here, and
+open case streams are ended, since a long-lived SSE connection would otherwise
+hold the shutdown until its timeout. Their clients reconnect to another worker
+and resume from Last-Event-ID.
+"""
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
+from sqlalchemy import text
+from app import ai_providers, events, storage
+from app.config import settings
+from app.db import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+state = {"started": False, "draining": False}
+# client name -> "pending" | "warm" | "failed" | "skipped"
+clients = {"ai": "pending", "s3": "pending"}
+_started_at = time.monotonic()
+
+
+async def _warm(name: str, warm_up, enabled: bool):
+    clients[name] = await warm_up() if enabled else "skipped"
+
+
+async def warm_up_clients():
+    # in the background, so a slow upstream never delays startup
+    await asyncio.gather(
+        _warm("ai", ai_providers.warm_up, settings.GEMINI_WARM_UP),
+        _warm("s3", storage.warm_up, settings.S3_WARM_UP),
+    )
+    logger.info("Ready %.1fs after import (clients: %s)", time.monotonic() - _started_at, clients)
+
+
+def drain():
+    if state["draining"]:
+        return
+    state["draining"] = True
+    logger.info("Draining: not ready, closing %s case streams", events.broadcaster.stats()["subscribers"])
+    events.broadcaster.close_streams()
+
+
+def _chain(sig, loop):
+    previous = signal.getsignal(sig)
+
+    def handler(signum, frame):
+        loop.call_soon_threadsafe(drain)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    signal.signal(sig, handler)
+
+
+def install_drain_handler():
+    """Run drain() on SIGTERM/SIGINT, then whatever handler the server installed."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        _chain(sig, loop)
+
+
+async def start():
+    install_drain_handler()
+    asyncio.create_task(warm_up_clients())
+    state["started"] = True
+
+
+async def _database_ok() -> bool:
+    try:
+        async with AsyncSessionLocal() as db:
+            await asyncio.wait_for(db.execute(text("SELECT 1")), settings.READY_DB_TIMEOUT_SECONDS)
+        return True
+    except Exception as e:
+        logger.warning("Readiness check: database unavailable: %s", e)
+        return False
+
+
+async def readiness() -> dict:
+    database = not state["draining"] and await _database_ok()
+    ready = (
+        state["started"]
+        and not state["draining"]
+        and database
+        and "pending" not in clients.values()
+    )
+    return {
+        "ready": ready,
+        "draining": state["draining"],
+        "database": "ok" if database else "unavailable",
+        "clients": dict(clients),
+        "pid": os.getpid(),
+    }
@@ -0,0 +1,132 @@
+"""
+Case statistics kept in a rollup table instead of aggregated per request.
+
+scan_daily_stats holds one row per (UTC day, severity, condition) with the
+scan count, the confidence sum/count and how many of those scans are still
+unassigned. The counts change in the same transaction as the data they
+describe:
+- new scans are folded in with one INSERT ... SELECT ... ON CONFLICT DO UPDATE
+  over the inserted ids
+- an assignment decrements `unassigned`
+
+GET /doctor/stats only ever reads the rollup.
+
+    python -m app.stats            # rebuild the rollup from scans
+    python -m app.stats --check    # report drift, exit 1 if any
+"""
+import argparse
+import sys
+from sqlalchemy import Date, case, cast, delete, func, select, tuple_, update
+from sqlalchemy.engine import make_url
+from app import models
+from app.config import settings
+from app.db import upsert_insert
+
+DIALECT = make_url(settings.DATABASE_URL).get_backend_name()
+KEY = ("day", "severity", "condition")
+COUNTS = ("scans", "confidence_sum", "confidence_count", "unassigned")
+
+
+def _day(column):
+    # UTC calendar day, computed the same way by every writer and by rebuild()
+    if DIALECT == "postgresql":
+        return cast(func.timezone("UTC", column), Date)
+    return func.date(column)
+
+
+def rollup_select(scan_ids=None):
+    """Rollup rows aggregated straight from scans (all of them, or just scan_ids)."""
+    Scan = models.Scan
+    day = _day(Scan.created_at)
+    severity = func.coalesce(Scan.severity, "")
+    condition = func.coalesce(Scan.condition, "")
+    q = select(
+        day.label("day"),
+        severity.label("severity"),
+        condition.label("condition"),
+        func.count().label("scans"),
+        func.coalesce(func.sum(Scan.confidence), 0.0).label("confidence_sum"),
+        func.count(Scan.confidence).label("confidence_count"),
+        func.sum(case((Scan.assigned_to.is_(None), 1), else_=0)).label("unassigned"),
+    )
+    if scan_ids is not None:
+        q = q.where(Scan.id.in_(scan_ids))
+    return q.group_by(day, severity, condition)
+
+
+async def record_scans(db, scan_ids: list):
+    """Fold newly inserted (flushed, not yet committed) scans into the rollup."""
+    if not scan_ids:
+        return
+    Stats = models.ScanDailyStats
+    stmt = upsert_insert(Stats.__table__).from_select(KEY + COUNTS, rollup_select(scan_ids))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(KEY),
+        set_={name: getattr(Stats, name) + getattr(stmt.excluded, name) for name in COUNTS},
+    )
+    await db.execute(stmt)
+
+
+async def record_assignment(db, scan_id: int):
+    """The scan just went from unassigned to assigned."""
+    Scan, Stats = models.Scan, models.ScanDailyStats
+    key = select(
+        _day(Scan.created_at), func.coalesce(Scan.severity, ""), func.coalesce(Scan.condition, "")
+    ).where(Scan.id == scan_id)
+    await db.execute(
+        update(Stats)
+        .where(tuple_(Stats.day, Stats.severity, Stats.condition).in_(key))
+        .values(unassigned=Stats.unassigned - 1)
+    )
+
+
+def _rows(conn, q) -> dict:
+    return {
+        (str(r.day), r.severity, r.condition): tuple(
+            round(float(v), 4) if isinstance(v, float) else int(v or 0) for v in (getattr(r, n) for n in COUNTS)
+        )
+        for r in conn.execute(q)
+    }
+
+
+def drift(conn) -> list:
+    """Rollup rows that differ from a fresh aggregate over scans."""
+    Stats = models.ScanDailyStats
+    expected = _rows(conn, rollup_select())
+    actual = _rows(conn, select(*[getattr(Stats, n) for n in KEY + COUNTS]))
+    return [
+        {"key": list(key), "expected": expected.get(key), "actual": actual.get(key)}
+        for key in sorted(expected.keys() | actual.keys())
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+def rebuild(conn):
+    Stats = models.ScanDailyStats
+    conn.execute(delete(Stats))
+    conn.execute(upsert_insert(Stats.__table__).from_select(KEY + COUNTS, rollup_select()))
+
+
+def main(argv=None):
+    from app.db import engine
+
+    parser = argparse.ArgumentParser(description="Rebuild or check the scan_daily_stats rollup.")
+    parser.add_argument("--check", action="store_true", help="only report drift; exit 1 if any is found")
+    args = parser.parse_args(argv)
+
+    with engine.begin() as conn:
+        found = drift(conn)
+        for row in found[:20]:
+            print(f"drift {row['key']}: expected {row['expected']}, found {row['actual']}")
+        if len(found) > 20:
+            print(f"... and {len(found) - 20} more")
+        if args.check:
+            print(f"{len(found)} rollup rows differ")
+            return 1 if found else 0
+        rebuild(conn)
+    print(f"Rebuilt scan_daily_stats ({len(found)} rows were out of date)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,344 @@
+"""
+Upload storage: the content-addressed blob store on local disk, and S3.
+
+Every upload is stored once per distinct content, at
+UPLOAD_DIR/blobs/<ab>/<cd>/<sha256> (the first two byte pairs of the hash
+shard the tree so no directory grows past a few thousand entries). A `blobs`
+row records where the bytes are and how many scans reference them; scans
+store the blob's relative path as their filename. The same path under
+cases/ is the S3 key, so identical uploads also share one object.
+app/lifecycle.py moves old blobs to S3 and deletes unreferenced ones.
+"""
+import asyncio
+import functools
+import logging
 import os
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+import anyio
+from sqlalchemy import select, update
+from app import metrics, models
 from app.config import settings
-import boto3
-from botocore.client import Config
+from app.db import AsyncSessionLocal, SessionLocal, upsert_insert
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
 
 USE_S3 = settings.USE_S3
 
+MB = 1024 * 1024
+
+_s3 = None
+_s3_lock = threading.Lock()
+_retry_task = None
+# scans whose local file is gone; skipped so they cannot starve the retry batch
+_missing_files = set()
+
+
+def get_s3_client():
+    """
+    Process-wide S3 client. botocore clients are thread-safe, so one client
+    (and its connection pool) is shared by every request and worker thread
+    instead of paying credential resolution and a TLS handshake per upload.
+    boto3 is imported here, on first use, so it stays out of startup.
+    """
+    global _s3
+    if _s3 is None:
+        with _s3_lock:
+            if _s3 is None:
+                import boto3
+                from botocore.client import Config
+
+                _s3 = boto3.session.Session().client(
+                    "s3",
+                    endpoint_url=settings.S3_ENDPOINT or None,
+                    region_name=settings.S3_REGION or None,
+                    aws_access_key_id=settings.S3_ACCESS_KEY,
+                    aws_secret_access_key=settings.S3_SECRET_KEY,
+                    config=Config(
+                        signature_version="s3v4",
+                        max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                        connect_timeout=5,
+                        read_timeout=30,
+                    ),
+                )
+    return _s3
+
+
+@functools.lru_cache(maxsize=None)
+def transfer_config():
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=settings.S3_MULTIPART_THRESHOLD_MB * MB,
+        multipart_chunksize=settings.S3_MULTIPART_CHUNK_MB * MB,
+        max_concurrency=settings.S3_TRANSFER_CONCURRENCY,
+        use_threads=True,
+    )
+
+
+def _warm_up():
+    client = get_s3_client()
+    transfer_config()
+    client.head_bucket(Bucket=settings.S3_BUCKET)
+
+
+async def warm_up() -> str:
+    """
+    Create the client and open a connection to the bucket before the first upload.
+    Returns "warm", "failed" or "skipped", like ai_client.warm_up().
+    """
+    if not settings.USE_S3:
+        return "skipped"
+    try:
+        await anyio.to_thread.run_sync(_warm_up)
+        logger.info("S3 client warmed up (%s)", settings.S3_BUCKET)
+        return "warm"
+    except Exception as e:
+        logger.warning("S3 warm-up failed: %s", e)
+        return "failed"
+
+
+def set_s3_client(client):
+    """Swap the process-wide S3 client (e.g. for a local stand-in)."""
+    global _s3
+    _s3 = client
+
+
+def object_name_for(filename: str) -> str:
+    # upload file names are already unique, so the object key can be derived
+    # from the scan row alone when an upload has to be retried later
+    return f"cases/{filename}"
+
+
+def object_url(object_name: str) -> str:
+    bucket = settings.S3_BUCKET
+    if settings.S3_ENDPOINT:
+        return f"{settings.S3_ENDPOINT.rstrip('/')}/{bucket}/{object_name}"
+    return f"https://{bucket}.s3.amazonaws.com/{object_name}"
+
+
+class LocalBlobStore:
+    """Blobs on local disk under <root>/blobs/<ab>/<cd>/<sha256>."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.directory = os.path.join(root, "blobs")
+        # uploads in progress, and files being retired by the lifecycle job
+        self.incoming = os.path.join(root, "incoming")
+
+    def relative_path(self, sha256: str) -> str:
+        return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.directory, sha256[:2], sha256[2:4], sha256)
+
+    def put(self, source: str, sha256: str) -> bool:
+        """Move a finished upload into place. False if the bytes were already stored."""
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.remove(source)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source, path)
+        return True
+
+    def set_aside(self, sha256: str):
+        """Rename a blob's file out of the tree before deleting it; None if it is not there."""
+        aside = os.path.join(self.incoming, f"{sha256}.{os.getpid()}.retired")
+        try:
+            os.replace(self.path(sha256), aside)
+        except FileNotFoundError:
+            return None
+        return aside
+
+    def restore(self, sha256: str, aside: str):
+        path = self.path(sha256)
+        if os.path.exists(path):  # an upload already put the bytes back
+            os.remove(aside)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(aside, path)
+
+    def shards(self) -> list:
+        try:
+            return sorted(e.path for e in os.scandir(self.directory) if e.is_dir())
+        except FileNotFoundError:
+            return []
+
+    def files(self, shard: str):
+        """(sha256, path, mtime) for every file in one top-level shard."""
+        for sub in os.scandir(shard):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.is_file():
+                    yield entry.name, entry.path, entry.stat().st_mtime
+
+
+class S3BlobStore:
+    """Blobs in the bucket, at the same relative path under cases/."""
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+
+    def key_for(self, sha256: str) -> str:
+        return object_name_for(blobs.relative_path(sha256))
+
+    def put(self, path: str, key: str):
+        get_s3_client().upload_file(path, self.bucket, key, Config=transfer_config())
+
+    def delete(self, key: str):
+        get_s3_client().delete_object(Bucket=self.bucket, Key=key)
+
+
+blobs = LocalBlobStore(settings.UPLOAD_DIR)
+s3_blobs = S3BlobStore(settings.S3_BUCKET)
+blob_counters = {"stored": 0, "deduplicated": 0}
+
+
+def sha_of(filename: str):
+    """The blob hash behind a scan filename, or None for an upload from before blobs."""
+    if filename and filename.startswith("blobs/"):
+        return filename.rsplit("/", 1)[1]
+    return None
+
+
+async def adopt(files: list):
+    """
+    Move freshly ingested files into the blob store, storing each distinct
+    content once. Afterwards every file's path and filename point at its blob.
+    """
+    if not files:
+        return
+    now = datetime.now(timezone.utc)
+    rows = {
+        f.sha256: {
+            "sha256": f.sha256, "size": f.size, "content_type": f.content_type,
+            "refcount": 0, "local": True, "last_seen_at": now,
+        }
+        for f in files
+    }
+    stmt = upsert_insert(models.Blob.__table__).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["sha256"],
+        set_={"local": True, "last_seen_at": stmt.excluded.last_seen_at},
+    )
+    # the row is claimed before the file is placed; the lifecycle job re-checks
+    # it before deleting a file, so it never removes bytes an upload just deduped against
+    async with AsyncSessionLocal() as db:
+        await db.execute(stmt)
+        await db.commit()
+    for f in files:
+        stored = await anyio.to_thread.run_sync(blobs.put, f.path, f.sha256)
+        blob_counters["stored" if stored else "deduplicated"] += 1
+    for f in files:
+        f.path, f.filename = blobs.path(f.sha256), blobs.relative_path(f.sha256)
+
+
+async def add_refs(db, scans: list):
+    """Count newly inserted (flushed, not yet committed) scans against their blobs."""
+    counts = Counter(scan.blob_sha256 for scan in scans if scan.blob_sha256)
+    for sha256, n in sorted(counts.items()):  # a fixed order, so concurrent batches cannot deadlock
+        await db.execute(
+            update(models.Blob).where(models.Blob.sha256 == sha256).values(refcount=models.Blob.refcount + n)
+        )
+
+
 def upload_to_storage(local_path: str, object_name: str):
     if not USE_S3:
         # when not using S3, just return local filename path
         return {"url": local_path, "key": local_path}
     # Using S3-compatible storage
-    s3 = boto3.client(
-        "s3",
-        endpoint_url=settings.S3_ENDPOINT or None,
-        region_name=settings.S3_REGION or None,
-        aws_access_key_id=settings.S3_ACCESS_KEY,
-        aws_secret_access_key=settings.S3_SECRET_KEY,
-        config=Config(signature_version="s3v4")
+    get_s3_client().upload_file(local_path, settings.S3_BUCKET, object_name, Config=transfer_config())
+    return {"url": object_url(object_name), "key": object_name}
+
+
+async def store_upload(local_path: str, filename: str):
+    """
+    Upload a scan image and return its storage key, or None if the upload
+    failed. A failed upload never fails the scan: the row is saved with
+    s3_key NULL and the retry worker uploads it later. A blob that is
+    already in the bucket is not uploaded again.
+    """
+    sha256 = sha_of(filename) if USE_S3 else None
+    try:
+        if sha256:
+            async with AsyncSessionLocal() as db:
+                key = await db.scalar(select(models.Blob.s3_key).where(models.Blob.sha256 == sha256))
+            if key:
+                return key
+        with metrics.span("s3_upload"):
+            storage = await run_in_threadpool(upload_to_storage, local_path, object_name_for(filename))
+        if sha256:
+            async with AsyncSessionLocal() as db:
+                await db.execute(_blob_key_update(sha256, storage["key"]))
+                await db.commit()
+        return storage.get("key")
+    except Exception as e:
+        logger.warning("Upload of %s failed, will retry in background: %s", filename, e)
+        return None
+
+
+def _blob_key_update(sha256: str, key: str):
+    return (
+        update(models.Blob)
+        .where(models.Blob.sha256 == sha256, models.Blob.s3_key.is_(None))
+        .values(s3_key=key)
     )
-    bucket = settings.S3_BUCKET
-    s3.upload_file(local_path, bucket, object_name)
-    url = f"{settings.S3_ENDPOINT.rstrip('/')}/{bucket}/{object_name}" if settings.S3_ENDPOINT else f"https://{bucket}.s3.amazonaws.com/{object_name}"
-    return {"url": url, "key": object_name}
+
+
+def _retry_pending(limit: int = 50) -> int:
+    uploaded = 0
+    with SessionLocal() as db:
+        q = db.query(models.Scan).filter(models.Scan.s3_key.is_(None))
+        if _missing_files:
+            q = q.filter(models.Scan.id.notin_(list(_missing_files)))
+        pending = (
+            q.order_by(models.Scan.id.asc())
+            .limit(limit)
+            .all()
+        )
+        for scan in pending:
+            local_path = os.path.join(settings.UPLOAD_DIR, scan.filename)
+            if not os.path.exists(local_path):
+                logger.error("Cannot upload scan %s: %s is missing", scan.id, local_path)
+                _missing_files.add(scan.id)
+                continue
+            try:
+                scan.s3_key = upload_to_storage(local_path, object_name_for(scan.filename))["key"]
+                if scan.blob_sha256:
+                    db.execute(_blob_key_update(scan.blob_sha256, scan.s3_key))
+            except Exception as e:
+                logger.warning("Retry upload of scan %s failed: %s", scan.id, e)
+                break  # storage is still unhealthy; try again next round
+            db.commit()
+            uploaded += 1
+    return uploaded
+
+
+async def _retry_loop():
+    while True:
+        await asyncio.sleep(settings.S3_RETRY_INTERVAL_SECONDS)
+        try:
+            uploaded = await run_in_threadpool(_retry_pending)
+            if uploaded:
+                logger.info("Uploaded %s pending scan images", uploaded)
+        except Exception as e:
+            logger.warning("Upload retry round failed: %s", e)
+
+
+def start_retry_worker():
+    global _retry_task
+    if USE_S3 and _retry_task is None:
+        _retry_task = asyncio.create_task(_retry_loop())
+
+
+async def stop_retry_worker():
+    global _retry_task
+    if _retry_task is not None:
+        _retry_task.cancel()
+        await asyncio.gather(_retry_task, return_exceptions=True)
+        _retry_task = None
@@ -0,0 +1,195 @@
+"""
+Scan thumbnails, generated once and kept in an LRU cache on disk.
+
+Thumbnails live in THUMBNAIL_DIR as <scan id>_<size>_<digest>.jpg. The digest
+is of the JPEG bytes and is also the strong ETag. An in-process index tracks
+recency and total size. It is rebuilt from the directory on first use and
+evicts the least recently used files once the cache passes
+THUMBNAIL_CACHE_MAX_MB. With USE_S3, every thumbnail is also stored under
+thumbnails/ in the bucket. A worker that misses on disk fetches the copy from
+the bucket before rendering the image again. Concurrent requests for the same
+thumbnail share one render.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+import anyio
+from app import metrics, storage
+from app.config import settings
+from app.preprocess import downscale
+
+logger = logging.getLogger(__name__)
+
+SIZES = (64, 128, 256, 512)
+DEFAULT_SIZE = 256
+MB = 1024 * 1024
+
+
+@dataclass
+class Entry:
+    path: str
+    size: int
+    etag: str
+
+
+def thumbnail_dir() -> str:
+    return settings.THUMBNAIL_DIR or os.path.join(settings.UPLOAD_DIR, "thumbnails")
+
+
+def object_name(scan_id: int, size: int) -> str:
+    return f"thumbnails/{scan_id}_{size}.jpg"
+
+
+class ThumbnailCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = None  # (scan_id, size) -> Entry, least recently used first
+        self._bytes = 0
+        self._inflight = {}
+        self.counters = {"hits": 0, "misses": 0, "renders": 0, "s3_hits": 0, "evictions": 0}
+
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            parts = stem.split("_")
+            if ext != ".jpg" or len(parts) != 3 or not parts[0].isdigit() or not parts[1].isdigit():
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            found.append((st.st_atime, (int(parts[0]), int(parts[1])), Entry(path, st.st_size, f'"{parts[2]}"')))
+        entries = OrderedDict()
+        for _, key, entry in sorted(found, key=lambda f: f[0]):
+            entries[key] = entry
+        return entries
+
+    async def _index(self) -> OrderedDict:
+        if self._entries is None:
+            entries = await anyio.to_thread.run_sync(self._load_index)
+            if self._entries is None:
+                self._entries = entries
+                self._bytes = sum(e.size for e in entries.values())
+        return self._entries
+
+    def _add(self, key, entry: Entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+            if old.path != entry.path:
+                _remove(old.path)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.counters["evictions"] += 1
+            _remove(evicted.path)
+
+    def _write(self, key, data: bytes) -> Entry:
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        path = os.path.join(self.directory, f"{key[0]}_{key[1]}_{digest}.jpg")
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # readers never see a half-written file
+        return Entry(path, len(data), f'"{digest}"')
+
+    async def get(self, scan, size: int):
+        """Entry for the scan's thumbnail, or None if the original image is gone."""
+        entries = await self._index()
+        key = (scan.id, size)
+        entry = entries.get(key)
+        if entry is not None and os.path.exists(entry.path):
+            entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry
+        self.counters["misses"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._fill(key, scan.filename, scan.s3_key))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fill(self, key, filename: str, s3_key):
+        scan_id, size = key
+        data = None
+        if settings.USE_S3:
+            data = await anyio.to_thread.run_sync(_download, object_name(scan_id, size))
+            if data is not None:
+                self.counters["s3_hits"] += 1
+        if data is None:
+            source = os.path.join(settings.UPLOAD_DIR, filename)
+            if not os.path.exists(source):
+                if not (settings.USE_S3 and s3_key):
+                    return None
+                original = await anyio.to_thread.run_sync(_download, s3_key)
+                if original is None:
+                    return None
+                source = io.BytesIO(original)
+            try:
+                with metrics.span("thumbnail_render"):
+                    data, _, _ = await anyio.to_thread.run_sync(downscale, source, size, settings.THUMBNAIL_JPEG_QUALITY)
+            except OSError as e:  # includes PIL.UnidentifiedImageError
+                logger.warning("Cannot render thumbnail for scan %s: %s", scan_id, e)
+                return None
+            self.counters["renders"] += 1
+            if settings.USE_S3:
+                await anyio.to_thread.run_sync(_upload, object_name(scan_id, size), data)
+        entry = await anyio.to_thread.run_sync(self._write, key, data)
+        self._add(key, entry)
+        return entry
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries or ()),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            **self.counters,
+        }
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _download(key: str):
+    try:
+        return storage.get_s3_client().get_object(Bucket=settings.S3_BUCKET, Key=key)["Body"].read()
+    except Exception as e:
+        # a missing object is the normal miss; anything else is logged and treated the same way
+        code = getattr(e, "response", {}).get("Error", {}).get("Code")
+        if code not in ("NoSuchKey", "404") and not isinstance(e, FileNotFoundError):
+            logger.warning("Could not fetch %s from storage: %s", key, e)
+        return None
+
+
+def _upload(key: str, data: bytes):
+    try:
+        storage.get_s3_client().put_object(Bucket=settings.S3_BUCKET, Key=key, Body=data, ContentType="image/jpeg")
+    except Exception as e:
+        logger.warning("Could not store thumbnail %s: %s", key, e)
+
+
+cache = ThumbnailCache(thumbnail_dir(), settings.THUMBNAIL_CACHE_MAX_MB * MB)
+
+
+@metrics.collector
+def _thumbnail_metrics():
+    s = cache.stats()
+    for result in ("hits", "s3_hits", "renders"):
+        yield "vaidra_thumbnail_requests_total", "counter", "Thumbnails served, by where they came from.", {"result": result}, s[result]
+    yield "vaidra_thumbnail_cache_bytes", "gauge", "Bytes of thumbnails cached on disk.", {}, s["bytes"]
+    yield "vaidra_thumbnail_evictions_total", "counter", "Thumbnails evicted from the disk cache.", {}, s["evictions"]
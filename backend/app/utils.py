@@ -1,9 +1,20 @@
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from app.config import settings
+import asyncio, threading, time
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+# bcrypt is deliberately slow; a few dedicated threads keep a login storm from
+# taking over the shared threadpool (and the CPU) that every other request uses
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+# decoded claims by token, least recently used first; entries never outlive the token's exp
+_token_cache = OrderedDict()
+_token_lock = threading.Lock()
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
@@ -11,6 +22,18 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, pwd_context.hash, password)
+
+async def verify_and_update_password(plain: str, hashed: str):
+    """
+    Returns (valid, new_hash). new_hash is set when the stored hash was made
+    with other settings (e.g. an older BCRYPT_ROUNDS) and should replace it.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        _hash_executor, pwd_context.verify_and_update, plain, hashed
+    )
+
 def create_access_token(subject: str, expires_minutes: int = None):
     expires = datetime.utcnow() + timedelta(minutes=(expires_minutes or settings.ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode = {"exp": expires, "sub": str(subject)}
@@ -18,18 +41,34 @@ def create_access_token(subject: str, expires_minutes: int = None):
     return encoded
 
 def decode_token(token: str):
+    now = time.time()
+    with _token_lock:
+        payload = _token_cache.get(token)
+        if payload is not None:
+            if payload["exp"] > now:
+                _token_cache.move_to_end(token)
+                return payload
+            del _token_cache[token]
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        return payload
     except JWTError:
         return None
+    if settings.TOKEN_CACHE_SIZE > 0 and isinstance(payload.get("exp"), (int, float)):
+        with _token_lock:
+            _token_cache[token] = payload
+            while len(_token_cache) > settings.TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return payload
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import get_async_db
+from app import models
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_current_user_id(token: str = Depends(oauth2_scheme)):
+async def get_current_user_id(token: str = Depends(oauth2_scheme)):
     payload = decode_token(token)
     if not payload:
          raise HTTPException(
@@ -38,3 +77,12 @@ def get_current_user_id(token: str = Depends(oauth2_scheme)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     return int(payload.get("sub"))
+
+async def get_current_admin_id(
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
+    user = await db.get(models.User, current_user_id)
+    if not user or user.role != "ADMIN":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return user.id
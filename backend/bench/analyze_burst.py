@@ -0,0 +1,115 @@
+"""
+Analyze burst: many concurrent POST /scans/analyze uploads against the fake
+AI backend and local S3 stand-in.
+
+    cd backend && python -m bench.analyze_burst --requests 200 --concurrency 50 --rate-limit-rate 0.05
+
+--duplicates sends the same photo every time (the analysis cache path);
+otherwise every upload is a distinct image. --secondary-latency-ms adds a
+second fake provider, so slow answers are hedged (see app/ai_providers.py). Status counts show how many
+requests were shed with 429 or failed with 502 under the configured error mix.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+
+from PIL import Image
+
+from bench import common
+
+
+def make_jpeg(seed: int, size: int = 1024) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    # a few blocks of noise so the encoder (and the preprocess step) do real work
+    for _ in range(8):
+        x, y = rng.randrange(size - 64), rng.randrange(size - 64)
+        image.paste(Image.frombytes("RGB", (64, 64), rng.randbytes(64 * 64 * 3)), (x, y))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def add_arguments(parser):
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duplicates", action="store_true", help="upload one image repeatedly")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="median fake AI latency")
+    parser.add_argument("--jitter", type=float, default=0.4, help="log-normal sigma of the AI latency")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02, help="share of AI calls answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="share of AI calls answered with 503")
+    parser.add_argument("--safety-block-rate", type=float, default=0.02, help="share of AI calls blocked by safety filters")
+    parser.add_argument("--secondary-latency-ms", type=float, default=0.0, help="median latency of a second provider; 0 for none")
+    parser.add_argument("--s3-latency-ms", type=float, default=40.0)
+
+
+async def run(client, args) -> dict:
+    images = [make_jpeg(0)] if args.duplicates else [make_jpeg(i) for i in range(args.requests)]
+
+    def analyze(c, i):
+        files = {"scan_image": (f"burst-{i}.jpg", images[i % len(images)], "image/jpeg")}
+        return c.post("/scans/analyze", files=files)
+
+    result = await common.run_load(client, args.requests, args.concurrency, analyze)
+    report = {
+        "benchmark": "analyze_burst",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "duplicates": args.duplicates,
+        "analyze": result,
+    }
+    if args.secondary_latency_ms:
+        from app import ai_providers
+
+        report["hedging"] = ai_providers.stats()
+    return report
+
+
+def defaults():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    return parser.parse_args([])
+
+
+def install_fakes(args, workdir: str):
+    from bench import fakes
+
+    ai = fakes.FakeAIClient(
+        latency_ms=args.latency_ms,
+        jitter=args.jitter,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        safety_block_rate=args.safety_block_rate,
+        seed=1,
+    )
+    secondary = None
+    if args.secondary_latency_ms:
+        secondary = fakes.FakeAIClient(latency_ms=args.secondary_latency_ms, jitter=args.jitter, seed=2)
+    return fakes.install(ai, s3_root=os.path.join(workdir, "s3"), s3_latency_ms=args.s3_latency_ms, secondary=secondary)
+
+
+async def main_async(args, workdir: str) -> dict:
+    ai, s3 = install_fakes(args, workdir)
+    async with common.app_client() as client:
+        result = await run(client, args)
+    result["ai"] = ai.counters
+    result["s3"] = s3.counters
+    result["memory"] = common.memory()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    workdir = common.configure_env()
+    json.dump(asyncio.run(main_async(args, workdir)), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
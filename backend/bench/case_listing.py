@@ -0,0 +1,133 @@
+"""
+Doctor case listing over a large synthetic scans table.
+
+    cd backend && python -m bench.case_listing --scans 1000000 --workdir /tmp/vaidra-bench
+
+Seeds --scans rows (once: a database that already has enough rows is reused,
+so point --workdir at the same directory between runs), then times
+GET /doctor/cases for the first page, severity and assignee filters, deep
+cursor paging and the warnings text search.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bench import common
+
+SEVERITIES = ("MINOR", "MODERATE", "URGENT")
+CONDITIONS = ("Contact dermatitis", "Eczema", "Psoriasis", "Tinea corporis", "Acne vulgaris", "Urticaria")
+WARNINGS = (
+    "See a doctor if the rash spreads or blisters.",
+    "Seek urgent care if you develop a fever.",
+    "Avoid scratching the affected area.",
+    "Stop using any new skin products.",
+)
+SEED_CHUNK = 20_000
+
+
+def seed(scans: int) -> dict:
+    """Insert synthetic scans until the table holds at least `scans` rows."""
+    from sqlalchemy import func, insert, select
+    from app import models, stats
+    from app.db import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        existing = conn.scalar(select(func.count()).select_from(models.Scan))
+    missing = max(0, scans - existing)
+    if not missing:
+        return {"rows": existing, "inserted": 0, "seconds": 0.0}
+
+    rng = random.Random(existing)
+    start = datetime(2024, 1, 1)
+    started = time.perf_counter()
+    for offset in range(0, missing, SEED_CHUNK):
+        rows = []
+        for i in range(existing + offset, existing + min(missing, offset + SEED_CHUNK)):
+            rows.append({
+                "filename": f"seed_{i}.jpg",
+                "s3_key": f"cases/seed_{i}.jpg",
+                "condition": rng.choice(CONDITIONS),
+                "confidence": round(rng.random(), 3),
+                "severity": rng.choice(SEVERITIES),
+                "steps": ["Keep the area clean and dry."],
+                "warnings": rng.sample(WARNINGS, rng.randint(0, 2)),
+                "assigned_to": rng.randint(1, 50) if rng.random() < 0.3 else None,
+                "created_at": start + timedelta(seconds=i * 30),
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(models.Scan), rows)
+    with engine.begin() as conn:
+        # bulk inserts bypass the app, so bring the dashboard rollup up to date
+        stats.rebuild(conn)
+    return {"rows": existing + missing, "inserted": missing, "seconds": round(time.perf_counter() - started, 2)}
+
+
+def add_arguments(parser):
+    parser.add_argument("--scans", type=int, default=1_000_000, help="rows to seed (default 1M)")
+    parser.add_argument("--requests", type=int, default=200, help="requests per query shape")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=50, help="pages walked by the deep-paging phase")
+
+
+async def run(client, args) -> dict:
+    async def phase(params):
+        return await common.run_load(
+            client, args.requests, args.concurrency,
+            lambda c, i: c.get("/doctor/cases", params=params(i) if callable(params) else params),
+        )
+
+    results = {
+        "first_page": await phase({"limit": 50}),
+        "severity": await phase(lambda i: {"severity": SEVERITIES[i % 3], "limit": 50}),
+        "assigned": await phase(lambda i: {"assigned_to": i % 50 + 1, "limit": 50}),
+        "unassigned": await phase({"unassigned": "true", "limit": 50}),
+        "warning_search": await phase({"warning": "fever", "limit": 50}),
+    }
+
+    # deep paging is sequential by nature: each page needs the previous cursor
+    latencies, cursor = [], None
+    for _ in range(args.pages):
+        params = {"limit": 200, **({"cursor": cursor} if cursor else {})}
+        started = time.perf_counter()
+        response = await client.get("/doctor/cases", params=params)
+        latencies.append(time.perf_counter() - started)
+        response.raise_for_status()
+        cursor = response.json()["next_cursor"]
+        if not cursor:
+            break
+    results["deep_paging"] = common.percentiles(latencies)
+
+    return {
+        "benchmark": "case_listing",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        **results,
+    }
+
+
+async def main_async(args) -> dict:
+    seeded = await asyncio.to_thread(seed, args.scans)
+    async with common.app_client() as client:
+        result = await run(client, args)
+    result["seed"] = seeded
+    result["memory"] = common.memory()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--workdir", help="directory for the bench database; reused between runs")
+    args = parser.parse_args(argv)
+    common.configure_env(args.workdir)
+    json.dump(asyncio.run(main_async(args)), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Shared plumbing for the offline benchmarks.
+
+Every workload runs the real app in-process (or against --url) with the AI
+service and S3 replaced by the stand-ins in bench/fakes.py, so nothing here
+spends Gemini quota or needs network access.
+"""
+import asyncio
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+import httpx
+
+# Applied with setdefault before the app is imported, so an explicit
+# environment (e.g. DATABASE_URL pointing at a seeded database) always wins.
+BENCH_ENV = {
+    "GEMINI_API_KEY": "offline-bench",
+    "GEMINI_WARM_UP": "false",
+    "USE_S3": "true",
+    "S3_BUCKET": "bench",
+    # the fake AI backend is the thing under test, not our own quota limiter
+    "AI_RATE_PER_MINUTE": "1000000",
+    "AI_BURST": "100000",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def configure_env(workdir: str = None) -> str:
+    workdir = workdir or tempfile.mkdtemp(prefix="vaidra-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault("UPLOAD_DIR", os.path.join(workdir, "uploads"))
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    return workdir
+
+
+def percentiles(samples: list) -> dict:
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2) if ordered else None
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+    }
+
+
+def memory() -> dict:
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open("/proc/self/statm") as f:
+            rss_mb = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        rss_mb = None
+    return {
+        "rss_mb": round(rss_mb, 1) if rss_mb is not None else None,
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+    }
+
+
+async def run_load(client: httpx.AsyncClient, requests: int, concurrency: int, send) -> dict:
+    """Issue `requests` calls of `send(client, i)`, at most `concurrency` at a time."""
+    limit = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], Counter()
+
+    async def one(i):
+        async with limit:
+            started = time.perf_counter()
+            try:
+                response = await send(client, i)
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    elapsed = time.perf_counter() - started
+    errors = sum(n for status, n in statuses.items() if not status.startswith(("2", "3")))
+    return {
+        **percentiles(latencies),
+        "errors": errors,
+        "statuses": dict(statuses),
+        "rps": round(requests / elapsed, 1) if elapsed else None,
+        "seconds": round(elapsed, 3),
+    }
+
+
+@asynccontextmanager
+async def app_client(url: str = None):
+    """An httpx client for a running server, or for the app in-process with startup/shutdown run."""
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+            yield client
+        return
+
+    from app import models  # noqa: F401  (registers the tables)
+    from app.db import Base, engine, async_engine
+    from app.main import app
+    # the app logs to stdout; keep that free for the JSON report
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(sys.stderr)
+    Base.metadata.create_all(bind=engine)
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            yield client
+    finally:
+        await app.router.shutdown()
+        # aiosqlite keeps a thread per pooled connection; close them so the process can exit
+        await async_engine.dispose()
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
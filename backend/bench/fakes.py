@@ -0,0 +1,215 @@
+"""
+Offline stand-ins for the AI service and S3.
+
+FakeAIClient has the same interface as ai_client.GeminiClient and is installed
+with ai_client.set_client(); a second one can be added as another provider
+(FakeProvider) to exercise hedged requests. FakeS3Client covers the boto3
+calls storage.py makes and is installed with storage.set_s3_client(). Both add
+configurable latency, and the AI fake can fail the way Gemini does (429 quota
+errors, 5xx, safety-filter blocks) so the limiter, retries and fallbacks are
+exercised too.
+"""
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import threading
+import time
+
+import anyio
+from google.api_core import exceptions as google_exceptions
+
+from app import ai_client, ai_providers, metrics
+from app.config import settings
+from app.preprocess import prepare_image
+
+RESULT = {
+    "condition": "Contact dermatitis",
+    "confidence": 0.82,
+    "severity": "MINOR",
+    "steps": ["Wash the area with mild soap and water.", "Apply a cool compress."],
+    "warnings": ["See a doctor if the rash spreads or blisters."],
+}
+
+
+class _TextResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _BlockedResponse:
+    @property
+    def text(self):
+        raise ValueError("response was blocked by safety filters")
+
+
+class FakeAIClient:
+    def __init__(
+        self,
+        latency_ms: float = 800.0,
+        jitter: float = 0.4,
+        rate_limit_rate: float = 0.0,
+        error_rate: float = 0.0,
+        safety_block_rate: float = 0.0,
+        preprocess: bool = True,
+        seed: int = None,
+    ):
+        """
+        latency_ms is the median response time; jitter is the sigma of a
+        log-normal around it, which gives the long right tail real APIs have.
+        The *_rate arguments are per-call probabilities.
+        """
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.safety_block_rate = safety_block_rate
+        self.preprocess = preprocess
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "rate_limited": 0, "errors": 0, "blocked": 0, "ok": 0}
+
+    def _outcome(self):
+        with self._lock:
+            self.counters["calls"] += 1
+            delay = self.latency_ms / 1000 * self._random.lognormvariate(0, self.jitter)
+            roll = self._random.random()
+            if roll < self.rate_limit_rate:
+                outcome = "rate_limited"
+                delay *= 0.05  # quota errors come back fast
+            elif roll < self.rate_limit_rate + self.error_rate:
+                outcome = "errors"
+            elif roll < self.rate_limit_rate + self.error_rate + self.safety_block_rate:
+                outcome = "blocked"
+            else:
+                outcome = "ok"
+            self.counters[outcome] += 1
+        return delay, outcome
+
+    @staticmethod
+    def _response(outcome: str):
+        if outcome == "rate_limited":
+            raise google_exceptions.ResourceExhausted("429 Resource has been exhausted (e.g. check quota).")
+        if outcome == "errors":
+            raise google_exceptions.ServiceUnavailable("503 The model is overloaded. Please try again later.")
+        return _BlockedResponse() if outcome == "blocked" else _TextResponse(json.dumps(RESULT))
+
+    def _prepare(self, file_paths):
+        if self.preprocess and settings.AI_IMAGE_PREPROCESS:
+            for path in file_paths:
+                prepare_image(path)
+
+    async def analyze_many_async(self, file_paths: list) -> dict:
+        # same stages as GeminiClient, so /metrics looks like production
+        with metrics.span("ai_preprocess"):
+            await anyio.to_thread.run_sync(self._prepare, file_paths)
+        delay, outcome = self._outcome()
+        with metrics.span("ai_request"):
+            await asyncio.sleep(delay)
+            response = self._response(outcome)
+        with metrics.span("ai_parse"):
+            return ai_client.parse_response(response)
+
+    async def analyze_async(self, file_path: str) -> dict:
+        return await self.analyze_many_async([file_path])
+
+    def analyze(self, file_path: str) -> dict:
+        self._prepare([file_path])
+        delay, outcome = self._outcome()
+        time.sleep(delay)
+        return ai_client.parse_response(self._response(outcome))
+
+    def warm_up(self):
+        pass
+
+    async def warm_up_async(self):
+        pass
+
+
+class FakeS3Client:
+    """Stores objects as files under `root`/<bucket>/<key>."""
+
+    def __init__(self, root: str, latency_ms: float = 40.0):
+        self.root = root
+        self.latency_ms = latency_ms
+        self.counters = {"uploads": 0, "bytes": 0, "gets": 0, "deletes": 0}
+
+    def _path(self, bucket: str, key: str) -> str:
+        path = os.path.join(self.root, bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _wait(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self._wait()
+        shutil.copyfile(Filename, self._path(Bucket, Key))
+        self.counters["uploads"] += 1
+        self.counters["bytes"] += os.path.getsize(Filename)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._wait()
+        data = Body if isinstance(Body, bytes) else Body.read()
+        with open(self._path(Bucket, Key), "wb") as f:
+            f.write(data)
+        self.counters["uploads"] += 1
+        self.counters["bytes"] += len(data)
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._wait()
+        with open(self._path(Bucket, Key), "rb") as f:
+            data = f.read()
+        self.counters["gets"] += 1
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def head_bucket(self, Bucket, **kwargs):
+        os.makedirs(os.path.join(self.root, Bucket), exist_ok=True)
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        return {"ContentLength": os.path.getsize(self._path(Bucket, Key))}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+        self.counters["deletes"] += 1
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        return "file://" + self._path(Params["Bucket"], Params["Key"])
+
+
+class FakeProvider(ai_providers.Provider):
+    """An extra AI provider backed by its own FakeAIClient, always configured."""
+
+    def __init__(self, name: str, ai: FakeAIClient):
+        super().__init__()
+        self.name = name
+        self.ai = ai
+
+    def configured(self) -> bool:
+        return True
+
+    async def analyze(self, file_paths: list) -> dict:
+        return await self.ai.analyze_many_async(file_paths)
+
+
+def install(ai: FakeAIClient = None, s3_root: str = None, s3_latency_ms: float = 40.0, secondary: FakeAIClient = None):
+    """Plug the stand-ins into the app; returns (ai, s3)."""
+    from app import storage
+
+    ai = ai or FakeAIClient()
+    ai_client.set_client(ai)
+    if secondary is not None:
+        ai_providers.set_providers([ai_providers.GeminiProvider(), FakeProvider("secondary", secondary)])
+    s3 = None
+    if s3_root:
+        s3 = FakeS3Client(s3_root, latency_ms=s3_latency_ms)
+        storage.set_s3_client(s3)
+    return ai, s3
@@ -0,0 +1,75 @@
+"""
+Login storm: many concurrent logins, and authenticated profile reads made
+while that storm is running.
+
+    cd backend && python -m bench.login_storm --requests 100 --concurrency 50
+
+Runs the app in-process against a throwaway SQLite database unless --url
+points at a running server. Prints one JSON object with latency percentiles
+(milliseconds) per phase: logins alone, profile reads alone, and both at once
+("storm"), which shows whether password hashing starves everything else.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import uuid
+
+from bench import common
+
+
+def add_arguments(parser):
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+
+
+async def run(client, args) -> dict:
+    email, password = f"storm-{uuid.uuid4().hex[:8]}@bench.local", "correct horse battery staple"
+    (await client.post("/auth/register", json={"email": email, "password": password})).raise_for_status()
+    form = {"username": email, "password": password}
+    token = (await client.post("/auth/login", data=form)).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def login(c, i):
+        return c.post("/auth/login", data=form)
+
+    def profile(c, i):
+        return c.get("/auth/profile", headers=headers)
+
+    results = {
+        "login": await common.run_load(client, args.requests, args.concurrency, login),
+        "profile": await common.run_load(client, args.requests, args.concurrency, profile),
+    }
+    storm_login, storm_profile = await asyncio.gather(
+        common.run_load(client, args.requests, args.concurrency, login),
+        common.run_load(client, args.requests, args.concurrency, profile),
+    )
+    results["storm"] = {"login": storm_login, "profile": storm_profile}
+    return {
+        "benchmark": "login_storm",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        **results,
+    }
+
+
+async def main_async(args) -> dict:
+    async with common.app_client(args.url) as client:
+        result = await run(client, args)
+    result["memory"] = common.memory()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--url", help="benchmark a running server instead of an in-process app")
+    args = parser.parse_args(argv)
+    if not args.url:
+        common.configure_env()
+    json.dump(asyncio.run(main_async(args)), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
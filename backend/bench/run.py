@@ -0,0 +1,141 @@
+"""
+Run the offline benchmark suite and write a machine-readable report.
+
+    cd backend && python -m bench.run --output bench-results.json
+    cd backend && python -m bench.run --quick --baseline bench-baseline.json
+
+Everything runs in-process: the AI service and S3 are the stand-ins from
+bench/fakes.py, the database is SQLite under --workdir (reuse the directory
+to skip re-seeding the case-listing table). With --baseline, every phase's
+p95/p99 and throughput are compared to the earlier report and the run exits
+with status 1 if any got worse by more than --tolerance. It also exits with
+status 1 if the startup workload is over its import-time budget.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from bench import analyze_burst, case_listing, common, login_storm, startup
+
+WORKLOADS = {
+    "analyze_burst": analyze_burst,
+    "case_listing": case_listing,
+    "login_storm": login_storm,
+    "startup": startup,
+}
+# small enough to finish in a minute or two on a laptop, e.g. in CI
+QUICK = {"requests": 50, "concurrency": 10, "scans": 20_000, "pages": 10}
+# latencies this small are dominated by noise; don't flag them
+MIN_DELTA_MS = 5.0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="comma-separated subset to run")
+    parser.add_argument("--quick", action="store_true", help="small sizes, for CI and smoke runs")
+    parser.add_argument("--workdir", help="directory for the bench database; reused between runs")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (default 0.2)")
+    args, rest = parser.parse_known_args(argv)
+
+    # each workload parses its own options from what is left over
+    options = {}
+    for name in args.workloads.split(","):
+        if name not in WORKLOADS:
+            parser.error(f"unknown workload {name!r}; choose from {', '.join(WORKLOADS)}")
+        sub = argparse.ArgumentParser(prog=name, add_help=False)
+        WORKLOADS[name].add_arguments(sub)
+        if args.quick:
+            sub.set_defaults(**{k: v for k, v in QUICK.items() if sub.get_default(k) is not None})
+        options[name], _ = sub.parse_known_args(rest)
+    return args, options
+
+
+async def run_suite(options: dict, workdir: str) -> dict:
+    if "case_listing" in options:
+        seeded = await asyncio.to_thread(case_listing.seed, options["case_listing"].scans)
+
+    results = {}
+    # the fakes are installed for every workload so nothing reaches the network
+    ai, s3 = analyze_burst.install_fakes(options.get("analyze_burst") or analyze_burst.defaults(), workdir)
+    async with common.app_client() as client:
+        for name, args in options.items():
+            started = time.perf_counter()
+            results[name] = await WORKLOADS[name].run(client, args)
+            results[name]["seconds"] = round(time.perf_counter() - started, 2)
+            results[name]["memory"] = common.memory()
+
+    if "case_listing" in results:
+        results["case_listing"]["seed"] = seeded
+    if "analyze_burst" in results:
+        results["analyze_burst"]["ai"] = ai.counters
+        results["analyze_burst"]["s3"] = s3.counters
+    return results
+
+
+def phases(report: dict, prefix: str = ""):
+    """Yield (path, stats) for every latency summary in a report."""
+    for key, value in report.items():
+        if not isinstance(value, dict):
+            continue
+        path = f"{prefix}{key}"
+        if "p95_ms" in value:
+            yield path, value
+        else:
+            yield from phases(value, path + ".")
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    before = dict(phases(baseline["results"]))
+    regressions = []
+    for path, now in phases(report["results"]):
+        then = before.get(path)
+        if not then:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if now.get(key) is None or then.get(key) is None:
+                continue
+            if now[key] > then[key] * (1 + tolerance) and now[key] - then[key] > MIN_DELTA_MS:
+                regressions.append({"phase": path, "metric": key, "baseline": then[key], "current": now[key]})
+        if now.get("rps") and then.get("rps") and now["rps"] < then["rps"] * (1 - tolerance):
+            regressions.append({"phase": path, "metric": "rps", "baseline": then["rps"], "current": now["rps"]})
+    return regressions
+
+
+def main(argv=None):
+    args, options = parse_args(argv)
+    workdir = common.configure_env(args.workdir)
+
+    report = {
+        "environment": common.environment(),
+        "quick": args.quick,
+        "options": {name: vars(opts) for name, opts in options.items()},
+        "results": asyncio.run(run_suite(options, workdir)),
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        status = 1 if report["regressions"] else 0
+    if report["results"].get("startup", {}).get("over_budget"):
+        status = 1
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    sys.stdout.write(text + "\n")
+    for regression in report.get("regressions", []):
+        sys.stderr.write("REGRESSION {phase} {metric}: {baseline} -> {current}\n".format(**regression))
+    if report["results"].get("startup", {}).get("over_budget"):
+        result = report["results"]["startup"]
+        sys.stderr.write(f"STARTUP import p95 {result['import']['p95_ms']}ms (budget {result['budget_ms']}ms), "
+                         f"eagerly loaded: {', '.join(result['eager_sdks']) or 'none'}\n")
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
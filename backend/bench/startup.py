@@ -0,0 +1,93 @@
+"""
+Startup: how long `import app.main` takes in a fresh interpreter, which is
+most of a cold start (and all of it for every gunicorn worker without preload).
+
+    cd backend && python -m bench.startup --runs 5 --budget-ms 2000
+
+Prints the import time over --runs fresh processes, the top-level packages
+that cost the most (from `python -X importtime`), and any SDK that should
+only be loaded on first use but was imported anyway. When run through
+bench.run, the suite exits with status 1 if the p95 import time is over
+--budget-ms or a lazy SDK was loaded eagerly.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+
+from bench import common
+
+# loaded on first use by ai_client, storage, preprocess, geo and export
+LAZY = ("google.generativeai", "google.api_core", "boto3", "botocore", "PIL", "numpy", "pyarrow")
+PROBE = f"""
+import sys, time
+started = time.perf_counter()
+import app.main
+print(time.perf_counter() - started)
+print(",".join(m for m in {LAZY!r} if m in sys.modules))
+"""
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_arguments(parser):
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=2000.0)
+    parser.add_argument("--top", type=int, default=10)
+
+
+def _python(*args) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], cwd=BACKEND, env=os.environ.copy(),
+                          capture_output=True, text=True, check=True)
+
+
+def _top_packages(stderr: str, limit: int) -> list:
+    """Self time per top-level package, from -X importtime output."""
+    totals = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        totals[name.strip().split(".")[0]] += int(self_us)
+    return [{"package": name, "ms": round(us / 1000, 1)} for name, us in totals.most_common(limit)]
+
+
+def measure(args) -> dict:
+    samples, eager = [], set()
+    for _ in range(args.runs):
+        seconds, loaded = _python("-c", PROBE).stdout.splitlines()[-2:]
+        samples.append(float(seconds))
+        eager.update(filter(None, loaded.split(",")))
+    top = _top_packages(_python("-X", "importtime", "-c", "import app.main").stderr, args.top)
+    summary = common.percentiles(samples)
+    return {
+        "benchmark": "startup",
+        "runs": args.runs,
+        "budget_ms": args.budget_ms,
+        "import": summary,
+        "top_packages": top,
+        "eager_sdks": sorted(eager),
+        "over_budget": summary["p95_ms"] > args.budget_ms or bool(eager),
+    }
+
+
+async def run(client, args) -> dict:
+    # the in-process client is not used; every sample is a new interpreter
+    return await asyncio.to_thread(measure, args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    common.configure_env()
+    result = measure(args)
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    sys.exit(1 if result["over_budget"] else 0)
+
+
+if __name__ == "__main__":
+    main()
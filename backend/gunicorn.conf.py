@@ -0,0 +1,23 @@
+"""
+Production serving: WEB_CONCURRENCY uvicorn workers under gunicorn.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The app is imported once in the master (preload_app) and the workers are
+forked from it, so they start without importing it again. Each worker runs the
+startup handlers itself and answers GET /ready once it is warmed up. On
+SIGTERM every worker stops being ready and ends its case streams, then has
+GRACEFUL_TIMEOUT_SECONDS to finish in-flight requests.
+"""
+from app.config import settings
+
+bind = f"0.0.0.0:{settings.PORT}"
+workers = settings.WEB_CONCURRENCY
+worker_class = "app.gunicorn_worker.Worker"
+preload_app = True
+graceful_timeout = settings.GRACEFUL_TIMEOUT_SECONDS
+# a worker that stops heartbeating for this long is killed and replaced
+timeout = settings.WORKER_TIMEOUT_SECONDS
+keepalive = 5
+# the app logs every request itself (see app/metrics.py)
+accesslog = None
@@ -4,4 +4,5 @@ set -e
 echo "Running Alembic migrations..."
 alembic upgrade head
 echo "Migrations complete. Starting server..."
-exec uvicorn app.main:app --host 0.0.0.0 --port 8000
+# WEB_CONCURRENCY workers, preloaded, with graceful shutdown (see gunicorn.conf.py)
+exec gunicorn -c gunicorn.conf.py app.main:app
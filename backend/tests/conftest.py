@@ -0,0 +1,66 @@
+"""
+Shared fixtures. The app is pointed at a throwaway SQLite database and upload
+directory before anything under app/ is imported, and no test reaches Gemini
+or S3.
+
+    cd backend && pytest
+"""
+import os
+import tempfile
+
+WORKDIR = tempfile.mkdtemp(prefix="vaidra-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+    "UPLOAD_DIR": os.path.join(WORKDIR, "uploads"),
+    "GEMINI_API_KEY": "",
+    "PERPLEXITY_API_KEY": "",
+    "GEMINI_WARM_UP": "false",
+    "S3_WARM_UP": "false",
+    "USE_S3": "false",
+    "BLOB_LIFECYCLE_INTERVAL_SECONDS": "0",
+    "LOG_LEVEL": "WARNING",
+})
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+from app import models, utils  # noqa: E402
+from app.db import AsyncSessionLocal, Base, SessionLocal, engine  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+async def db():
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+async def client():
+    from app.main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+        yield c
+
+
+@pytest.fixture
+def make_user():
+    """Create a user with the given role; returns (user id, Authorization headers)."""
+
+    def make(role: str = "CITIZEN"):
+        with SessionLocal() as session:
+            user = models.User(email=f"{os.urandom(6).hex()}@tests.local", hashed_password="x", role=role)
+            session.add(user)
+            session.commit()
+            return user.id, {"Authorization": f"Bearer {utils.create_access_token(str(user.id))}"}
+
+    return make
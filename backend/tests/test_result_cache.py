@@ -0,0 +1,56 @@
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+from app import models, result_cache
+from app.db import AsyncSessionLocal
+
+pytestmark = pytest.mark.anyio
+
+RESULT = {"condition": "Eczema", "confidence": 80.0, "severity": "MINOR", "steps": ["a"], "warnings": []}
+
+
+def image_sha():
+    return uuid.uuid4().hex * 2
+
+
+async def test_miss_then_hit(db):
+    sha = image_sha()
+    assert await result_cache.get(db, sha) is None
+    await result_cache.put(db, sha, {**RESULT, "fallback": False})
+    assert await result_cache.get(db, sha) == RESULT
+    entry = await db.get(models.AnalysisCache, result_cache.cache_key(sha))
+    assert entry.hits == 1
+
+
+async def test_put_overwrites_existing_entry(db):
+    sha = image_sha()
+    await result_cache.put(db, sha, RESULT)
+    await result_cache.put(db, sha, {**RESULT, "condition": "Psoriasis"})
+    assert (await result_cache.get(db, sha))["condition"] == "Psoriasis"
+
+
+async def test_expired_entry_is_a_miss(db, monkeypatch):
+    sha = image_sha()
+    await result_cache.put(db, sha, RESULT)
+    monkeypatch.setattr(result_cache.settings, "ANALYSIS_CACHE_TTL_SECONDS", -1)
+    assert await result_cache.get(db, sha) is None
+    assert await db.get(models.AnalysisCache, result_cache.cache_key(sha)) is None
+
+
+async def test_concurrent_puts_for_the_same_image(db):
+    # two misses for one image (a retried upload) both store their result
+    sha = image_sha()
+
+    async def put(result):
+        async with AsyncSessionLocal() as session:
+            await result_cache.put(session, sha, result)
+
+    await asyncio.gather(put(RESULT), put({**RESULT, "condition": "Psoriasis"}))
+    count = await db.scalar(
+        select(func.count()).select_from(models.AnalysisCache).where(models.AnalysisCache.image_sha256 == sha)
+    )
+    assert count == 1
+    assert (await result_cache.get(db, sha))["condition"] in ("Eczema", "Psoriasis")
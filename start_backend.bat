@@ -1,5 +1,6 @@
 @echo off
 echo Starting Backend...
 cd backend
+python -m alembic upgrade head
 python -m uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload
 pause